@@ -1,18 +1,32 @@
 import streamlit as st
 import pandas as pd
-from database import get_db
+from database import db_session, pool_stats
 from services.note_service import NoteService
-from services.ai_service import AIService
+from services.ai_service import get_ai_service, AIProviderError
+from services.embedding_cache import get_embedding_cache
+from services.result_cache import get_result_cache
+from services.note_events import latest_event_id, read_status_events
+from services.metrics import APP_RENDER_SECONDS, start_metrics_server
 from config import Config
 import time
+import datetime
 import os
 
+render_start = time.perf_counter()
+# Once per process; Streamlit reruns this script on every interaction
+start_metrics_server(Config.METRICS_PORT, Config.METRICS_HOST)
+
+@st.cache_resource
+def get_queue():
+    """RQ queue for notes saved here, on the shared Redis connection pool, built once per process."""
+    from rq import Queue
+    from database import redis_binary_client
+    from worker import INTERACTIVE_QUEUE
+    return Queue(INTERACTIVE_QUEUE, connection=redis_binary_client)
+
 # Try to setup RQ
 try:
-    from redis import Redis
-    from rq import Queue
-    redis_conn = Redis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, db=Config.REDIS_DB, password=Config.REDIS_PASSWORD)
-    q = Queue(connection=redis_conn)
+    q = get_queue()
     USE_RQ = True
 except (ImportError, Exception) as e:
     print(f"RQ/Redis not available: {e}")
@@ -21,10 +35,10 @@ except (ImportError, Exception) as e:
 # Page Config
 st.set_page_config(page_title="Smart Knowledge Hub", layout="wide", page_icon="🧠")
 
-# Initialize Services
-db = next(get_db())
-note_service = NoteService(db)
-ai_service = AIService()
+# Initialize Services: the session proxy resolves to this thread's session, released at the end of the run
+# (and here, in case the previous run on this thread stopped early, e.g. on st.rerun())
+db_session.remove()
+note_service = NoteService(db_session)
 
 # Sidebar
 st.sidebar.title("🧠 Knowledge Hub")
@@ -33,16 +47,15 @@ st.sidebar.title("🧠 Knowledge Hub")
 st.sidebar.subheader("⚙️ Settings")
 ai_provider = st.sidebar.selectbox(
     "AI Provider", 
-    ["openai", "gemini", "claude"], 
-    index=["openai", "gemini", "claude"].index(Config.AI_PROVIDER) if Config.AI_PROVIDER in ["openai", "gemini", "claude"] else 0
+    ["openai", "gemini", "claude", "local"], 
+    index=["openai", "gemini", "claude", "local"].index(Config.AI_PROVIDER) if Config.AI_PROVIDER in ["openai", "gemini", "claude", "local"] else 0
 )
 
-# Update config if changed (Note: This is per session/rerun, doesn't persist to .env)
-# In a real app, you might want to reload the AIService or update a singleton config
+# Update config if changed (Note: This is per process, doesn't persist to .env or reach the workers)
 if ai_provider != Config.AI_PROVIDER:
     Config.AI_PROVIDER = ai_provider
-    # Re-initialize AI service
-    ai_service = AIService()
+# Built once per provider and process, with its SDK imported on first use
+ai_service = get_ai_service(ai_provider)
 
 page = st.sidebar.radio("Navigate", ["Knowledge Base", "Recycle Bin"])
 
@@ -53,12 +66,178 @@ if USE_RQ:
 else:
     st.sidebar.warning("Async Worker: Inactive (Sync Mode)")
 
-# Simple Auto-cleanup trigger check
+# Status events from the workers, read from where this session started
+if USE_RQ and "events_from" not in st.session_state:
+    try:
+        st.session_state.events_from = latest_event_id()
+    except Exception as e:
+        print(f"Status events unavailable: {e}")
+st.session_state.note_patches = {}  # fresh rows of notes changed since this run's query
+
+cache_stats = get_embedding_cache().report()
+try:
+    from database import redis_client
+    dedup_stats = redis_client.hgetall("enrichment:stats")
+    st.sidebar.caption(f"AI dedup: {dedup_stats.get('dedup_hits', 0)} notes reused existing results")
+    purge_stats = redis_client.hgetall("retention:last_run")
+    if purge_stats:
+        st.sidebar.caption(
+            f"Last purge: {purge_stats['rows']} notes, {float(purge_stats['lock_seconds']):.2f}s holding locks "
+            f"({time.strftime('%Y-%m-%d %H:%M', time.localtime(float(purge_stats['finished_at'])))})"
+        )
+except Exception:
+    pass
+st.sidebar.caption(f"Search embedding space: {note_service.active_space() or 'none (no embedding API configured)'}")
+st.sidebar.caption(
+    f"Query cache: {cache_stats['hit_rate']:.0%} hits, "
+    f"{int(cache_stats['api_calls_saved'])} API calls / ~{cache_stats['seconds_saved']:.1f}s saved"
+)
+st.sidebar.caption(f"Result cache (this process): {get_result_cache().report()['hit_rate']:.0%} hits")
+db_pool = pool_stats()
+if db_pool:
+    st.sidebar.caption(
+        f"DB pool: {db_pool['in_use']} in use, {db_pool['idle']} idle of {db_pool['size']}"
+        + (f" (+{db_pool['overflow']} overflow)" if db_pool['overflow'] else "")
+    )
+
+def request_purge(everything: bool = False):
+    """Hand the purge to the workers; without them (sync mode) run it here, still in small batches."""
+    if USE_RQ:
+        from worker import request_purge as enqueue_purge
+        enqueue_purge(everything)
+        return None
+    from worker import purge_deleted_notes
+    return purge_deleted_notes(None if everything else Config.RETENTION_DAYS)
+
 if st.sidebar.button("Run Auto-Cleanup"):
-    note_service.cleanup_old_deleted_notes()
-    st.sidebar.success("Cleanup executed.")
+    report = request_purge()
+    if report is None:
+        st.sidebar.success("Cleanup requested; a worker will purge expired notes shortly.")
+    else:
+        st.sidebar.success(f"Cleanup executed: {report['rows']} notes purged.")
+
+IN_FLIGHT = ("pending", "processing")
+# Seconds between checks for status events while shown notes await the workers; None without Redis
+STATUS_REFRESH = Config.STATUS_REFRESH_SECONDS if "events_from" in st.session_state else None
+
+def patched_notes(notes):
+    """notes, with fresh rows swapped in for those the workers published a status change for."""
+    try:
+        st.session_state.events_from, statuses = read_status_events(st.session_state.events_from)
+    except Exception as e:
+        print(f"Could not read status events: {e}")
+        return notes
+    shown = {note.id for note in notes}
+    changed = [note_id for note_id in statuses if note_id in shown]
+    if changed:
+        for row in note_service.get_note_summaries(changed):
+            st.session_state.note_patches[row.id] = row
+    return [st.session_state.note_patches.get(note.id, note) for note in notes]
+
+def show_notes(notes, matched_passages, view_mode):
+    """
+    The note cards / table. Runs as a fragment that re-runs on its own every
+    STATUS_REFRESH seconds while notes are in flight, patching only the changed ones.
+    """
+    if STATUS_REFRESH:
+        notes = patched_notes(notes)
+    if view_mode == "Cards":
+        try:
+            # Precomputed by the workers: one read for every card on the page
+            related = note_service.get_related_notes([note.id for note in notes])
+        except Exception as e:
+            print(f"Related notes unavailable: {e}")
+            db_session.rollback()
+            related = {}
+        cols = st.columns(3)
+        for i, note in enumerate(notes):
+            with cols[i % 3]:
+                with st.container(border=True):
+                    # Status Badge
+                    if hasattr(note, 'status'):
+                        if note.status == 'pending':
+                            st.caption("🕓 Waiting for AI...")
+                        elif note.status == 'processing':
+                            st.caption("⏳ Processing AI...")
+                        elif note.status == 'failed':
+                            st.caption("❌ AI Failed")
+                        
+                    st.markdown(f"**{note.category or 'Uncategorized'}**")
+                    st.caption(note.created_at.strftime("%Y-%m-%d %H:%M"))
+                    st.text(note.preview[:150] + ("..." if len(note.preview) > 150 else ""))
+                    if note.id in matched_passages:
+                        # Long note: show the passage that matched the query
+                        passage = matched_passages[note.id]
+                        st.caption("Matching passage")
+                        st.text(passage[:300] + ("..." if len(passage) > 300 else ""))
+                    if note.tags:
+                        st.markdown(" ".join([f"`#{tag}`" for tag in note.tags]))
+                    if related.get(note.id):
+                        closest = related[note.id][0]
+                        if closest.score >= Config.NEAR_DUPLICATE_SCORE:
+                            st.caption(f"♊ Possible duplicate of #{closest.neighbor_id}")
+                        with st.expander("Related notes"):
+                            for item in related[note.id]:
+                                st.caption(f"#{item.neighbor_id} · {item.score:.0%} similar")
+                                st.text(item.preview[:80] + ("..." if len(item.preview) > 80 else ""))
+                        
+                    if st.button("🗑️", key=f"del_{note.id}", help="Move to Recycle Bin"):
+                        note_service.soft_delete_notes([note.id])
+                        st.rerun()
+
+    elif view_mode == "Table":
+        data = []
+        for note in notes:
+            status = getattr(note, 'status', 'unknown')
+            data.append({
+                "Select": False,
+                "ID": note.id,
+                "Content": note.preview[:150] + ("..." if len(note.preview) > 150 else ""),
+                "Category": note.category,
+                "Tags": str(note.tags),
+                "Status": status,
+                "Created At": note.created_at
+            })
+            
+        df = pd.DataFrame(data)
+            
+        edited_df = st.data_editor(
+            df,
+            column_config={
+                "Select": st.column_config.CheckboxColumn("Select", default=False),
+                "ID": st.column_config.NumberColumn("ID", disabled=True),
+                "Content": st.column_config.TextColumn("Content", disabled=True),
+                "Category": st.column_config.TextColumn("Category", disabled=True),
+                "Tags": st.column_config.TextColumn("Tags", disabled=True),
+                "Status": st.column_config.TextColumn("Status", disabled=True),
+                "Created At": st.column_config.DatetimeColumn("Created At", disabled=True),
+            },
+            hide_index=True,
+            use_container_width=True,
+            key="editor_active"
+        )
+            
+        selected_indices = edited_df[edited_df["Select"]].index
+        if not selected_indices.empty:
+            st.warning(f"Selected {len(selected_indices)} notes.")
+            if st.button("🗑️ Batch Delete"):
+                selected_ids = edited_df[edited_df["Select"]]["ID"].tolist()
+                note_service.soft_delete_notes(selected_ids)
+                st.session_state.flash = f"Moved {len(selected_ids)} notes to Recycle Bin."
+                st.rerun()
+
+def notes_fragment(notes, matched_passages, view_mode):
+    # Fragment reruns skip the end of the script, so release the session here too
+    try:
+        show_notes(notes, matched_passages, view_mode)
+    finally:
+        db_session.remove()
 
 # Main Content
+# Set by actions that st.rerun() right away, which would clear their st.success before it is seen
+if "flash" in st.session_state:
+    st.success(st.session_state.pop("flash"))
+
 if page == "Knowledge Base":
     st.title("📚 Knowledge Base")
 
@@ -77,120 +256,124 @@ if page == "Knowledge Base":
                 # 2. AI Processing
                 if USE_RQ:
                     try:
-                        from worker import process_note_ai
-                        q.enqueue(process_note_ai, note.id)
+                        if Config.WORKER_MODE in ("batch", "async"):
+                            from worker import enqueue_enrichment, INTERACTIVE_QUEUE
+                            enqueue_enrichment([note.id], queue=INTERACTIVE_QUEUE)
+                        else:
+                            from worker import process_note_ai, job_retry
+                            q.enqueue(process_note_ai, note.id, retry=job_retry())
                         st.success("Note saved! AI processing running in background.")
                     except Exception as e:
                         st.error(f"Failed to enqueue task: {e}")
                 else:
                     with st.spinner('AI Processing (Classifying & Embedding)...'):
-                        ai_data = ai_service.classify_and_tag(content_input)
-                        embedding = ai_service.generate_embedding(content_input)
-                        
-                        note_service.update_note_ai_data(
-                            note_id=note.id,
-                            category=ai_data.get("category"),
-                            tags=ai_data.get("tags"),
-                            embedding=embedding
-                        )
-                        note_service.update_note_status(note.id, "completed")
-                    st.success("Note saved and processed!")
-                
-                time.sleep(1)
-                st.rerun()
+                        from worker import enrich_note
+                        try:
+                            enrich_note(note_service, ai_service, note)
+                            st.success("Note saved and processed!")
+                        except AIProviderError as e:
+                            note_service.update_note_status(note.id, "failed")
+                            st.error(f"Note saved, but AI processing failed: {e}")
 
     st.markdown("---")
 
     # 2. Search & Filter Section
-    col_search, col_view = st.columns([3, 1])
-    search_query = col_search.text_input("🔍 Semantic Search", placeholder="Search by meaning...")
+    col_search, col_mode, col_view = st.columns([3, 1, 1])
+    search_query = col_search.text_input("🔍 Search", placeholder="Search by meaning, keywords or error codes...")
+    search_modes = ["hybrid", "semantic", "keyword"]
+    search_mode = col_mode.selectbox(
+        "Search Mode",
+        search_modes,
+        index=search_modes.index(Config.SEARCH_MODE) if Config.SEARCH_MODE in search_modes else 0
+    )
     view_mode = col_view.radio("View Mode", ["Cards", "Table"], horizontal=True)
 
-    # 3. Data Retrieval
+    # Metadata filters (indexed in SQL, applied before any search scoring)
+    with st.expander("Filters"):
+        col_category, col_tags, col_dates = st.columns([1, 2, 2])
+        filter_category = col_category.selectbox("Category", ["All"] + note_service.get_categories())
+        filter_tags = col_tags.multiselect("Tags (match all)", note_service.get_popular_tags())
+        filter_dates = col_dates.date_input("Created between", value=[])
+    filters = {}
+    if filter_category != "All":
+        filters["category"] = filter_category
+    if filter_tags:
+        filters["tags"] = filter_tags
+    if len(filter_dates) == 2:
+        filters["date_from"] = datetime.datetime.combine(filter_dates[0], datetime.time())
+        filters["date_to"] = datetime.datetime.combine(filter_dates[1], datetime.time()) + datetime.timedelta(days=1)
+
+    # 3. Data Retrieval (projected rows only: no embeddings, content cut to a preview)
+    next_cursor = None
+    matched_passages = {}
     if search_query:
-        active_notes = note_service.get_active_notes()
-        notes = ai_service.search_similar(search_query, active_notes)
+        def run_search():
+            note_service.ensure_search_index()
+            passages = {}
+            results = ai_service.search_note_ids(
+                search_query, mode=search_mode, passages=passages,
+                allowed_ids=note_service.filter_note_ids(filters)
+            )
+            # The query is embedded in the active space, not necessarily by the sidebar's provider
+            try:
+                semantic = ai_service.for_space(note_service.active_space()).embedding_available()
+            except AIProviderError:
+                semantic = False
+            degraded = search_mode != "keyword" and not semantic
+            return results, passages, degraded
+
+        # Served from the result cache until the next write; keyword-only fallbacks aren't kept
+        results, matched_passages, degraded = get_result_cache().get_or_compute(
+            "search", (search_query, search_mode, ai_service.provider, filters), run_search,
+            keep=lambda value: not value[2]
+        )
+        if degraded:
+            st.caption("Embedding provider unavailable, showing keyword matches only.")
+        notes = note_service.get_note_summaries([note_id for note_id, score in results])
+        passage_texts = note_service.get_passage_texts([matched_passages[note.id] for note in notes if note.id in matched_passages])
+        matched_passages = {note_id: passage_texts[chunk_id] for note_id, chunk_id in matched_passages.items() if chunk_id in passage_texts}
         st.caption(f"Found {len(notes)} relevant results.")
     else:
-        notes = note_service.get_active_notes()
-        st.caption(f"Showing all {len(notes)} notes.")
+        # Keyset pagination: remember the (created_at, id) cursor that starts each visited page
+        filter_key = repr(sorted(filters.items()))
+        if "page_cursors" not in st.session_state or st.session_state.get("page_filters") != filter_key:
+            st.session_state.page_cursors = [None]
+            st.session_state.page_filters = filter_key
+        notes, next_cursor = note_service.get_active_notes_page(
+            limit=Config.PAGE_SIZE,
+            cursor=st.session_state.page_cursors[-1],
+            filters=filters
+        )
+        page_no = len(st.session_state.page_cursors)
+        st.caption(f"Showing {len(notes)} of {note_service.count_active_notes(filters)} notes (page {page_no}).")
 
     # 4. Display Section
     if not notes:
         st.info("No notes found. Start by adding one above!")
     else:
-        if view_mode == "Cards":
-            cols = st.columns(3)
-            for i, note in enumerate(notes):
-                with cols[i % 3]:
-                    with st.container(border=True):
-                        # Status Badge
-                        if hasattr(note, 'status'):
-                            if note.status == 'processing':
-                                st.caption("⏳ Processing AI...")
-                            elif note.status == 'failed':
-                                st.caption("❌ AI Failed")
-                        
-                        st.markdown(f"**{note.category or 'Uncategorized'}**")
-                        st.caption(note.created_at.strftime("%Y-%m-%d %H:%M"))
-                        st.text(note.content[:150] + ("..." if len(note.content) > 150 else ""))
-                        if note.tags:
-                            st.markdown(" ".join([f"`#{tag}`" for tag in note.tags]))
-                        
-                        if st.button("🗑️", key=f"del_{note.id}", help="Move to Recycle Bin"):
-                            note_service.soft_delete_notes([note.id])
-                            st.rerun()
-
-        elif view_mode == "Table":
-            data = []
-            for note in notes:
-                status = getattr(note, 'status', 'unknown')
-                data.append({
-                    "Select": False,
-                    "ID": note.id,
-                    "Content": note.content,
-                    "Category": note.category,
-                    "Tags": str(note.tags),
-                    "Status": status,
-                    "Created At": note.created_at
-                })
-            
-            df = pd.DataFrame(data)
-            
-            edited_df = st.data_editor(
-                df,
-                column_config={
-                    "Select": st.column_config.CheckboxColumn("Select", default=False),
-                    "ID": st.column_config.NumberColumn("ID", disabled=True),
-                    "Content": st.column_config.TextColumn("Content", disabled=True),
-                    "Category": st.column_config.TextColumn("Category", disabled=True),
-                    "Tags": st.column_config.TextColumn("Tags", disabled=True),
-                    "Status": st.column_config.TextColumn("Status", disabled=True),
-                    "Created At": st.column_config.DatetimeColumn("Created At", disabled=True),
-                },
-                hide_index=True,
-                use_container_width=True,
-                key="editor_active"
-            )
-            
-            selected_indices = edited_df[edited_df["Select"]].index
-            if not selected_indices.empty:
-                st.warning(f"Selected {len(selected_indices)} notes.")
-                if st.button("🗑️ Batch Delete"):
-                    selected_ids = edited_df[edited_df["Select"]]["ID"].tolist()
-                    note_service.soft_delete_notes(selected_ids)
-                    st.success(f"Moved {len(selected_ids)} notes to Recycle Bin.")
-                    time.sleep(1)
-                    st.rerun()
+        refresh = STATUS_REFRESH if any(note.status in IN_FLIGHT for note in notes) else None
+        st.fragment(run_every=refresh)(notes_fragment)(notes, matched_passages, view_mode)
+
+    # 5. Pagination
+    if not search_query and (next_cursor or len(st.session_state.page_cursors) > 1):
+        col_prev, col_next, _ = st.columns([1, 1, 4])
+        if len(st.session_state.page_cursors) > 1 and col_prev.button("⬅️ Previous"):
+            st.session_state.page_cursors.pop()
+            st.rerun()
+        if next_cursor and col_next.button("Next ➡️"):
+            st.session_state.page_cursors.append(next_cursor)
+            st.rerun()
 
 elif page == "Recycle Bin":
     st.title("♻️ Recycle Bin")
-    st.caption("Items here are deleted automatically after 30 days.")
+    st.caption(f"Items here are deleted automatically after {Config.RETENTION_DAYS} days.")
 
     col_empty_bin, _ = st.columns([1, 5])
     if col_empty_bin.button("🔥 Empty Recycle Bin"):
-        note_service.empty_recycle_bin()
-        st.success("Recycle Bin emptied.")
+        if request_purge(everything=True) is None:
+            st.session_state.flash = "Emptying the Recycle Bin in the background."
+        else:
+            st.session_state.flash = "Recycle Bin emptied."
         st.rerun()
 
     deleted_notes = note_service.get_deleted_notes()
@@ -232,15 +415,14 @@ elif page == "Recycle Bin":
             with col_restore:
                 if st.button(f"♻️ Restore ({len(selected_ids)})"):
                     note_service.restore_notes(selected_ids)
-                    st.success("Notes restored.")
-                    time.sleep(1)
+                    st.session_state.flash = "Notes restored."
                     st.rerun()
             
             with col_hard_delete:
                 if st.button(f"❌ Permanently Delete ({len(selected_ids)})"):
                     note_service.hard_delete_notes(selected_ids)
-                    st.success("Notes permanently deleted.")
-                    time.sleep(1)
+                    st.session_state.flash = "Notes permanently deleted."
                     st.rerun()
 
-db.close()
+APP_RENDER_SECONDS.observe(time.perf_counter() - render_start, page=page)
+db_session.remove()
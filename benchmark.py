@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import platform
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from config import Config
+import database
+from database import Base, get_db
+from models import KnowledgeNote, EmbeddingSpace
+from services.fake_ai import FakeAIService, FAKE_CATEGORIES
+from services import result_cache
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_DATABASE_URL = "sqlite:///data/benchmark.db"
+SYLLABLES = ["ka", "ri", "to", "men", "sa", "lo", "vi", "dex", "pra", "nu", "zel", "qui", "bor", "tan", "fe", "ly"]
+
+
+def summarize(seconds: list):
+    """Latency distribution of a list of durations, in milliseconds."""
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {
+        "count": int(ms.shape[0]),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KiB on Linux, bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+class SyntheticCorpus:
+    """
+    Deterministic notes drawn from a Zipf-distributed pseudo-word vocabulary,
+    so BM25 and the fake embeddings see realistic term skew. Lengths are
+    log-normal; a few percent of notes are long enough to be split into passages.
+    """
+
+    def __init__(self, seed: int = 0, vocab_size: int = 20000, mean_words: int = 60):
+        self.rng = np.random.default_rng(seed)
+        self.mean_words = mean_words
+        self.vocab = []
+        seen = set()
+        while len(self.vocab) < vocab_size:
+            word = "".join(self.rng.choice(SYLLABLES, size=self.rng.integers(2, 5)))
+            if word not in seen:
+                seen.add(word)
+                self.vocab.append(word)
+        weights = 1.0 / np.arange(1, vocab_size + 1) ** 1.1
+        self.weights = weights / weights.sum()
+
+    def note(self, now):
+        length = int(np.clip(self.rng.lognormal(np.log(self.mean_words), 0.6), 5, 2000))
+        words = [self.vocab[i] for i in self.rng.choice(len(self.vocab), size=length, p=self.weights)]
+        sentences = [" ".join(words[i:i + 12]) for i in range(0, length, 12)]
+        age = datetime.timedelta(seconds=int(self.rng.integers(0, 730 * 86400)))
+        return {"content": ". ".join(sentences) + ".", "created_at": now - age}
+
+    def query(self):
+        # Mid-frequency words: common enough to match, rare enough to be selective
+        picks = self.rng.integers(20, min(5000, len(self.vocab)), size=self.rng.integers(2, 5))
+        return " ".join(self.vocab[i] for i in picks)
+
+
+def connect(url: str, reset: bool):
+    """Point database.get_db at the benchmark database and recreate the schema."""
+    if url.startswith("sqlite"):
+        path = url.split(":///", 1)[-1]
+        if path and path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        engine = create_engine(url, connect_args={"check_same_thread": False})
+    else:
+        if not reset:
+            raise SystemExit("The benchmark drops and recreates every table; pass --reset to use this database.")
+        engine = create_engine(url, pool_recycle=3600, pool_size=10)
+    database.engine = engine
+    database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def bench_ingest(corpus: SyntheticCorpus, notes: int, batch_size: int):
+    from services.note_service import NoteService
+
+    db = next(get_db())
+    try:
+        note_service = NoteService(db)
+        now = datetime.datetime.now()
+        inserted, batches = 0, []
+        start = time.perf_counter()
+        while inserted < notes:
+            records = [corpus.note(now) for _ in range(min(batch_size, notes - inserted))]
+            seconds, ids = timed(note_service.bulk_create_notes, records)
+            batches.append(seconds)
+            inserted += len(records)
+        elapsed = time.perf_counter() - start
+        return {
+            "notes": inserted,
+            "seconds": round(elapsed, 3),
+            # Generating the synthetic text is excluded
+            "notes_per_second": round(inserted / sum(batches), 1),
+            "batch": summarize(batches),
+        }
+    finally:
+        db.close()
+
+
+def redis_available():
+    try:
+        return bool(database.redis_client.ping())
+    except Exception:
+        return False
+
+
+def bench_enrichment(ai_service: FakeAIService, sample: int, workers: int, use_redis: bool = True):
+    """Enrich `sample` pending notes through worker.process_note_ai, as the RQ worker does."""
+    import worker
+
+    logging.getLogger(worker.__name__).setLevel(logging.ERROR)
+    if not use_redis:
+        # Dedup counters and status events are best-effort; without a server every write waits out the reconnect backoff
+        worker.record_enrichment_stat = lambda field, amount=1: None
+        worker.publish_status = lambda note_ids, status: None
+    db = next(get_db())
+    try:
+        note_ids = [row[0] for row in db.query(KnowledgeNote.id).filter(
+            KnowledgeNote.status == "pending"
+        ).order_by(KnowledgeNote.id).limit(sample)]
+    finally:
+        db.close()
+
+    def run(note_id):
+        return timed(worker.process_note_ai, note_id, ai_service=ai_service)[0]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        per_note = list(pool.map(run, note_ids))
+    elapsed = time.perf_counter() - start
+    return {
+        "notes": len(note_ids),
+        "workers": workers,
+        "provider_latency_ms": ai_service.latency * 1000,
+        "notes_per_second": round(len(note_ids) / elapsed, 1) if elapsed else None,
+        "note": summarize(per_note),
+    }
+
+
+def fill_enrichment(ai_service: FakeAIService, batch_size: int):
+    """Enrich the remaining notes in batches without provider latency (setup, not measured)."""
+    from services.note_service import NoteService
+
+    db = next(get_db())
+    try:
+        note_service = NoteService(db)
+        after_id = 0
+        while True:
+            rows = db.query(KnowledgeNote.id, KnowledgeNote.content).filter(
+                KnowledgeNote.id > after_id, KnowledgeNote.status == "pending"
+            ).order_by(KnowledgeNote.id).limit(batch_size).all()
+            if not rows:
+                break
+            embedded = ai_service.embed_notes([content for _, content in rows])
+            note_service.save_ai_results([{
+                "note_id": note_id, "embedding": embedding, "passages": passages,
+                "embedding_model": ai_service.embedding_model, "ai_provider": ai_service.embedding_provider,
+                **ai_service.classify_and_tag(content)
+            } for (note_id, content), (embedding, passages) in zip(rows, embedded)])
+            after_id = rows[-1][0]
+    finally:
+        db.close()
+
+
+def bench_search(corpus: SyntheticCorpus, ai_service: FakeAIService, queries: int, top_k: int):
+    from services.note_service import NoteService
+
+    db = next(get_db())
+    try:
+        note_service = NoteService(db)
+        texts = [corpus.query() for _ in range(queries)]
+        results = {}
+        for mode in ("keyword", "semantic", "hybrid"):
+            results[mode] = summarize([
+                timed(ai_service.search_note_ids, text, top_k=top_k, mode=mode)[0] for text in texts
+            ])
+
+        # Metadata pre-filter + hybrid search, timed together as the app runs them
+        date_from = datetime.datetime.now() - datetime.timedelta(days=180)
+
+        def filtered(text, category):
+            allowed = note_service.filter_note_ids({"category": category, "date_from": date_from})
+            return ai_service.search_note_ids(text, top_k=top_k, allowed_ids=allowed, mode="hybrid")
+
+        results["hybrid_filtered"] = summarize([
+            timed(filtered, text, FAKE_CATEGORIES[i % len(FAKE_CATEGORIES)])[0] for i, text in enumerate(texts)
+        ])
+        return results
+    finally:
+        db.close()
+
+
+def bench_listing(repeats: int, deep_pages: int = 10):
+    from services.note_service import NoteService
+
+    db = next(get_db())
+    try:
+        note_service = NoteService(db)
+        tag = (note_service.get_popular_tags(limit=1) or [None])[0]
+        timings = {"first_page": [], "deep_page": [], "count": [], "category_page": [], "tag_page": []}
+        for i in range(repeats):
+            category = FAKE_CATEGORIES[i % len(FAKE_CATEGORIES)]
+            timings["first_page"].append(timed(note_service.get_active_notes_page, limit=Config.PAGE_SIZE)[0])
+            cursor = None
+            for _ in range(deep_pages):
+                seconds, (rows, cursor) = timed(note_service.get_active_notes_page, limit=Config.PAGE_SIZE, cursor=cursor)
+                if cursor is None:
+                    break
+            timings["deep_page"].append(seconds)
+            timings["count"].append(timed(note_service.count_active_notes)[0])
+            timings["category_page"].append(timed(
+                note_service.get_active_notes_page, limit=Config.PAGE_SIZE, filters={"category": category}
+            )[0])
+            if tag:
+                timings["tag_page"].append(timed(
+                    note_service.get_active_notes_page, limit=Config.PAGE_SIZE, filters={"tags": [tag]}
+                )[0])
+        return {name: summarize(values) for name, values in timings.items()}
+    finally:
+        db.close()
+
+
+def run_benchmark(args, notes: int):
+    from services.vector_index import get_vector_index, get_passage_index
+    from services.keyword_index import get_keyword_index
+    from services.note_service import NoteService
+
+    Config.SEARCH_BACKEND = args.backend
+    # Measure the listing and search paths themselves, not repeat hits on the result cache
+    result_cache._cache = result_cache.ResultCache(None)
+    if args.backend == "ivf":
+        Config.ANN_INDEX_DIR = tempfile.mkdtemp(prefix="benchmark_ann_")
+    engine = connect(args.database_url, args.reset)
+    ai_service = FakeAIService(dim=args.dim, latency_ms=args.latency_ms, seed=args.seed)
+    corpus = SyntheticCorpus(seed=args.seed)
+
+    db = next(get_db())
+    try:
+        db.add(EmbeddingSpace(name=ai_service.embedding_space, dim=args.dim, status="active",
+                              activated_at=datetime.datetime.now()))
+        db.commit()
+    finally:
+        db.close()
+    # Workers don't serve searches: keep setup writes out of this process's indexes,
+    # the timed cold load below then rebuilds them for the active space
+    get_vector_index().space = "benchmark:setup"
+
+    use_redis = redis_available()
+    report = {"notes": notes, "redis": use_redis}
+    report["ingest"] = bench_ingest(corpus, notes, args.batch_size)
+    report["enrichment"] = bench_enrichment(ai_service, min(args.enrich_sample, notes), args.enrich_workers, use_redis)
+    report["setup_enrich_seconds"] = round(timed(
+        fill_enrichment, FakeAIService(dim=args.dim, seed=args.seed), args.batch_size
+    )[0], 3)
+    report["memory"] = {"peak_rss_mb_before_load": peak_rss_mb()}
+
+    get_keyword_index().clear()
+    get_passage_index().clear()
+    db = next(get_db())
+    try:
+        report["index_load_seconds"] = round(timed(NoteService(db).ensure_search_index)[0], 3)
+    finally:
+        db.close()
+    index = get_vector_index()
+    report["memory"].update({
+        "peak_rss_mb_after_load": peak_rss_mb(),
+        "vector_index_mb": round((index.memory_bytes() if hasattr(index, "memory_bytes")
+                                  else len(index) * (index.dim or 0) * 4) / 2 ** 20, 1),
+        "passage_vectors": len(get_passage_index()),
+        "keyword_index_notes": len(get_keyword_index()),
+    })
+
+    report["search"] = bench_search(corpus, ai_service, args.queries, args.top_k)
+    report["listing"] = bench_listing(args.list_repeats)
+    report["memory"]["peak_rss_mb"] = peak_rss_mb()
+    engine.dispose()
+    if args.backend == "ivf":
+        shutil.rmtree(Config.ANN_INDEX_DIR, ignore_errors=True)
+    return report
+
+
+def child_command(args, notes: int, output: str):
+    command = [sys.executable, os.path.abspath(__file__), "--notes", str(notes), "--output", output,
+               "--database-url", args.database_url, "--backend", args.backend, "--dim", str(args.dim),
+               "--latency-ms", str(args.latency_ms), "--batch-size", str(args.batch_size),
+               "--enrich-sample", str(args.enrich_sample), "--enrich-workers", str(args.enrich_workers),
+               "--queries", str(args.queries), "--top-k", str(args.top_k),
+               "--list-repeats", str(args.list_repeats), "--seed", str(args.seed)]
+    if args.reset:
+        command.append("--reset")
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, enrichment, search and listing on a synthetic corpus, offline")
+    parser.add_argument("--notes", type=int, nargs="+", default=[10000], help="Corpus sizes, e.g. 10000 100000 1000000")
+    parser.add_argument("--database-url", default=DEFAULT_DATABASE_URL,
+                        help="SQLite (default) or a dedicated local MySQL database, e.g. mysql+pymysql://root:@localhost/kh_bench")
+    parser.add_argument("--reset", action="store_true", help="Allow dropping all tables of a non-SQLite database")
+    parser.add_argument("--backend", choices=["exact", "ivf", "int8", "binary"], default=Config.SEARCH_BACKEND)
+    parser.add_argument("--dim", type=int, default=256, help="Fake embedding dimension")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Simulated latency of every provider call")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Notes per bulk insert")
+    parser.add_argument("--enrich-sample", type=int, default=200, help="Notes enriched through worker.process_note_ai")
+    parser.add_argument("--enrich-workers", type=int, default=1, help="Concurrent process_note_ai calls")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--list-repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    result = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "database": create_engine(args.database_url).url.render_as_string(hide_password=True),
+        "backend": args.backend,
+        "dim": args.dim,
+        "latency_ms": args.latency_ms,
+        "runs": [],
+    }
+    if len(args.notes) == 1:
+        result["runs"].append(run_benchmark(args, args.notes[0]))
+    else:
+        # One process per size, so peak memory and process-wide indexes don't carry over
+        for notes in args.notes:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "run.json")
+                subprocess.run(child_command(args, notes, path), check=True)
+                with open(path) as f:
+                    result["runs"].extend(json.load(f)["runs"])
+
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
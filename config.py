@@ -1,4 +1,5 @@
 import os
+import json
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -21,8 +22,97 @@ class Config:
     REDIS_DB = int(os.getenv("REDIS_DB", "0"))
     REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
 
+    # UI
+    PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+    STATUS_REFRESH_SECONDS = float(os.getenv("STATUS_REFRESH_SECONDS", "2")) # how often cards of notes awaiting AI check for updates
+
+    # Search
+    SEARCH_MODE = os.getenv("SEARCH_MODE", "hybrid") # hybrid, semantic, keyword
+    RRF_K = int(os.getenv("RRF_K", "60")) # reciprocal rank fusion damping
+    EMBEDDING_RETRY_AFTER = int(os.getenv("EMBEDDING_RETRY_AFTER", "30")) # seconds of keyword-only search after a provider failure
+    SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "exact") # exact, ivf, int8, binary
+    ANN_INDEX_DIR = os.getenv("ANN_INDEX_DIR", "data/ann_index")
+    ANN_NLIST = int(os.getenv("ANN_NLIST", "0")) # 0 = 4 * sqrt(n)
+    ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8")) # higher = better recall, slower queries
+    ANN_COMPACT_RATIO = float(os.getenv("ANN_COMPACT_RATIO", "0.1"))
+    ANN_COMPACT_MIN_CHANGES = int(os.getenv("ANN_COMPACT_MIN_CHANGES", "1000"))
+    QUANT_RERANK = int(os.getenv("QUANT_RERANK", "0")) # int8/binary: re-rank top_k * this in full precision, 0 = 4 (int8) / 16 (binary)
+    QUANT_RERANK_DIR = os.getenv("QUANT_RERANK_DIR", "") # int8/binary: where the memory-mapped full-precision copy lives; empty = system temp dir
+    # Notes longer than PASSAGE_CHARS are embedded as overlapping passages, scored by their best passage
+    PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "1500"))
+    PASSAGE_OVERLAP = int(os.getenv("PASSAGE_OVERLAP", "200"))
+
+    # Embedding storage precision: float32 or float16 (half the size, ~3 decimal digits)
+    EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
+
+    # Worker: "rq" runs one job per note, "batch" coalesces queued notes into batched embedding calls,
+    # "async" drains the same queue but classifies and embeds notes concurrently
+    WORKER_MODE = os.getenv("WORKER_MODE", "rq")
+    AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "16")) # notes in flight per async worker
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    EMBED_BATCH_WAIT_MS = int(os.getenv("EMBED_BATCH_WAIT_MS", "200"))
+
+    # Worker pool run by supervisor.py, resized between MIN and MAX processes from the queues' depth and age
+    WORKER_MIN_PROCESSES = int(os.getenv("WORKER_MIN_PROCESSES", "1"))
+    WORKER_MAX_PROCESSES = int(os.getenv("WORKER_MAX_PROCESSES", "4"))
+    WORKER_SCALE_DEPTH = int(os.getenv("WORKER_SCALE_DEPTH", "20")) # queued jobs (notes in batch mode) per process
+    WORKER_SCALE_MAX_AGE = int(os.getenv("WORKER_SCALE_MAX_AGE", "30")) # seconds; an older queued job adds a process
+    WORKER_SCALE_INTERVAL = int(os.getenv("WORKER_SCALE_INTERVAL", "5")) # seconds between checks
+    WORKER_SCALE_DOWN_AFTER = int(os.getenv("WORKER_SCALE_DOWN_AFTER", "60")) # seconds of spare capacity before a process is stopped
+
+    # Shared provider rate limits ("provider:model" -> requests/min, tokens/min), enforced through Redis.
+    # Override or extend with PROVIDER_RATE_LIMITS='{"openai:gpt-3.5-turbo": {"rpm": 500, "tpm": 60000}}'
+    RATE_LIMITS = {
+        "openai:text-embedding-3-small": {"rpm": 3000, "tpm": 1000000},
+        "openai:gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000},
+        "gemini:models/text-embedding-004": {"rpm": 1500, "tpm": 0},
+        "gemini:gemini-pro": {"rpm": 60, "tpm": 0},
+        "claude:claude-3-opus-20240229": {"rpm": 50, "tpm": 40000},
+    }
+    RATE_LIMITS.update(json.loads(os.getenv("PROVIDER_RATE_LIMITS", "{}")))
+    AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "4")) # in-process retries per provider call
+    AI_RETRY_BASE_SECONDS = float(os.getenv("AI_RETRY_BASE_SECONDS", "1"))
+    AI_RETRY_MAX_SECONDS = float(os.getenv("AI_RETRY_MAX_SECONDS", "60"))
+    AI_JOB_RETRIES = int(os.getenv("AI_JOB_RETRIES", "5")) # times a note is requeued before it is marked failed
+    AI_CLAIM_TIMEOUT = int(os.getenv("AI_CLAIM_TIMEOUT", "900")) # seconds before a stuck "processing" note may be taken over
+
+    # Query embedding cache (in-process LRU in front of Redis)
+    QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "604800")) # seconds
+    QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "100000"))
+    QUERY_CACHE_LOCAL_SIZE = int(os.getenv("QUERY_CACHE_LOCAL_SIZE", "1024"))
+    QUERY_CACHE_STATS_FLUSH = float(os.getenv("QUERY_CACHE_STATS_FLUSH", "10")) # seconds between writes of the hit counters to Redis
+
+    # Listing / search result cache, invalidated by a corpus version bumped on every write
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "600")) # seconds; also bounds how long superseded versions linger
+    RESULT_CACHE_LOCAL_SIZE = int(os.getenv("RESULT_CACHE_LOCAL_SIZE", "256"))
+
+    # Related notes: top-k neighbour graph kept by the workers (see services/related_notes.py)
+    RELATED_K = int(os.getenv("RELATED_K", "10"))
+    RELATED_REFRESH_INTERVAL = int(os.getenv("RELATED_REFRESH_INTERVAL", "30")) # min seconds between incremental passes, 0 disables
+    RELATED_REBUILD_INTERVAL = int(os.getenv("RELATED_REBUILD_INTERVAL", "86400")) # full rebuild undoing incremental drift, 0 = never
+    RELATED_WORKERS = int(os.getenv("RELATED_WORKERS", "0")) # processes for rebuilds, 0 = all cores
+    NEAR_DUPLICATE_SCORE = float(os.getenv("NEAR_DUPLICATE_SCORE", "0.95")) # a related note this similar is flagged
+
+    # Recycle bin retention, purged by the workers in small batches (see worker.run_retention)
+    RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30"))
+    RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", "3600")) # seconds between scheduled purges, 0 = only on request
+    PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "200"))
+    PURGE_PAUSE_MS = int(os.getenv("PURGE_PAUSE_MS", "200")) # between batches, so other writers get the locks
+
+    # Prometheus metrics endpoints (GET /metrics); port 0 disables
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1") # 0.0.0.0 to scrape from other containers
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "8502")) # Streamlit app
+    WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "8503")) # supervisor.py; its worker N serves on this + N
+
     # AI
-    AI_PROVIDER = os.getenv("AI_PROVIDER", "openai") # openai, gemini, claude
+    AI_PROVIDER = os.getenv("AI_PROVIDER", "openai") # openai, gemini, claude, local
+
+    # Local embeddings (AI_PROVIDER=local, and always for claude): hashed n-grams, optionally reduced by
+    # a fitted LSA model ("python reembed.py fit-local"), or a sentence-transformers model if one is named
+    LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "") # e.g. sentence-transformers/all-MiniLM-L6-v2
+    LOCAL_EMBEDDING_DIR = os.getenv("LOCAL_EMBEDDING_DIR", "data/local_embeddings")
+    LOCAL_EMBEDDING_DIM = int(os.getenv("LOCAL_EMBEDDING_DIM", "256"))
+    LOCAL_EMBED_WORKERS = int(os.getenv("LOCAL_EMBED_WORKERS", "0")) # processes for large batches, 0 = all cores
     
     # OpenAI
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -1,6 +1,7 @@
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.orm import sessionmaker, scoped_session, declarative_base
 from config import Config
+from services.metrics import instrument_engine
 import redis
 
 # SQLAlchemy Setup
@@ -10,11 +11,24 @@ engine = create_engine(
     pool_size=10,
     echo=False
 )
+instrument_engine(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# One session per thread (Streamlit runs each user's script on its own thread);
+# long-lived code holds this proxy and calls db_session.remove() when a run ends
+db_session = scoped_session(SessionLocal)
+
 Base = declarative_base()
 
+def pool_stats():
+    """Connection pool usage of the engine, or None for pools that don't track it (SQLite)."""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout"):
+        return None
+    return {"size": pool.size(), "in_use": pool.checkedout(), "idle": pool.checkedin(),
+            "overflow": max(0, pool.overflow())}
+
 def get_db():
     db = SessionLocal()
     try:
@@ -30,3 +44,12 @@ redis_client = redis.Redis(
     password=Config.REDIS_PASSWORD,
     decode_responses=True
 )
+
+# Same server without response decoding, for values stored as raw bytes (packed vectors)
+redis_binary_client = redis.Redis(
+    host=Config.REDIS_HOST,
+    port=Config.REDIS_PORT,
+    db=Config.REDIS_DB,
+    password=Config.REDIS_PASSWORD,
+    decode_responses=False
+)
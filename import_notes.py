@@ -0,0 +1,166 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+import time
+from config import Config
+from database import get_db
+from services.note_service import NoteService
+
+
+def read_jsonl(path):
+    """Yield (position, record) for each line with a "content" (or "text") field."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_no}: {e}")
+                continue
+            content = data.get("content") or data.get("text")
+            if content:
+                yield line_no, {
+                    "content": content,
+                    "category": data.get("category"),
+                    "tags": data.get("tags"),
+                    "created_at": data.get("created_at"),
+                }
+
+
+def read_csv(path, content_column="content"):
+    csv.field_size_limit(sys.maxsize)
+    with open(path, encoding="utf-8", newline="") as f:
+        for row_no, row in enumerate(csv.DictReader(f), 1):
+            content = row.get(content_column)
+            if content:
+                tags = row.get("tags")
+                yield row_no, {
+                    "content": content,
+                    "category": row.get("category") or None,
+                    "tags": [t.strip() for t in tags.split(",") if t.strip()] if tags else None,
+                    "created_at": row.get("created_at") or None,
+                }
+
+
+def read_markdown(folder):
+    """One note per .md file, walked in a stable order so positions survive a restart."""
+    position = 0
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith((".md", ".markdown")):
+                continue
+            position += 1
+            with open(os.path.join(root, name), encoding="utf-8") as f:
+                content = f.read().strip()
+            if content:
+                yield position, {"content": content}
+
+
+def parse_created_at(value):
+    if not value or isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def load_checkpoint(path, source):
+    if not path or not os.path.exists(path):
+        return 0, 0
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("source") != os.path.abspath(source):
+        print(f"Checkpoint {path} belongs to another source, starting from the beginning.")
+        return 0, 0
+    return data.get("position", 0), data.get("imported", 0)
+
+
+def save_checkpoint(path, source, position, imported):
+    if not path:
+        return
+    with open(path + ".tmp", "w") as f:
+        json.dump({"source": os.path.abspath(source), "position": position, "imported": imported}, f)
+    os.replace(path + ".tmp", path)
+
+
+def import_notes(source, fmt, batch_size=1000, checkpoint=None, content_column="content",
+                 enqueue=True, skip_existing=True):
+    if fmt == "jsonl":
+        records = read_jsonl(source)
+    elif fmt == "csv":
+        records = read_csv(source, content_column)
+    else:
+        records = read_markdown(source)
+
+    resume_from, imported = load_checkpoint(checkpoint, source)
+    if resume_from:
+        print(f"Resuming after record {resume_from} ({imported} already imported).")
+
+    db = next(get_db())
+    note_service = NoteService(db)
+    start = time.time()
+    scanned = 0
+    batch, position = [], resume_from
+
+    def flush():
+        nonlocal imported
+        ids = note_service.bulk_create_notes(batch, skip_existing=skip_existing)
+        if enqueue:
+            from worker import enqueue_enrichment
+            enqueue_enrichment(ids, Config.EMBED_BATCH_SIZE)
+        imported += len(ids)
+        save_checkpoint(checkpoint, source, position, imported)
+        elapsed = time.time() - start
+        print(f"  {imported} imported, {scanned} scanned ({scanned / elapsed if elapsed else 0:.0f} rows/s)")
+        batch.clear()
+
+    try:
+        for position, record in records:
+            if position <= resume_from:
+                continue
+            scanned += 1
+            record["created_at"] = parse_created_at(record.get("created_at"))
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    finally:
+        db.close()
+
+    elapsed = time.time() - start
+    print(f"Done. {imported} notes imported in {elapsed:.1f}s ({scanned / elapsed if elapsed else 0:.0f} rows/s).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import notes from JSONL, CSV or a folder of Markdown files")
+    parser.add_argument("source", help="Path to a .jsonl / .csv file or a Markdown folder")
+    parser.add_argument("--format", choices=["jsonl", "csv", "markdown"], default=None,
+                        help="Defaults to the file extension, or markdown for folders")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per multi-row INSERT")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Progress file for resuming (default: <source>.import-checkpoint)")
+    parser.add_argument("--content-column", default="content", help="CSV column holding the note text")
+    parser.add_argument("--no-enqueue", action="store_true", help="Import only, don't queue AI processing")
+    parser.add_argument("--allow-duplicates", action="store_true", help="Import notes whose content already exists")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        if os.path.isdir(args.source):
+            fmt = "markdown"
+        elif args.source.lower().endswith(".csv"):
+            fmt = "csv"
+        else:
+            fmt = "jsonl"
+    checkpoint = args.checkpoint or os.path.abspath(args.source).rstrip(os.sep) + ".import-checkpoint"
+
+    import_notes(args.source, fmt, args.batch_size, checkpoint, args.content_column,
+                 enqueue=not args.no_enqueue, skip_existing=not args.allow_duplicates)
@@ -0,0 +1,110 @@
+import argparse
+import json
+from config import Config
+from database import get_db
+from services.ann_index import AnnIndex, write_segment, evaluate_recall
+from services.quantized_index import evaluate_quantized_recall
+from services.vector_index import VectorIndex, sync_index
+from services.embedding_space import get_active_space
+from services.related_notes import rebuild_related_notes, refresh_related_notes
+
+
+def build_index(nlist=None):
+    db = next(get_db())
+    try:
+        print("Loading embeddings...")
+        staging = VectorIndex()
+        staging.space = get_active_space(db)
+        staging.load(db)
+        ids, vectors = staging.snapshot()
+        if not ids.shape[0]:
+            print("No embeddings found, nothing to build.")
+            return
+        manifest = write_segment(Config.ANN_INDEX_DIR, ids, vectors, synced_at=staging.synced_at, nlist=nlist,
+                                 space=staging.space)
+        print(f"Built segment {manifest['segment']} with {manifest['count']} {staging.space} vectors in {manifest['nlist']} lists.")
+    finally:
+        db.close()
+
+
+def compact_index():
+    db = next(get_db())
+    try:
+        index = AnnIndex(Config.ANN_INDEX_DIR)
+        index.space = get_active_space(db)
+        index.load(db)
+        sync_index(db, index)
+        print(f"Pending changes: {index.pending_changes()}")
+        manifest = index.compact()
+        if manifest:
+            print(f"Compacted into {manifest['segment']} ({manifest['count']} vectors).")
+        else:
+            print("Nothing to compact or another process is compacting.")
+    finally:
+        db.close()
+
+
+def check_recall(top_k=10, nprobe=None, sample=100):
+    index = AnnIndex(Config.ANN_INDEX_DIR)
+    if not index.open():
+        print("No index found. Run 'python manage_index.py build' first.")
+        return
+    print(json.dumps(evaluate_recall(index, top_k=top_k, nprobe=nprobe, sample=sample), indent=2))
+
+
+def check_quantized_recall(top_k=10, sample=100, rerank=None, modes=("int8", "binary")):
+    db = next(get_db())
+    try:
+        staging = VectorIndex()
+        staging.space = get_active_space(db)
+        staging.load(db)
+    finally:
+        db.close()
+    ids, vectors = staging.snapshot()
+    if not ids.shape[0]:
+        print("No embeddings found.")
+        return
+    print(json.dumps(evaluate_quantized_recall(ids, vectors, top_k=top_k, sample=sample, modes=modes, rerank=rerank),
+                     indent=2))
+
+
+def update_related(rebuild=False, k=None, workers=None):
+    db = next(get_db())
+    try:
+        report = rebuild_related_notes(db, k, workers) if rebuild else refresh_related_notes(db, k)
+        print(json.dumps(report, indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the on-disk ANN search index and the related-notes graph")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Rebuild the index from the database")
+    build.add_argument("--nlist", type=int, default=None)
+    sub.add_parser("compact", help="Fold pending changes into a new segment")
+    recall = sub.add_parser("recall", help="Measure recall against exhaustive search")
+    recall.add_argument("--top-k", type=int, default=10)
+    recall.add_argument("--nprobe", type=int, default=None)
+    recall.add_argument("--sample", type=int, default=100)
+    quant = sub.add_parser("quant-recall", help="Compare int8 / binary quantized search with exact search")
+    quant.add_argument("--mode", choices=["int8", "binary"], action="append", default=None)
+    quant.add_argument("--top-k", type=int, default=10)
+    quant.add_argument("--rerank", type=int, default=None, help="Shortlist size as a multiple of top_k")
+    quant.add_argument("--sample", type=int, default=100)
+    related = sub.add_parser("related", help="Update the related-notes graph from notes changed since the last pass")
+    related.add_argument("--rebuild", action="store_true", help="Recompute every note's neighbours")
+    related.add_argument("--k", type=int, default=None, help="Neighbours per note (default RELATED_K)")
+    related.add_argument("--workers", type=int, default=None, help="Rebuild processes (default RELATED_WORKERS)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.nlist)
+    elif args.command == "compact":
+        compact_index()
+    elif args.command == "recall":
+        check_recall(args.top_k, args.nprobe, args.sample)
+    elif args.command == "quant-recall":
+        check_quantized_recall(args.top_k, args.sample, args.rerank, args.mode or ("int8", "binary"))
+    elif args.command == "related":
+        update_related(args.rebuild, args.k, args.workers)
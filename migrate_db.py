@@ -1,5 +1,11 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, bindparam, inspect, select
 from config import Config
+from models import compute_content_hash, NoteChunk, NoteTag, NoteEmbedding, NoteNeighbor, EmbeddingSpace, parse_space
+import argparse
+import datetime
+import json
+
+LEGACY_SPACE = "legacy:unknown"  # vectors stored before the provider/model was recorded
 
 def add_status_column():
     engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
@@ -10,5 +16,226 @@ def add_status_column():
         except Exception as e:
             print(f"Column might already exist or error: {e}")
 
-if __name__ == "__main__":
+def add_listing_index():
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE INDEX ix_notes_listing ON knowledge_notes (is_deleted, created_at, id)"))
+            print("Added 'ix_notes_listing' index.")
+        except Exception as e:
+            print(f"Index might already exist or error: {e}")
+
+def add_retention_index():
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE INDEX ix_notes_deleted ON knowledge_notes (is_deleted, deleted_at)"))
+            print("Added 'ix_notes_deleted' index.")
+        except Exception as e:
+            print(f"Index might already exist or error: {e}")
+
+def add_sync_index():
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE INDEX ix_knowledge_notes_updated_at ON knowledge_notes (updated_at)"))
+            print("Added 'ix_knowledge_notes_updated_at' index.")
+        except Exception as e:
+            print(f"Index might already exist or error: {e}")
+
+def add_dedup_columns(batch_size=1000):
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as conn:
+        for ddl in [
+            "ALTER TABLE knowledge_notes ADD COLUMN content_hash VARCHAR(64) NULL",
+            "ALTER TABLE knowledge_notes ADD COLUMN ai_provider VARCHAR(20) NULL",
+            "CREATE INDEX ix_knowledge_notes_content_hash ON knowledge_notes (content_hash)",
+        ]:
+            try:
+                conn.execute(text(ddl))
+                print(f"Applied: {ddl}")
+            except Exception as e:
+                print(f"Column/index might already exist or error: {e}")
+
+    # Backfill hashes in small batches so no long-running transaction is held
+    last_id, filled = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, content FROM knowledge_notes WHERE id > :last_id AND content_hash IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            conn.execute(text("UPDATE knowledge_notes SET content_hash = :hash WHERE id = :id"), [
+                {"id": note_id, "hash": compute_content_hash(content)} for note_id, content in rows
+            ])
+            last_id = rows[-1][0]
+            filled += len(rows)
+    print(f"Backfilled content_hash for {filled} notes.")
+
+def add_passage_table():
+    # Existing long notes keep their single vector until they are reprocessed
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    NoteChunk.__table__.create(bind=engine, checkfirst=True)
+    print("Ensured 'note_chunks' table.")
+
+def add_tag_table(batch_size=1000):
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    NoteTag.__table__.create(bind=engine, checkfirst=True)
+    print("Ensured 'note_tags' table.")
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("CREATE INDEX ix_notes_category ON knowledge_notes (category, created_at)"))
+            print("Added 'ix_notes_category' index.")
+        except Exception as e:
+            print(f"Index might already exist or error: {e}")
+
+    # Copy the JSON tags into note_tags in batches; rewriting each batch keeps re-runs idempotent
+    last_id, copied = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, tags FROM knowledge_notes WHERE id > :last_id AND tags IS NOT NULL "
+                "ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+            pairs = []
+            for note_id, tags in rows:
+                if isinstance(tags, str):
+                    tags = json.loads(tags)
+                pairs.extend({"note_id": note_id, "tag": tag} for tag in {str(t).strip()[:100] for t in tags or []} if tag)
+            if pairs:
+                conn.execute(text("DELETE FROM note_tags WHERE note_id IN :ids").bindparams(
+                    bindparam("ids", expanding=True)
+                ), {"ids": [note_id for note_id, _ in rows]})
+                conn.execute(text("INSERT INTO note_tags (note_id, tag) VALUES (:note_id, :tag)"), pairs)
+            last_id = rows[-1][0]
+            copied += len(pairs)
+    print(f"Backfilled {copied} note tags.")
+
+def add_claim_column():
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as conn:
+        try:
+            conn.execute(text("ALTER TABLE knowledge_notes ADD COLUMN claim_token VARCHAR(32) NULL"))
+            print("Added 'claim_token' column.")
+        except Exception as e:
+            print(f"Column might already exist or error: {e}")
+
+def add_embedding_spaces(legacy_space=None):
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    EmbeddingSpace.__table__.create(bind=engine, checkfirst=True)
+    NoteEmbedding.__table__.create(bind=engine, checkfirst=True)
+    print("Ensured 'embedding_spaces' and 'note_embeddings' tables.")
+    with engine.connect() as conn:
+        for ddl in [
+            "ALTER TABLE note_chunks ADD COLUMN space VARCHAR(150) NULL",
+            "CREATE INDEX ix_note_chunks_space ON note_chunks (space, note_id)",
+        ]:
+            try:
+                conn.execute(text(ddl))
+                print(f"Applied: {ddl}")
+            except Exception as e:
+                print(f"Column/index might already exist or error: {e}")
+
+    columns = {column["name"] for column in inspect(engine).get_columns("knowledge_notes")}
+    if not {"embedding_vec", "embedding_model"} <= columns:
+        print("No 'embedding_vec' column yet: run migrate_embeddings.py, then this script again to tag the existing vectors.")
+        return
+
+    # The model behind vectors written before spaces were tracked was never recorded:
+    # they go to the space the operator names, or to an explicit legacy space
+    space = legacy_space or LEGACY_SPACE
+    provider, model = parse_space(space)
+    legacy_provider, legacy_model = parse_space(LEGACY_SPACE)
+    spaces = EmbeddingSpace.__table__
+    with engine.begin() as conn:
+        notes = conn.execute(text(
+            "UPDATE knowledge_notes SET ai_provider = :provider, embedding_model = :model "
+            "WHERE embedding_vec IS NOT NULL AND (embedding_model IS NULL "
+            "OR (ai_provider = :legacy_provider AND embedding_model = :legacy_model))"
+        ), {"provider": provider, "model": model,
+            "legacy_provider": legacy_provider, "legacy_model": legacy_model}).rowcount
+        chunks = conn.execute(text(
+            "UPDATE note_chunks SET space = :space WHERE space IS NULL OR space = :legacy"
+        ), {"space": space, "legacy": LEGACY_SPACE}).rowcount
+        if (notes or chunks) and conn.execute(select(spaces.c.name).where(spaces.c.name == space)).first() is None:
+            dim = conn.execute(text(
+                "SELECT embedding_dim FROM knowledge_notes "
+                "WHERE ai_provider = :provider AND embedding_model = :model AND embedding_dim IS NOT NULL LIMIT 1"
+            ), {"provider": provider, "model": model}).scalar()
+            # A named space is searched right away unless another one already is
+            active = legacy_space and conn.execute(
+                select(spaces.c.name).where(spaces.c.status == "active")).first() is None
+            now = datetime.datetime.now()
+            conn.execute(spaces.insert().values(name=space, dim=dim, status="active" if active else "retired",
+                                                backfill_cursor=0, created_at=now,
+                                                activated_at=now if active else None))
+    print(f"Tagged {notes} notes and {chunks} passages with embedding space {space}.")
+    if notes and not legacy_space:
+        print("Their model is unknown, so searches of the active space skip them: re-embed them with 'python reembed.py backfill <provider>' "
+              "and switch, or re-run with --legacy-space provider:model if you know which model wrote them.")
+
+def merge_claude_spaces(batch_size=1000):
+    # "claude" embeds with the local embedder, but its vectors used to be recorded as
+    # claude:<model>: fold them into local:<model>, where identical vectors belong
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    if "embedding_spaces" not in inspect(engine).get_table_names():
+        return
+    spaces = EmbeddingSpace.__table__
+    with engine.begin() as conn:
+        old_spaces = set(conn.execute(select(spaces.c.name).where(spaces.c.name.like("claude:%"))).scalars())
+        old_spaces |= set(conn.execute(text(
+            "SELECT DISTINCT space FROM note_chunks WHERE space LIKE 'claude:%'")).scalars())
+        old_spaces |= set(conn.execute(text(
+            "SELECT DISTINCT space FROM note_embeddings WHERE space LIKE 'claude:%'")).scalars())
+        for old in sorted(old_spaces):
+            new = "local:" + parse_space(old)[1]
+            # Notes embedded in both copies keep the local one
+            for table in ("note_chunks", "note_embeddings"):
+                kept = list(conn.execute(text(f"SELECT DISTINCT note_id FROM {table} WHERE space = :new"), {"new": new}).scalars())
+                for start in range(0, len(kept), batch_size):
+                    conn.execute(text(f"DELETE FROM {table} WHERE space = :old AND note_id IN :ids").bindparams(
+                        bindparam("ids", expanding=True)), {"old": old, "ids": kept[start:start + batch_size]})
+                conn.execute(text(f"UPDATE {table} SET space = :new WHERE space = :old"), {"new": new, "old": old})
+            row = conn.execute(select(spaces).where(spaces.c.name == old)).first()
+            if row is None:
+                continue
+            if conn.execute(select(spaces.c.name).where(spaces.c.name == new)).first() is None:
+                conn.execute(spaces.update().where(spaces.c.name == old).values(name=new))
+            else:
+                if row.status == "active":
+                    conn.execute(spaces.update().where(spaces.c.name == new).values(status="active", activated_at=row.activated_at))
+                conn.execute(spaces.delete().where(spaces.c.name == old))
+        notes = conn.execute(text("UPDATE knowledge_notes SET ai_provider = 'local' WHERE ai_provider = 'claude'")).rowcount
+    if old_spaces or notes:
+        print(f"Merged {', '.join(sorted(old_spaces)) or 'claude'} vectors into the local embedder's spaces ({notes} notes).")
+
+def add_neighbor_table():
+    # Filled by the workers' first related-notes pass (or: python manage_index.py related --rebuild)
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    NoteNeighbor.__table__.create(bind=engine, checkfirst=True)
+    print("Ensured 'note_neighbors' table.")
+
+def migrate_all(legacy_space=None):
+    """Every step in order; each one is safe to re-run."""
     add_status_column()
+    add_listing_index()
+    add_dedup_columns()
+    add_passage_table()
+    add_tag_table()
+    add_embedding_spaces(legacy_space)
+    add_claim_column()
+    add_retention_index()
+    add_neighbor_table()
+    add_sync_index()
+    merge_claude_spaces()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bring an existing database up to the current schema")
+    parser.add_argument("--legacy-space", default=None,
+                        help="provider:model that wrote the vectors stored before embedding spaces were tracked")
+    args = parser.parse_args()
+    migrate_all(args.legacy_space)
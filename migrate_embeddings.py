@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import time
+from sqlalchemy import create_engine, text, inspect
+from config import Config
+from models import encode_vector
+
+CHECKPOINT_FILE = os.getenv("EMBEDDING_MIGRATION_CHECKPOINT", "data/migrate_embeddings.checkpoint")
+
+
+def add_vector_columns(engine):
+    columns = {c["name"] for c in inspect(engine).get_columns("knowledge_notes")}
+    new_columns = {
+        "embedding_vec": "MEDIUMBLOB NULL",
+        "embedding_model": "VARCHAR(100) NULL",
+        "embedding_dim": "INT NULL",
+    }
+    with engine.connect() as conn:
+        for name, ddl in new_columns.items():
+            if name in columns:
+                continue
+            # INSTANT/INPLACE add-column does not block concurrent reads and writes
+            try:
+                conn.execute(text(f"ALTER TABLE knowledge_notes ADD COLUMN {name} {ddl}, ALGORITHM=INSTANT"))
+            except Exception:
+                conn.execute(text(f"ALTER TABLE knowledge_notes ADD COLUMN {name} {ddl}, ALGORITHM=INPLACE, LOCK=NONE"))
+            print(f"Added '{name}' column.")
+        conn.commit()
+    return "embedding" in columns
+
+
+def read_checkpoint():
+    try:
+        with open(CHECKPOINT_FILE) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(last_id: int):
+    os.makedirs(os.path.dirname(CHECKPOINT_FILE) or ".", exist_ok=True)
+    with open(CHECKPOINT_FILE + ".tmp", "w") as f:
+        f.write(str(last_id))
+    os.replace(CHECKPOINT_FILE + ".tmp", CHECKPOINT_FILE)
+
+
+def convert_embeddings(batch_size=500, pause=0.1, dtype=None, restart=False):
+    """
+    Copy JSON embeddings into the packed embedding_vec column.
+
+    Walks the primary key in small batches (one short transaction each), so only
+    the rows in the current batch are locked. Progress is checkpointed after every
+    batch and rows that already have a vector are skipped, so the script can be
+    stopped and re-run at any time.
+    """
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    if not add_vector_columns(engine):
+        print("No legacy 'embedding' JSON column found, nothing to convert.")
+        return
+
+    last_id = 0 if restart else read_checkpoint()
+    converted = skipped = 0
+    start = time.time()
+    print(f"Converting embeddings to {dtype or Config.EMBEDDING_DTYPE} starting after id {last_id}...")
+
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, embedding FROM knowledge_notes "
+                "WHERE id > :last_id AND embedding IS NOT NULL AND embedding_vec IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch_size}).fetchall()
+            if not rows:
+                break
+
+            params = []
+            for note_id, raw in rows:
+                vector = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+                if not vector:
+                    skipped += 1
+                    continue
+                params.append({"id": note_id, "vec": encode_vector(vector, dtype), "dim": len(vector)})
+            if params:
+                conn.execute(text(
+                    "UPDATE knowledge_notes SET embedding_vec = :vec, embedding_dim = :dim "
+                    "WHERE id = :id AND embedding_vec IS NULL"
+                ), params)
+            converted += len(params)
+            last_id = rows[-1][0]
+
+        write_checkpoint(last_id)
+        elapsed = time.time() - start
+        print(f"  up to id {last_id}: {converted} converted, {skipped} skipped ({converted / elapsed:.0f} rows/s)")
+        time.sleep(pause)
+
+    print(f"Done. {converted} embeddings converted.")
+
+
+def drop_json_column():
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URL)
+    with engine.connect() as conn:
+        remaining = conn.execute(text(
+            "SELECT COUNT(*) FROM knowledge_notes WHERE embedding IS NOT NULL AND embedding_vec IS NULL"
+        )).scalar()
+        if remaining:
+            print(f"{remaining} rows are not converted yet, keeping the JSON column.")
+            return
+        conn.execute(text("ALTER TABLE knowledge_notes DROP COLUMN embedding"))
+        conn.commit()
+        print("Dropped legacy 'embedding' column.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert JSON embeddings to packed binary vectors")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds to sleep between batches")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default=None)
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and scan from the start")
+    parser.add_argument("--drop-json", action="store_true", help="Drop the JSON column once every row is converted")
+    args = parser.parse_args()
+
+    convert_embeddings(args.batch_size, args.pause, args.dtype, args.restart)
+    if args.drop_json:
+        drop_json_column()
@@ -1,21 +1,100 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, LargeBinary, Float, Index, ForeignKey
+from sqlalchemy.types import TypeDecorator
 from database import Base
+from config import Config
+import numpy as np
 import datetime
+import hashlib
+import unicodedata
+
+# 4-byte header keeps the payload float32-aligned: magic, dtype code, 2 reserved bytes
+VECTOR_DTYPES = {"float32": b"4", "float16": b"2"}
+VECTOR_CODES = {b"4": np.dtype("<f4"), b"2": np.dtype("<f2")}
+
+
+def encode_vector(vector, dtype: str = None):
+    if vector is None:
+        return None
+    code = VECTOR_DTYPES[dtype or Config.EMBEDDING_DTYPE]
+    array = np.asarray(vector, dtype=VECTOR_CODES[code]).ravel()
+    return b"E" + code + b"\x00\x00" + array.tobytes()
+
+
+def decode_vector(blob):
+    """Zero-copy view over the stored bytes (read-only ndarray)."""
+    if blob is None:
+        return None
+    return np.frombuffer(blob, dtype=VECTOR_CODES[blob[1:2]], offset=4)
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def space_name(provider: str, model: str) -> str:
+    """An embedding space: vectors from one provider/model, comparable only with each other."""
+    return f"{provider}:{model}"
+
+
+def parse_space(space: str):
+    provider, model = space.split(":", 1)
+    return provider, model
+
+
+def compute_content_hash(text: str) -> str:
+    """sha256 of the whitespace/NFKC-normalized text, used to reuse AI results."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class Vector(TypeDecorator):
+    """Packed float32/float16 embedding stored as a binary blob."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if isinstance(value, (bytes, bytearray)):
+            return value
+        return encode_vector(value)
+
+    def process_result_value(self, value, dialect):
+        return decode_vector(value)
+
+    def compare_values(self, x, y):
+        # Default == is elementwise on ndarrays (and fails outright when dimensions differ)
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(np.asarray(x), np.asarray(y))
+
 
 class KnowledgeNote(Base):
     __tablename__ = "knowledge_notes"
 
     id = Column(Integer, primary_key=True, index=True)
     content = Column(Text, nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)
     category = Column(String(50), nullable=True)
     tags = Column(JSON, nullable=True)  # List of strings
-    embedding = Column(JSON, nullable=True) # List of floats
-    status = Column(String(20), default="pending") # pending, completed, failed
+    embedding = Column("embedding_vec", Vector, nullable=True) # np.ndarray, see Vector
+    ai_provider = Column(String(20), nullable=True)
+    embedding_model = Column(String(100), nullable=True)
+    embedding_dim = Column(Integer, nullable=True)
+    status = Column(String(20), default="pending") # pending, processing, completed, failed
+    claim_token = Column(String(32), nullable=True) # worker run holding a "processing" note, see NoteService.claim_notes (set by bulk_create_notes only inside its transaction)
     created_at = Column(DateTime, default=datetime.datetime.now)
-    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+    # Indexed: the search indexes and the related-notes pass sync on it
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now, index=True)
     is_deleted = Column(Boolean, default=False, index=True)
     deleted_at = Column(DateTime, nullable=True)
 
+    __table_args__ = (
+        # Serves the keyset-paginated listing: WHERE is_deleted ORDER BY created_at, id
+        # (and date-range filters on created_at)
+        Index("ix_notes_listing", "is_deleted", "created_at", "id"),
+        Index("ix_notes_category", "category", "created_at"),
+        # Retention purges: WHERE is_deleted AND deleted_at < cutoff
+        Index("ix_notes_deleted", "is_deleted", "deleted_at"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -26,3 +105,78 @@ class KnowledgeNote(Base):
             "is_deleted": self.is_deleted,
             "deleted_at": self.deleted_at
         }
+
+
+class NoteTag(Base):
+    """One row per (note, tag): the indexed copy of KnowledgeNote.tags used for filtering."""
+    __tablename__ = "note_tags"
+
+    note_id = Column(Integer, ForeignKey("knowledge_notes.id", ondelete="CASCADE"), primary_key=True)
+    tag = Column(String(100), primary_key=True)
+
+    __table_args__ = (
+        Index("ix_note_tags_tag", "tag", "note_id"),
+    )
+
+
+class NoteChunk(Base):
+    """An overlapping passage of a long note, embedded on its own."""
+    __tablename__ = "note_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    note_id = Column(Integer, ForeignKey("knowledge_notes.id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False) # order within the note
+    start = Column(Integer, nullable=False) # character offset in the note content
+    content = Column(Text, nullable=False)
+    embedding = Column("embedding_vec", Vector, nullable=True)
+    space = Column(String(150), nullable=True) # embedding space of this passage's vector
+
+    __table_args__ = (
+        Index("ix_note_chunks_space", "space", "note_id"),
+    )
+
+
+class EmbeddingSpace(Base):
+    """
+    Known embedding spaces. Exactly one is "active": searches and workers use it.
+    Others are being backfilled (vectors in note_embeddings) or retired.
+    """
+    __tablename__ = "embedding_spaces"
+
+    name = Column(String(150), primary_key=True) # "provider:model"
+    dim = Column(Integer, nullable=True)
+    status = Column(String(20), default="backfilling") # backfilling, active, retired
+    backfill_cursor = Column(Integer, default=0) # highest note id the backfill has covered
+    created_at = Column(DateTime, default=datetime.datetime.now)
+    activated_at = Column(DateTime, nullable=True)
+
+
+class NoteEmbedding(Base):
+    """A note's vector in a space that is being backfilled, until the switch promotes it."""
+    __tablename__ = "note_embeddings"
+
+    note_id = Column(Integer, ForeignKey("knowledge_notes.id", ondelete="CASCADE"), primary_key=True)
+    space = Column(String(150), primary_key=True)
+    embedding = Column("embedding_vec", Vector, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.now, onupdate=datetime.datetime.now)
+
+    __table_args__ = (
+        Index("ix_note_embeddings_space", "space", "note_id"),
+    )
+
+
+class NoteNeighbor(Base):
+    """
+    An edge of the related-notes graph: neighbor_id is one of the Config.RELATED_K notes
+    most similar to note_id (see services/related_notes.py).
+    """
+    __tablename__ = "note_neighbors"
+
+    note_id = Column(Integer, ForeignKey("knowledge_notes.id", ondelete="CASCADE"), primary_key=True)
+    neighbor_id = Column(Integer, ForeignKey("knowledge_notes.id", ondelete="CASCADE"), primary_key=True)
+    score = Column(Float, nullable=False) # cosine similarity
+
+    __table_args__ = (
+        # Which notes list a given note, to refresh them when it changes or goes away
+        Index("ix_note_neighbors_neighbor", "neighbor_id", "note_id"),
+    )
@@ -0,0 +1,185 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from database import get_db
+from models import KnowledgeNote, EmbeddingSpace
+from services.ai_service import AIService
+from services.local_embedder import fit_lsa
+from services.note_service import NoteService
+from services.embedding_space import (
+    get_active_space, register_space, missing_note_ids, backfill_progress, switch_space, prune_spaces
+)
+
+
+def resolve_space(name: str):
+    """Accept a provider ("gemini") or a full space name ("gemini:models/text-embedding-004")."""
+    if ":" in name:
+        return name
+    return AIService(provider=name).embedding_space
+
+
+def embed_batch(space: str, provider: str, note_ids: list):
+    """Re-embed one batch into `space` on its own session. Returns (stored, failed)."""
+    db = next(get_db())
+    try:
+        ai_service = AIService(provider=provider)
+        rows = db.query(KnowledgeNote.id, KnowledgeNote.content).filter(KnowledgeNote.id.in_(note_ids)).all()
+        embedded = ai_service.embed_notes([content for _, content in rows])
+        results = [{"note_id": note_id, "embedding": outcome[0], "passages": outcome[1]}
+                   for (note_id, _), outcome in zip(rows, embedded) if outcome is not None]
+        NoteService(db).save_space_embeddings(space, results)
+        return len(results), len(rows) - len(results)
+    finally:
+        db.close()
+
+
+def backfill(provider: str, workers: int = 4, batch_size: int = None, pause: float = 0.0):
+    """
+    Re-embed every active note into the provider's space while searches keep using
+    the active one. Batches run on `workers` threads; all provider calls go through
+    the shared rate limiter, so live traffic keeps its share. The position is
+    checkpointed in embedding_spaces after every round, so the job can be stopped
+    and restarted at any time.
+    """
+    batch_size = batch_size or Config.EMBED_BATCH_SIZE
+    ai_service = AIService(provider=provider)
+    space = ai_service.embedding_space
+    if ai_service.embedding_model == "mock":
+        print(f"No embedding API configured for {provider}, nothing to backfill.")
+        return
+
+    db = next(get_db())
+    try:
+        if space == get_active_space(db):
+            print(f"{space} is already the active space.")
+            return
+        row = db.get(EmbeddingSpace, space)
+        if row is None:
+            dim = len(ai_service.generate_embedding("dimension probe"))
+            row = register_space(db, space, dim)
+        done, total = backfill_progress(db, space)
+        print(f"Backfilling {space}: {done}/{total} notes already embedded, resuming after id {row.backfill_cursor or 0}.")
+
+        start = time.time()
+        stored, failed = 0, 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # First pass resumes from the checkpoint; the second picks up notes created
+            # behind the cursor meanwhile and batches that failed
+            for checkpointed, after_id in ((True, row.backfill_cursor or 0), (False, 0)):
+                while True:
+                    ids = missing_note_ids(db, space, after_id=after_id, limit=batch_size * workers)
+                    if not ids:
+                        break
+                    batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+                    for ok, bad in pool.map(lambda batch: embed_batch(space, provider, batch), batches):
+                        stored += ok
+                        failed += bad
+                    after_id = ids[-1]
+                    if checkpointed:
+                        row.backfill_cursor = after_id
+                        db.commit()
+                    elapsed = time.time() - start
+                    print(f"  up to id {after_id}: {stored} embedded, {failed} failed ({stored / elapsed:.1f} notes/s)")
+                    if pause:
+                        time.sleep(pause)
+
+        done, total = backfill_progress(db, space)
+        print(f"Done: {done}/{total} notes have a {space} vector. "
+              f"Run 'python reembed.py switch {provider}' to make it the active space.")
+    finally:
+        db.close()
+
+
+def status():
+    db = next(get_db())
+    try:
+        get_active_space(db)
+        for space in db.query(EmbeddingSpace).order_by(EmbeddingSpace.created_at):
+            line = f"{space.name:55} {space.status:12} dim={space.dim}"
+            if space.status == "backfilling":
+                done, total = backfill_progress(db, space.name)
+                line += f"  {done}/{total} notes"
+            print(line)
+    finally:
+        db.close()
+
+
+def switch(name: str, force: bool = False):
+    db = next(get_db())
+    try:
+        space = resolve_space(name)
+        if db.get(EmbeddingSpace, space) is None:
+            print(f"{space} has not been backfilled.")
+            return
+        missing = missing_note_ids(db, space, limit=1000)
+        if missing and not force:
+            print(f"{len(missing)}{'+' if len(missing) == 1000 else ''} notes have no {space} vector yet. "
+                  "Finish the backfill first or pass --force to re-enrich them after the switch.")
+            return
+        stragglers = switch_space(db, space)
+        print(f"Switched search to {space}.")
+        if stragglers:
+            from worker import enqueue_enrichment
+            note_service = NoteService(db)
+            note_service.set_notes_status(stragglers, "pending")
+            enqueue_enrichment(stragglers)
+            print(f"Queued {len(stragglers)} notes for re-enrichment in the new space.")
+    finally:
+        db.close()
+
+
+def fit_local(sample: int = 20000, dim: int = None):
+    """Fit the built-in local embedding model (LSA over hashed n-grams) on the newest notes."""
+    db = next(get_db())
+    try:
+        texts = [row[0] for row in db.query(KnowledgeNote.content).filter(
+            KnowledgeNote.is_deleted == False
+        ).order_by(KnowledgeNote.id.desc()).limit(sample)]
+    finally:
+        db.close()
+    if not texts:
+        print("No notes to fit on.")
+        return
+    start = time.time()
+    model_id = fit_lsa(texts, dim)
+    print(f"Fitted local:{model_id} on {len(texts)} notes in {time.time() - start:.1f}s. New local embeddings use it; "
+          "run 'python reembed.py backfill local' and 'python reembed.py switch local' to search with it.")
+
+
+def prune():
+    db = next(get_db())
+    try:
+        print(f"Removed {prune_spaces(db)} vectors of inactive embedding spaces.")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move the corpus to another embedding space without downtime")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("backfill", help="Re-embed all notes into a provider's space (resumable)")
+    run.add_argument("provider", choices=["openai", "gemini", "claude", "local"])
+    run.add_argument("--workers", type=int, default=4, help="Batches embedded in parallel")
+    run.add_argument("--batch-size", type=int, default=None)
+    run.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between rounds")
+    sub.add_parser("status", help="List embedding spaces and backfill progress")
+    flip = sub.add_parser("switch", help="Atomically make a backfilled space the active one")
+    flip.add_argument("space", help="Provider name or full space name")
+    flip.add_argument("--force", action="store_true", help="Switch even if some notes are missing")
+    sub.add_parser("prune", help="Delete vectors of retired spaces")
+    fit = sub.add_parser("fit-local", help="Fit the local embedding model on the newest notes")
+    fit.add_argument("--sample", type=int, default=20000)
+    fit.add_argument("--dim", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        backfill(args.provider, args.workers, args.batch_size, args.pause)
+    elif args.command == "status":
+        status()
+    elif args.command == "switch":
+        switch(args.space, args.force)
+    elif args.command == "prune":
+        prune()
+    elif args.command == "fit-local":
+        fit_local(args.sample, args.dim)
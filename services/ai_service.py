@@ -1,15 +1,118 @@
 import json
+import time
+import heapq
+import asyncio
+import threading
 import numpy as np
 from config import Config
-from openai import OpenAI
-import google.generativeai as genai
-import anthropic
+from models import space_name, parse_space
+from services.vector_index import get_vector_index, get_passage_index
+from services.embedding_cache import get_embedding_cache
+from services.rate_limiter import call_with_retry, acall_with_retry, estimate_tokens
+from services.keyword_index import get_keyword_index, reciprocal_rank_fusion
+from services.metrics import SEARCH_STAGE_SECONDS
+from services.local_embedder import get_local_embedder, embed_texts
+
+# Provider SDKs, imported by load_sdk when a provider is first used: each is slow to
+# import, and the app should only pay for the one that is selected
+OpenAI = AsyncOpenAI = genai = anthropic = None
+_sdk_lock = threading.Lock()
+
+def classify_prompt(text: str):
+    return f"""
+        Analyze the following text and provide a category and a list of tags.
+        Output JSON format only: {{"category": "CategoryName", "tags": ["tag1", "tag2"]}}
+        Text: {text[:1000]}
+        """
+
+def parse_gemini_json(text: str):
+    # Gemini often returns text with markdown code blocks
+    clean_text = text.replace("```json", "").replace("```", "").strip()
+    return json.loads(clean_text)
+
+def parse_claude_json(content: str):
+    # Cleanup potential non-json
+    start_idx = content.find('{')
+    end_idx = content.rfind('}') + 1
+    if start_idx != -1 and end_idx != -1:
+        json_str = content[start_idx:end_idx]
+        return json.loads(json_str)
+    return {"category": "Uncategorized", "tags": []}
+
+PASSAGE_BREAKS = ("\n\n", "\n", "。", ". ", "! ", "? ", " ")
+
+def split_passages(text: str, size: int = None, overlap: int = None):
+    """
+    Split text into overlapping passages of about `size` characters, cutting at a
+    paragraph, line, sentence or word break when one falls in the last third.
+    Returns [(start offset, passage), ...]; text that fits in one passage comes back whole.
+    """
+    size = size or Config.PASSAGE_CHARS
+    overlap = Config.PASSAGE_OVERLAP if overlap is None else overlap
+    if len(text) <= size:
+        return [(0, text)]
+    passages = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            floor = start + size * 2 // 3
+            for sep in PASSAGE_BREAKS:
+                cut = text.rfind(sep, floor, end)
+                if cut != -1:
+                    end = cut + len(sep)
+                    break
+        passages.append((start, text[start:end]))
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        # Start the overlap on a word boundary when there is one nearby
+        space = text.find(" ", next_start, end)
+        start = space + 1 if space != -1 else next_start
+    return passages
+
+def pool_passages(spans, vectors):
+    """Passage records for NoteService plus the note vector (normalized mean of the passages)."""
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    mean = (matrix / norms).mean(axis=0)
+    passages = [{"position": i, "start": start, "content": content, "embedding": vector}
+                for i, ((start, content), vector) in enumerate(zip(spans, vectors))]
+    return mean / (np.linalg.norm(mean) or 1), passages
+
+# Services bound to other embedding spaces than the configured provider's, by (provider, space name)
+_space_services = {}
+
+# Services for the configured provider, see get_ai_service
+_services = {}
+_services_lock = threading.Lock()
+
+# Monotonic time until which query embedding is skipped after a failure (keyword-only search meanwhile)
+_embedding_down_until = 0.0
+
+def load_sdk(provider: str):
+    global OpenAI, AsyncOpenAI, genai, anthropic
+    with _sdk_lock:
+        if provider == "openai" and OpenAI is None:
+            from openai import OpenAI, AsyncOpenAI
+        elif provider == "gemini" and genai is None:
+            import google.generativeai as genai
+        elif provider == "claude" and anthropic is None:
+            import anthropic
+
+class AIProviderError(Exception):
+    """A provider call failed after retries. Callers should requeue rather than store a fallback."""
 
 class AIService:
-    def __init__(self):
-        self.provider = Config.AI_PROVIDER.lower()
+    def __init__(self, provider: str = None, local_model: str = None):
+        self.provider = (provider or Config.AI_PROVIDER).lower()
         self.openai_client = None
         self.anthropic_client = None
+        self.async_openai_client = None
+        self.async_anthropic_client = None
+        self.local_embedder = None
+        load_sdk(self.provider)
         
         # Initialize clients based on provider
         if self.provider == "openai":
@@ -24,111 +127,399 @@ class AIService:
             if Config.ANTHROPIC_API_KEY and Config.ANTHROPIC_API_KEY != "your_anthropic_api_key":
                 self.anthropic_client = anthropic.Anthropic(api_key=Config.ANTHROPIC_API_KEY)
 
+        # Embeddings on this machine's CPU. Anthropic has no embedding API, so "claude"
+        # embeds locally too. local_model picks an older fitted model (see for_space).
+        if self.provider in ("local", "claude"):
+            self.local_embedder = get_local_embedder(local_model)
+
+    @property
+    def embedding_model(self):
+        """Name of the model generate_embedding uses, stored alongside each vector."""
+        if self.provider == "openai" and self.openai_client:
+            return "text-embedding-3-small"
+        elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
+            return "models/text-embedding-004"
+        elif self.local_embedder is not None:
+            return self.local_embedder.model_id
+        return "mock"
+
+    @property
+    def embedding_provider(self):
+        """Provider recorded with each vector: "local" for "claude", whose vectors come from the local embedder."""
+        return "local" if self.local_embedder is not None else self.provider
+
+    @property
+    def embedding_space(self):
+        """Vectors are only comparable within one space, see services/embedding_space.py."""
+        return space_name(self.embedding_provider, self.embedding_model)
+
+    def for_space(self, space: str):
+        """
+        A service that embeds into `space`: this one, or one for that space's provider.
+        Raises AIProviderError when this process can't produce vectors in it (e.g. no API key).
+        """
+        if space is None or space == self.embedding_space:
+            return self
+        service = _space_services.get((self.provider, space))
+        if service is None:
+            provider, model = parse_space(space)
+            if provider == "local" and self.local_embedder is not None:
+                provider = self.provider  # "claude" keeps classifying with Claude
+            try:
+                service = AIService(provider=provider, local_model=model if provider in ("local", "claude") else None)
+            except Exception as e:
+                raise AIProviderError(f"Cannot embed into {space} here: {e}") from e
+            if service.embedding_space != space:
+                raise AIProviderError(f"Cannot embed into {space} here (got {service.embedding_space})")
+            _space_services[(self.provider, space)] = service
+        return service
+
+    @property
+    def chat_model(self):
+        return {"openai": "gpt-3.5-turbo", "gemini": "gemini-pro", "claude": "claude-3-opus-20240229"}.get(self.provider, "mock")
+
+    def _embed(self, text: str, max_retries: int = None):
+        """Provider call without fallback; raises on errors."""
+        if self.local_embedder is not None:
+            return embed_texts(self.local_embedder, [text])[0]
+
+        elif self.provider == "openai" and self.openai_client:
+            response = call_with_retry(lambda: self.openai_client.embeddings.create(
+                input=text,
+                model="text-embedding-3-small"
+            ), self.provider, self.embedding_model, estimate_tokens(text), max_retries=max_retries)
+            return response.data[0].embedding
+        
+        elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
+            # Gemini text-embedding-004
+            result = call_with_retry(lambda: genai.embed_content(
+                model="models/text-embedding-004",
+                content=text,
+                task_type="retrieval_document"
+            ), self.provider, self.embedding_model, estimate_tokens(text), max_retries=max_retries)
+            return result['embedding']
+            
+        raise AIProviderError(f"No embedding API configured for {self.provider}")
+
     def generate_embedding(self, text: str):
         try:
-            if self.provider == "openai" and self.openai_client:
-                response = self.openai_client.embeddings.create(
-                    input=text,
-                    model="text-embedding-3-small"
-                )
-                return response.data[0].embedding
-            
-            elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
-                # Gemini text-embedding-004
-                result = genai.embed_content(
-                    model="models/text-embedding-004",
-                    content=text,
-                    task_type="retrieval_document"
-                )
-                return result['embedding']
-                
-            elif self.provider == "claude":
-                # Claude doesn't have a direct embedding API yet (typically), 
-                # often uses Voyage AI or similar. 
-                # For simplicity, we might fallback to OpenAI or mock if pure Claude is requested.
-                # However, for this demo, let's assume we fallback to mock or warn.
-                # NOTE: Anthropic generally recommends external embedding providers.
-                # We will return random for now to avoid crashing, or user needs to use OpenAI for embeddings.
-                print("Warning: Claude provider selected but Anthropic has no native embedding API. Returning mock.")
-                return np.random.rand(1536).tolist()
-                
+            return self._embed(text)
+        except Exception as e:
+            # No random fallback: a fake vector would silently corrupt search
+            raise AIProviderError(f"Error generating embedding ({self.provider}): {e}") from e
+
+    def _embed_batch(self, texts: list):
+        """One provider call for many inputs; raises on errors."""
+        if self.local_embedder is not None:
+            # Large batches are featurized on every core
+            return embed_texts(self.local_embedder, texts)
+
+        elif self.provider == "openai" and self.openai_client:
+            response = call_with_retry(lambda: self.openai_client.embeddings.create(
+                input=texts,
+                model="text-embedding-3-small"
+            ), self.provider, self.embedding_model, estimate_tokens(texts))
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
+            result = call_with_retry(lambda: genai.embed_content(
+                model="models/text-embedding-004",
+                content=texts,
+                task_type="retrieval_document"
+            ), self.provider, self.embedding_model, estimate_tokens(texts))
+            return result['embedding']
+
+        return [self._embed(text) for text in texts]
+
+    def generate_embeddings(self, texts: list):
+        """
+        Embed many texts in one request. If the batch call fails, each text is
+        retried on its own so one bad input does not sink the others; entries
+        that still fail come back as None.
+        """
+        if not texts:
+            return []
+        try:
+            return self._embed_batch(texts)
+        except Exception as e:
+            print(f"Batch embedding failed ({self.provider}), retrying one by one: {e}")
+        embeddings = []
+        for text in texts:
+            try:
+                embeddings.append(self._embed(text))
+            except Exception as e:
+                print(f"Error generating embedding ({self.provider}): {e}")
+                embeddings.append(None)
+        return embeddings
+
+    def embed_notes(self, texts: list):
+        """
+        Embed notes, splitting long ones into passages, with all passages sent in
+        batched requests. Returns [(embedding, passages), ...] in input order;
+        passages is [] for short notes, and entries that failed are None.
+        """
+        spans = [split_passages(text) for text in texts]
+        flat = [content for note_spans in spans for _, content in note_spans]
+        vectors = []
+        for start in range(0, len(flat), Config.EMBED_BATCH_SIZE):
+            vectors.extend(self.generate_embeddings(flat[start:start + Config.EMBED_BATCH_SIZE]))
+        results, offset = [], 0
+        for note_spans in spans:
+            note_vectors = vectors[offset:offset + len(note_spans)]
+            offset += len(note_spans)
+            if any(vector is None for vector in note_vectors):
+                results.append(None)
+            elif len(note_spans) == 1:
+                results.append((note_vectors[0], []))
             else:
-                return np.random.rand(1536).tolist()
-                
+                results.append(pool_passages(note_spans, note_vectors))
+        return results
+
+    def embed_note(self, text: str):
+        """(embedding, passages) for one note; raises AIProviderError."""
+        if len(split_passages(text)) == 1:
+            return self.generate_embedding(text), []
+        result = self.embed_notes([text])[0]
+        if result is None:
+            raise AIProviderError(f"Error embedding passages ({self.provider})")
+        return result
+
+    def embedding_available(self):
+        """False when no real embedding provider is configured or it failed moments ago."""
+        return self.embedding_model != "mock" and time.monotonic() >= _embedding_down_until
+
+    def generate_query_embedding(self, text: str):
+        """Embedding for a search query, served from the shared query cache when possible."""
+        global _embedding_down_until
+        if self.embedding_model == "mock":
+            # No embedder: the caller falls back to keyword search
+            return None
+        try:
+            if self.local_embedder is not None:
+                # Computing it is cheaper than a Redis round trip
+                return self._embed(text)
+            # Interactive path: no retry loop, the caller falls back to keyword search
+            return get_embedding_cache().get_or_compute(
+                self.provider, self.embedding_model, text, lambda: self._embed(text, max_retries=0)
+            )
         except Exception as e:
             print(f"Error generating embedding ({self.provider}): {e}")
-            return np.random.rand(1536).tolist()
+            _embedding_down_until = time.monotonic() + Config.EMBEDDING_RETRY_AFTER
+            return None
 
     def classify_and_tag(self, text: str):
-        prompt = f"""
-        Analyze the following text and provide a category and a list of tags.
-        Output JSON format only: {{"category": "CategoryName", "tags": ["tag1", "tag2"]}}
-        Text: {text[:1000]}
-        """
+        prompt = classify_prompt(text)
         
         try:
             if self.provider == "openai" and self.openai_client:
-                response = self.openai_client.chat.completions.create(
+                response = call_with_retry(lambda: self.openai_client.chat.completions.create(
                     model="gpt-3.5-turbo",
                     messages=[{"role": "user", "content": prompt}],
                     response_format={"type": "json_object"}
-                )
+                ), self.provider, self.chat_model, estimate_tokens(prompt))
                 content = response.choices[0].message.content
                 return json.loads(content)
                 
             elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
                 model = genai.GenerativeModel('gemini-pro')
-                response = model.generate_content(prompt)
-                # Gemini often returns text with markdown code blocks
-                clean_text = response.text.replace("```json", "").replace("```", "").strip()
-                return json.loads(clean_text)
+                response = call_with_retry(lambda: model.generate_content(prompt),
+                                           self.provider, self.chat_model, estimate_tokens(prompt))
+                return parse_gemini_json(response.text)
                 
             elif self.provider == "claude" and self.anthropic_client:
-                message = self.anthropic_client.messages.create(
+                message = call_with_retry(lambda: self.anthropic_client.messages.create(
                     model="claude-3-opus-20240229",
                     max_tokens=1000,
                     messages=[
                         {"role": "user", "content": prompt}
                     ]
-                )
-                # Extract text content
-                content = message.content[0].text
-                # Cleanup potential non-json
-                start_idx = content.find('{')
-                end_idx = content.rfind('}') + 1
-                if start_idx != -1 and end_idx != -1:
-                    json_str = content[start_idx:end_idx]
-                    return json.loads(json_str)
-                return {"category": "Uncategorized", "tags": []}
+                ), self.provider, self.chat_model, estimate_tokens(prompt))
+                return parse_claude_json(message.content[0].text)
                 
             else:
                 return {"category": "General", "tags": ["mock_tag"]}
                 
-        except Exception as e:
-            print(f"Error classifying text ({self.provider}): {e}")
+        except json.JSONDecodeError as e:
+            # The model answered but not with JSON; retrying won't help
+            print(f"Unparseable classification ({self.provider}): {e}")
             return {"category": "Uncategorized", "tags": []}
+        except Exception as e:
+            raise AIProviderError(f"Error classifying text ({self.provider}): {e}") from e
+
+    # Async API: same behaviour as the sync methods, on the SDKs' async clients
+
+    def _ensure_async_clients(self):
+        if self.provider == "openai" and self.openai_client and self.async_openai_client is None:
+            self.async_openai_client = AsyncOpenAI(api_key=Config.OPENAI_API_KEY, base_url=Config.OPENAI_BASE_URL)
+        elif self.provider == "claude" and self.anthropic_client and self.async_anthropic_client is None:
+            self.async_anthropic_client = anthropic.AsyncAnthropic(api_key=Config.ANTHROPIC_API_KEY)
+
+    async def aclose(self):
+        # Async HTTP pools belong to the event loop that created them
+        if self.async_openai_client is not None:
+            await self.async_openai_client.close()
+            self.async_openai_client = None
+        if self.async_anthropic_client is not None:
+            await self.async_anthropic_client.close()
+            self.async_anthropic_client = None
+
+    async def _aembed(self, text: str):
+        self._ensure_async_clients()
+        if self.provider == "openai" and self.async_openai_client:
+            response = await acall_with_retry(lambda: self.async_openai_client.embeddings.create(
+                input=text,
+                model="text-embedding-3-small"
+            ), self.provider, self.embedding_model, estimate_tokens(text))
+            return response.data[0].embedding
+
+        elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
+            result = await acall_with_retry(lambda: genai.embed_content_async(
+                model="models/text-embedding-004",
+                content=text,
+                task_type="retrieval_document"
+            ), self.provider, self.embedding_model, estimate_tokens(text))
+            return result['embedding']
+
+        return self._embed(text)
+
+    async def agenerate_embedding(self, text: str):
+        try:
+            return await self._aembed(text)
+        except Exception as e:
+            raise AIProviderError(f"Error generating embedding ({self.provider}): {e}") from e
+
+    async def aembed_note(self, text: str):
+        """Async embed_note: passages of a long note are embedded concurrently."""
+        spans = split_passages(text)
+        if len(spans) == 1:
+            return await self.agenerate_embedding(text), []
+        vectors = await asyncio.gather(*(self.agenerate_embedding(content) for _, content in spans))
+        return pool_passages(spans, vectors)
+
+    async def aclassify_and_tag(self, text: str):
+        self._ensure_async_clients()
+        prompt = classify_prompt(text)
+
+        try:
+            if self.provider == "openai" and self.async_openai_client:
+                response = await acall_with_retry(lambda: self.async_openai_client.chat.completions.create(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": prompt}],
+                    response_format={"type": "json_object"}
+                ), self.provider, self.chat_model, estimate_tokens(prompt))
+                return json.loads(response.choices[0].message.content)
+
+            elif self.provider == "gemini" and Config.GOOGLE_API_KEY:
+                model = genai.GenerativeModel('gemini-pro')
+                response = await acall_with_retry(lambda: model.generate_content_async(prompt),
+                                                  self.provider, self.chat_model, estimate_tokens(prompt))
+                return parse_gemini_json(response.text)
+
+            elif self.provider == "claude" and self.async_anthropic_client:
+                message = await acall_with_retry(lambda: self.async_anthropic_client.messages.create(
+                    model="claude-3-opus-20240229",
+                    max_tokens=1000,
+                    messages=[{"role": "user", "content": prompt}]
+                ), self.provider, self.chat_model, estimate_tokens(prompt))
+                return parse_claude_json(message.content[0].text)
 
-    def cosine_similarity(self, v1, v2):
-        if not v1 or not v2:
-            return 0
-        # Ensure vectors are same length (handle provider switch edge case)
-        if len(v1) != len(v2):
-            return 0
-        return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
-
-    def search_similar(self, query_text: str, notes: list, top_k=10):
-        if not query_text:
-            return notes
-        
-        query_embedding = self.generate_embedding(query_text)
-        
-        scored_notes = []
-        for note in notes:
-            if note.embedding:
-                score = self.cosine_similarity(query_embedding, note.embedding)
-                scored_notes.append((score, note))
             else:
-                scored_notes.append((0, note))
-        
-        scored_notes.sort(key=lambda x: x[0], reverse=True)
-        return [note for score, note in scored_notes[:top_k]]
+                return {"category": "General", "tags": ["mock_tag"]}
+
+        except json.JSONDecodeError as e:
+            print(f"Unparseable classification ({self.provider}): {e}")
+            return {"category": "Uncategorized", "tags": []}
+        except Exception as e:
+            raise AIProviderError(f"Error classifying text ({self.provider}): {e}") from e
+
+    async def aenrich(self, text: str):
+        """Classification and embedding for one text, run concurrently. Returns (ai_data, embedding, passages)."""
+        ai_data, (embedding, passages) = await asyncio.gather(self.aclassify_and_tag(text), self.aembed_note(text))
+        return ai_data, embedding, passages
+
+    async def aenrich_many(self, texts: list, concurrency: int = None, close_clients: bool = True):
+        """
+        Enrich many texts with at most `concurrency` in flight. Returns a list of
+        (ai_data, embedding, passages) in input order; entries that failed are None.
+        close_clients=False keeps the async clients for the next call on the same event loop.
+        """
+        semaphore = asyncio.Semaphore(concurrency or Config.AI_CONCURRENCY)
+
+        async def run(text):
+            async with semaphore:
+                try:
+                    return await self.aenrich(text)
+                except Exception as e:
+                    print(f"Error enriching text ({self.provider}): {e}")
+                    return None
+
+        try:
+            return await asyncio.gather(*(run(text) for text in texts))
+        finally:
+            if close_clients:
+                await self.aclose()
+
+    def semantic_search(self, query_embedding, top_k=10, allowed_ids=None, passages: dict = None):
+        """
+        Note vectors and passage vectors scored together; each note keeps its best
+        score (max-pooling). passages, if given, is filled with note_id -> chunk id
+        of the best matching passage of long notes.
+        """
+        with SEARCH_STAGE_SECONDS.time(stage="vector"):
+            best = dict(get_vector_index().search(query_embedding, top_k=top_k, allowed_ids=allowed_ids))
+        with SEARCH_STAGE_SECONDS.time(stage="passages"):
+            passage_hits = get_passage_index().search_notes(query_embedding, top_k=top_k, allowed_ids=allowed_ids)
+        for note_id, score, chunk_id in passage_hits:
+            if passages is not None:
+                passages[note_id] = chunk_id
+            if score > best.get(note_id, -1.0):
+                best[note_id] = score
+        return heapq.nlargest(top_k, best.items(), key=lambda item: item[1])
+
+    def search_note_ids(self, query_text: str, top_k=10, allowed_ids=None, mode: str = None, passages: dict = None):
+        """
+        [(note_id, score), ...] from the shared indexes, without loading notes.
+        mode is "semantic", "keyword" or "hybrid" (reciprocal rank fusion of both).
+        When no embedding provider is reachable the keyword ranking is returned alone.
+        passages is passed on to semantic_search.
+        """
+        mode = mode or Config.SEARCH_MODE
+        candidates = max(top_k * 5, 50)
+        try:
+            # The query must be embedded in the index's space, whichever provider is selected
+            embedder = self.for_space(get_vector_index().space)
+        except AIProviderError as e:
+            print(f"{e}; using keyword search")
+            embedder = None
+        semantic = embedder is not None and embedder.embedding_available()
+        keyword_results = []
+        if mode in ("keyword", "hybrid") or not semantic:
+            with SEARCH_STAGE_SECONDS.time(stage="keyword"):
+                keyword_results = get_keyword_index().search(query_text, top_k=candidates, allowed_ids=allowed_ids)
+            if mode == "keyword" or not semantic:
+                return keyword_results[:top_k]
+
+        with SEARCH_STAGE_SECONDS.time(stage="query_embedding"):
+            query_embedding = embedder.generate_query_embedding(query_text)
+        if query_embedding is None:
+            if not keyword_results:
+                keyword_results = get_keyword_index().search(query_text, top_k=top_k, allowed_ids=allowed_ids)
+            return keyword_results[:top_k]
+        semantic_results = self.semantic_search(query_embedding, top_k=candidates, allowed_ids=allowed_ids, passages=passages)
+        if mode == "semantic":
+            return semantic_results[:top_k]
+        with SEARCH_STAGE_SECONDS.time(stage="fusion"):
+            return reciprocal_rank_fusion([semantic_results, keyword_results], k=Config.RRF_K, top_k=top_k)
+
+
+def get_ai_service(provider: str = None):
+    """
+    The process-wide AIService for `provider` (default Config.AI_PROVIDER), so SDK
+    clients and their connection pools are built once and reused by every job.
+    """
+    provider = (provider or Config.AI_PROVIDER).lower()
+    with _services_lock:
+        service = _services.get(provider)
+        if service is None:
+            service = _services[provider] = AIService(provider=provider)
+    return service
@@ -0,0 +1,425 @@
+import os
+import json
+import time
+import shutil
+import datetime
+import threading
+import numpy as np
+from config import Config
+from services.vector_index import VectorIndex
+
+MANIFEST = "manifest.json"
+LOCK_FILE = "compact.lock"
+SEGMENT_FILES = ("centroids", "offsets", "vectors", "ids", "sorted_ids")
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def _assign(vectors, centroids, chunk=8192):
+    labels = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], chunk):
+        labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist: int, iterations: int = 10, sample: int = 50000, seed: int = 0):
+    """Spherical k-means on a sample of the (normalized) vectors."""
+    rng = np.random.default_rng(seed)
+    if vectors.shape[0] > sample:
+        vectors = vectors[np.sort(rng.choice(vectors.shape[0], sample, replace=False))]
+    centroids = vectors[rng.choice(vectors.shape[0], nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        sums = np.add.reduceat(vectors[order], starts[filled], axis=0)
+        centroids[filled] = sums
+        centroids = _normalize_rows(centroids)
+    return centroids
+
+
+def write_segment(directory: str, ids, vectors, synced_at=None, nlist: int = None, space: str = None):
+    """
+    Cluster vectors into IVF lists and write them as .npy segment files.
+    The manifest is swapped atomically so readers never see a half-written segment.
+    """
+    os.makedirs(directory, exist_ok=True)
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+    if not nlist:
+        nlist = Config.ANN_NLIST or int(4 * np.sqrt(vectors.shape[0]))
+    nlist = max(1, min(nlist, vectors.shape[0]))
+
+    centroids = train_centroids(vectors, nlist)
+    labels = _assign(vectors, centroids)
+    order = np.argsort(labels, kind="stable")
+    offsets = np.searchsorted(labels[order], np.arange(nlist + 1)).astype(np.int64)
+
+    name = f"seg-{time.time_ns()}"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "centroids.npy"), centroids)
+    np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+    np.save(os.path.join(tmp_path, "vectors.npy"), vectors[order])
+    np.save(os.path.join(tmp_path, "ids.npy"), ids[order])
+    np.save(os.path.join(tmp_path, "sorted_ids.npy"), np.sort(ids))
+    os.rename(tmp_path, os.path.join(directory, name))
+
+    manifest = {
+        "segment": name,
+        "count": int(ids.shape[0]),
+        "dim": int(vectors.shape[1]),
+        "nlist": int(nlist),
+        "synced_at": synced_at.isoformat() if synced_at else None,
+        "space": space,
+    }
+    manifest_tmp = os.path.join(directory, MANIFEST + ".tmp")
+    with open(manifest_tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_tmp, os.path.join(directory, MANIFEST))
+    _remove_old_segments(directory, keep={name})
+    return manifest
+
+
+def _remove_old_segments(directory: str, keep: set, keep_latest: int = 1):
+    # Leave the previous segment around for readers that have not reopened yet
+    segments = sorted(d for d in os.listdir(directory) if d.startswith("seg-") and d not in keep)
+    for name in segments[:len(segments) - keep_latest] if keep_latest else segments:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+class AnnIndex:
+    """
+    IVF approximate nearest-neighbour index backed by memory-mapped segment files.
+
+    The base segment is immutable and opened with mmap, so every process on the
+    host shares the same pages. Changes since the segment was written live in a
+    small in-memory delta (an exact VectorIndex) plus a tombstone set, until a
+    compaction folds them into a new segment.
+    """
+
+    def __init__(self, directory: str, nprobe: int = None):
+        self.directory = directory
+        self.nprobe = nprobe or Config.ANN_NPROBE
+        self.dim = None
+        self.loaded = False
+        self.synced_at = None
+        self.space = None
+        self._lock = threading.RLock()
+        self._segment = None
+        self._segment_name = None
+        self._manifest_mtime = None
+        self._delta = VectorIndex()
+        self._tombstones = set()
+        self._tombstone_array = None
+        self._compacting = False
+
+    def __len__(self):
+        base = self._segment["ids"].shape[0] if self._segment else 0
+        return base - len(self._tombstones) + len(self._delta)
+
+    def __contains__(self, note_id):
+        return note_id in self._delta or (self._in_base(note_id) and note_id not in self._tombstones)
+
+    # Segment lifecycle
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return None, None
+        mtime = os.stat(path).st_mtime_ns
+        with open(path) as f:
+            return json.load(f), mtime
+
+    def open(self):
+        """Map the current segment. Returns False when no segment has been written yet."""
+        manifest, mtime = self._read_manifest()
+        if not manifest:
+            return False
+        if self.space is not None and manifest.get("space") not in (None, self.space):
+            # Segment of another embedding space (e.g. before a switch): rebuild instead
+            return False
+        path = os.path.join(self.directory, manifest["segment"])
+        segment = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in SEGMENT_FILES}
+        with self._lock:
+            delta, tombstones = self._delta, self._tombstones
+            self._segment = segment
+            self._segment_name = manifest["segment"]
+            self._manifest_mtime = mtime
+            self.dim = manifest["dim"]
+            self._delta = VectorIndex(dim=self.dim)
+            self._tombstones = set()
+            self._tombstone_array = None
+            synced_at = manifest.get("synced_at")
+            self.synced_at = datetime.datetime.fromisoformat(synced_at) if synced_at else None
+            self._carry_over(delta, tombstones)
+        return True
+
+    def _carry_over(self, delta, tombstones):
+        """
+        Re-apply the changes of the previous delta and tombstones that the new segment
+        doesn't hold (e.g. made while it was being written), so removed notes stay removed.
+        """
+        ids, vectors = delta.snapshot()
+        for note_id in tombstones - set(ids.tolist()):
+            self._tombstone(note_id)
+        if not ids.shape[0]:
+            return
+        rows, found = self._base_rows(self._segment, ids)
+        same = np.zeros(ids.shape[0], dtype=bool)
+        if found.any() and vectors.shape[1] == self.dim:
+            same[found] = np.all(np.isclose(self._segment["vectors"][rows[found]], vectors[found], atol=1e-6), axis=1)
+        for note_id, vector in zip(ids[~same].tolist(), vectors[~same]):
+            self._tombstone(note_id)
+            self._delta.upsert(note_id, vector)
+
+    def reload_if_stale(self):
+        """Reopen when a compaction wrote a new segment; sync_index then replays newer rows."""
+        path = os.path.join(self.directory, MANIFEST)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._manifest_mtime:
+            return False
+        manifest, _ = self._read_manifest()
+        if manifest and manifest["segment"] != self._segment_name:
+            return self.open()
+        self._manifest_mtime = mtime
+        return False
+
+    def load(self, db):
+        with self._lock:
+            if not self.open():
+                staging = VectorIndex()
+                staging.space = self.space
+                staging.load(db)
+                ids, vectors = staging.snapshot()
+                if ids.shape[0]:
+                    write_segment(self.directory, ids, vectors, synced_at=staging.synced_at, space=self.space)
+                    self.open()
+                else:
+                    self.synced_at = staging.synced_at
+            self.loaded = True
+
+    def clear(self):
+        with self._lock:
+            self._segment = None
+            self._segment_name = None
+            self._manifest_mtime = None
+            self._delta = VectorIndex()
+            self._tombstones = set()
+            self._tombstone_array = None
+            self.dim = None
+            self.loaded = False
+            self.synced_at = None
+
+    # Incremental updates
+
+    def _in_base(self, note_id):
+        if self._segment is None:
+            return False
+        sorted_ids = self._segment["sorted_ids"]
+        pos = np.searchsorted(sorted_ids, note_id)
+        return pos < sorted_ids.shape[0] and sorted_ids[pos] == note_id
+
+    def _tombstone(self, note_id):
+        if self._in_base(note_id) and note_id not in self._tombstones:
+            self._tombstones.add(note_id)
+            self._tombstone_array = None
+
+    def upsert(self, note_id: int, embedding):
+        with self._lock:
+            # The base copy is stale once a note is re-embedded; the delta shadows it
+            self._tombstone(note_id)
+            ok = self._delta.upsert(note_id, embedding)
+            if self.dim is None:
+                self.dim = self._delta.dim
+        self.maybe_compact()
+        return ok
+
+    def upsert_many(self, items):
+        for note_id, embedding in items:
+            self.upsert(note_id, embedding)
+
+    def remove(self, note_ids):
+        with self._lock:
+            self._delta.remove(note_ids)
+            for note_id in note_ids:
+                self._tombstone(note_id)
+        self.maybe_compact()
+
+    # Search
+
+    @staticmethod
+    def _base_rows(segment, note_ids):
+        """(rows, found): position of each of note_ids in the segment's list-ordered arrays, valid where found."""
+        order = segment.get("id_order")
+        if order is None:
+            order = segment["id_order"] = np.argsort(segment["ids"], kind="stable")
+        sorted_ids = segment["sorted_ids"]
+        if sorted_ids.shape[0] == 0:
+            return np.zeros(len(note_ids), dtype=np.int64), np.zeros(len(note_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(sorted_ids, note_ids), sorted_ids.shape[0] - 1)
+        return order[pos], sorted_ids[pos] == note_ids
+
+    @classmethod
+    def _rows_for(cls, segment, note_ids):
+        """Positions of note_ids in the segment's list-ordered arrays (ids not in the segment are skipped)."""
+        rows, found = cls._base_rows(segment, note_ids)
+        return np.sort(rows[found])  # ascending rows read the mmap sequentially
+
+    def search(self, query_embedding, top_k: int = 10, allowed_ids=None, nprobe: int = None):
+        """Same contract as VectorIndex.search; nprobe trades recall for latency."""
+        results = self._delta.search(query_embedding, top_k=top_k, allowed_ids=allowed_ids)
+        segment = self._segment
+        if segment is None or query_embedding is None or len(query_embedding) == 0:
+            return results
+        query = np.asarray(query_embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != self.dim:
+            return results
+        query = query / norm
+
+        centroids = segment["centroids"]
+        offsets = segment["offsets"]
+        nprobe = min(nprobe or self.nprobe, centroids.shape[0])
+        allowed = np.fromiter(allowed_ids, dtype=np.int64) if allowed_ids is not None else None
+
+        if allowed is not None and allowed.shape[0] <= segment["ids"].shape[0] * nprobe / centroids.shape[0]:
+            # Selective filter: scoring just the allowed rows is cheaper than probing, and exact
+            rows = self._rows_for(segment, allowed)
+            ids = np.asarray(segment["ids"][rows])
+            scores = segment["vectors"][rows] @ query
+            allowed = None
+        else:
+            probe = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+            ids = np.concatenate([segment["ids"][offsets[l]:offsets[l + 1]] for l in probe])
+            scores = np.concatenate([segment["vectors"][offsets[l]:offsets[l + 1]] @ query for l in probe])
+
+        with self._lock:
+            if self._tombstones and self._tombstone_array is None:
+                self._tombstone_array = np.fromiter(self._tombstones, dtype=np.int64)
+            tombstones = self._tombstone_array if self._tombstones else None
+        mask = np.ones(ids.shape[0], dtype=bool)
+        if tombstones is not None:
+            mask &= ~np.isin(ids, tombstones)
+        if allowed is not None:
+            mask &= np.isin(ids, allowed)
+        ids, scores = ids[mask], scores[mask]
+
+        if ids.shape[0]:
+            k = min(top_k, ids.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            results = results + [(int(ids[i]), float(scores[i])) for i in top]
+        results.sort(key=lambda x: x[1], reverse=True)
+        return results[:top_k]
+
+    # Compaction
+
+    def pending_changes(self):
+        return len(self._tombstones) + len(self._delta)
+
+    def maybe_compact(self):
+        """Start a background compaction once the delta/tombstones outgrow the base segment."""
+        if not self.loaded:
+            return False
+        base = self._segment["ids"].shape[0] if self._segment else 0
+        pending = self.pending_changes()
+        if self._compacting or pending < Config.ANN_COMPACT_MIN_CHANGES:
+            return False
+        if base and pending < Config.ANN_COMPACT_RATIO * base:
+            return False
+        self._compacting = True
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+        return True
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"ANN compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    def compact(self):
+        """
+        Fold the delta and tombstones into a fresh segment. Only one process compacts at a time,
+        and only one that loaded the index: any other holds just its own changes.
+        """
+        if not self.loaded:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.directory, LOCK_FILE)
+        try:
+            if os.path.exists(lock_path) and time.time() - os.stat(lock_path).st_mtime > 3600:
+                os.remove(lock_path)  # stale lock from a crashed process
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        try:
+            with self._lock:
+                parts_ids, parts_vectors = [], []
+                if self._segment is not None:
+                    keep = np.ones(self._segment["ids"].shape[0], dtype=bool)
+                    if self._tombstones:
+                        keep = ~np.isin(self._segment["ids"], np.fromiter(self._tombstones, dtype=np.int64))
+                    parts_ids.append(np.asarray(self._segment["ids"][keep]))
+                    parts_vectors.append(np.asarray(self._segment["vectors"][keep]))
+                delta_ids, delta_vectors = self._delta.snapshot()
+                parts_ids.append(delta_ids)
+                if delta_vectors.shape[0]:
+                    parts_vectors.append(delta_vectors)
+                synced_at = self.synced_at
+            ids = np.concatenate(parts_ids)
+            if not ids.shape[0]:
+                return None
+            manifest = write_segment(self.directory, ids, np.concatenate(parts_vectors), synced_at=synced_at, space=self.space)
+            # Changes made while the segment was written are carried over by open()
+            self.reload_if_stale()
+            return manifest
+        finally:
+            os.close(fd)
+            os.remove(lock_path)
+
+
+def evaluate_recall(index: AnnIndex, queries=None, top_k: int = 10, nprobe: int = None, sample: int = 100):
+    """
+    Compare ANN results against an exhaustive scan of the same data (all lists probed).
+    Queries default to a random sample of indexed vectors.
+    """
+    if index._segment is None:
+        return {"queries": 0, "recall": None}
+    if queries is None:
+        vectors = index._segment["vectors"]
+        rng = np.random.default_rng(0)
+        picks = rng.choice(vectors.shape[0], min(sample, vectors.shape[0]), replace=False)
+        queries = [np.asarray(vectors[i]) for i in picks]
+
+    nlist = index._segment["centroids"].shape[0]
+    hits, ann_times, exact_times = 0, [], []
+    for query in queries:
+        start = time.perf_counter()
+        approx = index.search(query, top_k=top_k, nprobe=nprobe)
+        ann_times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        exact = index.search(query, top_k=top_k, nprobe=nlist)
+        exact_times.append(time.perf_counter() - start)
+        hits += len({i for i, _ in approx} & {i for i, _ in exact})
+
+    expected = sum(min(top_k, len(index)) for _ in queries)
+    return {
+        "queries": len(queries),
+        "top_k": top_k,
+        "nprobe": min(nprobe or index.nprobe, nlist),
+        "nlist": nlist,
+        "recall": hits / expected if expected else None,
+        "ann_ms_p50": float(np.median(ann_times) * 1000),
+        "exact_ms_p50": float(np.median(exact_times) * 1000),
+    }
@@ -0,0 +1,183 @@
+import atexit
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from models import encode_vector, decode_vector, normalize_text
+
+KEY_PREFIX = "embcache"
+LRU_KEY = f"{KEY_PREFIX}:lru"      # sorted set: key -> last access time
+STATS_KEY = f"{KEY_PREFIX}:stats"  # hash of shared counters
+
+
+def cache_key(provider: str, model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{KEY_PREFIX}:{provider}:{model}:{digest}"
+
+
+class EmbeddingCache:
+    """
+    Two-level cache for query embeddings.
+
+    A small in-process LRU answers repeat queries from the same Streamlit
+    process; behind it Redis holds packed vectors shared by every process,
+    with a TTL per entry and a size cap enforced through a last-access
+    sorted set. Redis errors degrade to the local LRU only. Hit counters are
+    kept in process and added to the shared totals every stats_flush seconds.
+    """
+
+    def __init__(self, redis_client=None, ttl: int = None, max_entries: int = None, local_size: int = None,
+                 stats_flush: float = None):
+        self.redis = redis_client
+        self.ttl = ttl or Config.QUERY_CACHE_TTL
+        self.max_entries = max_entries or Config.QUERY_CACHE_MAX_ENTRIES
+        self.local_size = local_size or Config.QUERY_CACHE_LOCAL_SIZE
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats_flush = Config.QUERY_CACHE_STATS_FLUSH if stats_flush is None else stats_flush
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "miss_seconds": 0.0}
+        self._unflushed = {}
+        self._flushed_at = time.monotonic()
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._local[key] = vector
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def _count(self, field, amount=1):
+        with self._lock:
+            self.stats[field] += amount
+            self._unflushed[field] = self._unflushed.get(field, 0) + amount
+            due = time.monotonic() - self._flushed_at >= self.stats_flush
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Add the counts since the last flush to the shared totals in one round trip."""
+        with self._lock:
+            pending, self._unflushed = self._unflushed, {}
+            self._flushed_at = time.monotonic()
+        if self.redis is None or not pending:
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for field, amount in pending.items():
+                if isinstance(amount, float):
+                    pipe.hincrbyfloat(STATS_KEY, field, amount)
+                else:
+                    pipe.hincrby(STATS_KEY, field, amount)
+            pipe.execute()
+        except Exception:
+            pass
+
+    def get(self, provider: str, model: str, text: str):
+        key = cache_key(provider, model, text)
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+        if vector is not None:
+            self._count("local_hits")
+            return vector
+
+        if self.redis is not None:
+            try:
+                blob = self.redis.get(key)
+                if blob is not None:
+                    pipe = self.redis.pipeline(transaction=False)
+                    pipe.expire(key, self.ttl)
+                    pipe.zadd(LRU_KEY, {key: time.time()})
+                    pipe.execute()
+                    vector = decode_vector(blob)
+                    self._remember(key, vector)
+                    self._count("redis_hits")
+                    return vector
+            except Exception as e:
+                print(f"Embedding cache read failed: {e}")
+        return None
+
+    def put(self, provider: str, model: str, text: str, vector):
+        key = cache_key(provider, model, text)
+        blob = encode_vector(vector)
+        vector = decode_vector(blob)
+        self._remember(key, vector)
+        if self.redis is None:
+            return vector
+        try:
+            now = time.time()
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(key, blob, ex=self.ttl)
+            pipe.zadd(LRU_KEY, {key: now})
+            # Entries whose TTL ran out are already gone; drop them from the LRU set too
+            pipe.zremrangebyscore(LRU_KEY, "-inf", now - self.ttl)
+            pipe.zcard(LRU_KEY)
+            size = pipe.execute()[-1]
+            if size > self.max_entries:
+                self._evict(size - self.max_entries)
+        except Exception as e:
+            print(f"Embedding cache write failed: {e}")
+        return vector
+
+    def _evict(self, count: int):
+        oldest = self.redis.zrange(LRU_KEY, 0, count - 1)
+        if oldest:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.delete(*oldest)
+            pipe.zrem(LRU_KEY, *oldest)
+            pipe.execute()
+
+    def get_or_compute(self, provider: str, model: str, text: str, compute):
+        """
+        Return the cached vector or call compute(). compute may raise to signal
+        a result that must not be cached (e.g. a provider error).
+        """
+        vector = self.get(provider, model, text)
+        if vector is not None:
+            return vector
+        start = time.perf_counter()
+        vector = compute()
+        self._count("misses")
+        self._count("miss_seconds", float(time.perf_counter() - start))
+        return self.put(provider, model, text, vector)
+
+    def report(self, shared: bool = True):
+        """Hit-rate counters; shared=True reads the cluster-wide totals from Redis."""
+        stats = dict(self.stats)
+        if shared and self.redis is not None:
+            self.flush()
+            try:
+                raw = self.redis.hgetall(STATS_KEY)
+                stats = {k.decode() if isinstance(k, bytes) else k: float(v) for k, v in raw.items()}
+            except Exception:
+                pass
+        hits = stats.get("local_hits", 0) + stats.get("redis_hits", 0)
+        misses = stats.get("misses", 0)
+        total = hits + misses
+        avg_miss = stats.get("miss_seconds", 0.0) / misses if misses else 0.0
+        stats.update({
+            "hit_rate": hits / total if total else 0.0,
+            "api_calls_saved": hits,
+            "avg_miss_seconds": avg_miss,
+            "seconds_saved": hits * avg_miss,
+        })
+        return stats
+
+
+_cache = None
+
+
+def get_embedding_cache():
+    global _cache
+    if _cache is None:
+        try:
+            from database import redis_binary_client
+            client = redis_binary_client
+        except Exception as e:
+            print(f"Embedding cache running without Redis: {e}")
+            client = None
+        _cache = EmbeddingCache(client)
+        atexit.register(_cache.flush)
+    return _cache
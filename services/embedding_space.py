@@ -0,0 +1,164 @@
+import datetime
+from sqlalchemy import select, and_
+from sqlalchemy.exc import IntegrityError
+from models import KnowledgeNote, NoteEmbedding, NoteChunk, EmbeddingSpace, parse_space
+from services.result_cache import invalidates_results
+
+
+def space_criteria(space: str):
+    """Filter for notes whose main embedding column belongs to `space`."""
+    provider, model = parse_space(space)
+    return [KnowledgeNote.ai_provider == provider, KnowledgeNote.embedding_model == model]
+
+
+def is_mock_space(name: str) -> bool:
+    """Spaces of a provider without an API key: nothing real is embedded in them."""
+    return parse_space(name)[1] == "mock"
+
+
+def get_active_space(db):
+    """
+    Name of the space searches and workers use. On first use the space of the
+    configured provider is recorded as active, so later provider changes in the
+    sidebar can't silently mix spaces. None while no real embedder is configured;
+    a mock space recorded earlier is replaced by the first real one.
+    """
+    row = db.query(EmbeddingSpace).filter(EmbeddingSpace.status == "active").first()
+    if row and not is_mock_space(row.name):
+        return row.name
+    from services.ai_service import AIService
+
+    name = AIService().embedding_space
+    if is_mock_space(name):
+        return None
+    try:
+        if row:
+            row.status = "retired"
+        existing = db.get(EmbeddingSpace, name)
+        if existing:
+            existing.status = "active"
+            existing.activated_at = datetime.datetime.now()
+        else:
+            db.add(EmbeddingSpace(name=name, status="active", activated_at=datetime.datetime.now()))
+        db.commit()
+    except IntegrityError:
+        # Another process registered it first
+        db.rollback()
+        row = db.query(EmbeddingSpace.name).filter(EmbeddingSpace.status == "active").first()
+        if row:
+            return row[0]
+    return name
+
+
+def register_space(db, name: str, dim: int = None):
+    """Create (or return) the row for a space about to be backfilled."""
+    space = db.get(EmbeddingSpace, name)
+    if space is None:
+        space = EmbeddingSpace(name=name, status="backfilling", dim=dim, backfill_cursor=0)
+        db.add(space)
+        db.commit()
+    return space
+
+
+def missing_note_ids(db, name: str, after_id: int = 0, limit: int = 1000):
+    """Active, embedded notes that have no vector in `name` yet, by id."""
+    done = select(NoteEmbedding.note_id).where(NoteEmbedding.space == name)
+    return [row[0] for row in db.query(KnowledgeNote.id).filter(
+        KnowledgeNote.id > after_id,
+        KnowledgeNote.is_deleted == False,
+        KnowledgeNote.embedding.isnot(None),
+        KnowledgeNote.id.notin_(done)
+    ).order_by(KnowledgeNote.id).limit(limit)]
+
+
+def backfill_progress(db, name: str):
+    done = db.query(NoteEmbedding.note_id).filter(NoteEmbedding.space == name).count()
+    total = db.query(KnowledgeNote.id).filter(
+        KnowledgeNote.is_deleted == False,
+        KnowledgeNote.embedding.isnot(None)
+    ).count()
+    return done, total
+
+
+@invalidates_results
+def switch_space(db, name: str):
+    """
+    Make `name` the active space in one transaction: the backfilled vectors are
+    promoted into the notes' embedding column and the active marker moves.
+    Readers see either the old space or the new one, never a mix.
+    Returns the ids of notes that still have no vector in the new space
+    (e.g. created after the backfill's last pass); they should be re-enriched.
+    """
+    provider, model = parse_space(name)
+    space = db.get(EmbeddingSpace, name)
+    if space is None:
+        raise ValueError(f"Unknown embedding space {name}")
+    now = datetime.datetime.now()
+    backfilled = select(NoteEmbedding.note_id).where(NoteEmbedding.space == name)
+    vector = select(NoteEmbedding.embedding).where(
+        NoteEmbedding.note_id == KnowledgeNote.id,
+        NoteEmbedding.space == name
+    ).scalar_subquery()
+    try:
+        db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(backfilled)).update({
+            KnowledgeNote.embedding: vector,
+            KnowledgeNote.ai_provider: provider,
+            KnowledgeNote.embedding_model: model,
+            KnowledgeNote.embedding_dim: space.dim,
+            KnowledgeNote.updated_at: now,
+        }, synchronize_session=False)
+        db.query(EmbeddingSpace).filter(EmbeddingSpace.status == "active").update({
+            EmbeddingSpace.status: "retired"
+        }, synchronize_session=False)
+        space.status = "active"
+        space.activated_at = now
+        stragglers = [row[0] for row in db.query(KnowledgeNote.id).filter(
+            KnowledgeNote.is_deleted == False,
+            KnowledgeNote.embedding.isnot(None),
+            ~and_(*space_criteria(name))
+        )]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return stragglers
+
+
+def prune_spaces(db, batch_size: int = 1000):
+    """
+    Delete vectors no search can use any more: promoted copies of the active
+    space, retired spaces' backfill rows, and passages of inactive spaces.
+    Runs in small batches. Returns the number of rows removed.
+    """
+    active = get_active_space(db)
+    if active is None:
+        return 0
+    backfilling = {row[0] for row in db.query(EmbeddingSpace.name).filter(EmbeddingSpace.status == "backfilling")}
+    removed = 0
+    for (space,) in db.query(NoteEmbedding.space).distinct().all():
+        if space in backfilling:
+            continue
+        while True:
+            note_ids = [row[0] for row in db.query(NoteEmbedding.note_id).filter(
+                NoteEmbedding.space == space
+            ).limit(batch_size)]
+            if note_ids:
+                db.query(NoteEmbedding).filter(
+                    NoteEmbedding.space == space, NoteEmbedding.note_id.in_(note_ids)
+                ).delete(synchronize_session=False)
+                db.commit()
+            removed += len(note_ids)
+            if len(note_ids) < batch_size:
+                break
+    keep = backfilling | {active}
+    while True:
+        chunk_ids = [row[0] for row in db.query(NoteChunk.id).filter(
+            NoteChunk.space.notin_(keep)
+        ).limit(batch_size)]
+        if chunk_ids:
+            db.query(NoteChunk).filter(NoteChunk.id.in_(chunk_ids)).delete(synchronize_session=False)
+            db.commit()
+        removed += len(chunk_ids)
+        if len(chunk_ids) < batch_size:
+            break
+    return removed
@@ -0,0 +1,83 @@
+import time
+import zlib
+import asyncio
+import threading
+import numpy as np
+from services.ai_service import AIService
+from services.keyword_index import tokenize
+
+FAKE_CATEGORIES = ["Work", "Study", "Ideas", "Reading", "Health", "Finance", "Travel", "Code"]
+
+
+class FakeAIService(AIService):
+    """
+    Deterministic offline stand-in for AIService, used by benchmark.py.
+
+    Embeddings are hashed bag-of-words projections, so texts sharing words come
+    out similar and search results are meaningful. Classification is derived
+    from the words too. Every provider call sleeps latency_ms, like a network
+    round trip. Nothing leaves the process: no API keys, rate limiter or Redis.
+    """
+
+    def __init__(self, dim: int = 256, latency_ms: float = 0.0, seed: int = 0):
+        super().__init__(provider="fake")
+        self.dim = dim
+        self.latency = latency_ms / 1000
+        self.seed = seed
+        self._words = {}
+        self._words_lock = threading.Lock()
+
+    @property
+    def embedding_model(self):
+        return f"fake-{self.dim}"
+
+    def _word_vector(self, word: str):
+        vector = self._words.get(word)
+        if vector is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode()) ^ self.seed)
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            with self._words_lock:
+                self._words[word] = vector
+        return vector
+
+    def _vector(self, text: str):
+        tokens = tokenize(text)
+        if not tokens:
+            tokens = ["<empty>"]
+        vector = np.sum([self._word_vector(token) for token in tokens], axis=0)
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def _classify(self, text: str):
+        tokens = [token for token in tokenize(text) if len(token) > 4]
+        category = FAKE_CATEGORIES[zlib.crc32(text[:200].encode()) % len(FAKE_CATEGORIES)]
+        return {"category": category, "tags": list(dict.fromkeys(tokens))[:3]}
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _embed(self, text: str, max_retries: int = None):
+        self._wait()
+        return self._vector(text)
+
+    def _embed_batch(self, texts: list):
+        self._wait()
+        return [self._vector(text) for text in texts]
+
+    def generate_query_embedding(self, text: str):
+        # Uncached on purpose: benchmarks measure the search path, not the Redis cache
+        return self._embed(text)
+
+    def classify_and_tag(self, text: str):
+        self._wait()
+        return self._classify(text)
+
+    async def _aembed(self, text: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._vector(text)
+
+    async def aclassify_and_tag(self, text: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._classify(text)
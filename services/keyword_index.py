@@ -0,0 +1,180 @@
+import re
+import math
+import heapq
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+# ASCII words and identifiers (error codes, hostnames, paths) are kept whole and also
+# split on their punctuation; runs of CJK characters are indexed as overlapping bigrams.
+WORD_RE = re.compile(r"[a-z0-9]+(?:[._\-:/@][a-z0-9]+)*")
+CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+SPLIT_RE = re.compile(r"[._\-:/@]")
+
+
+def tokenize(text: str):
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for word in WORD_RE.findall(text):
+        tokens.append(word)
+        parts = SPLIT_RE.split(word)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    for run in CJK_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def note_text(content: str, tags) -> str:
+    return " ".join([content or ""] + list(tags or []))
+
+
+class KeywordIndex:
+    """
+    In-memory inverted index over note content and tags, scored with BM25.
+    Updated incrementally like the vector index; loaded once per process.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {note_id: term frequency}
+        self._doc_terms = {}                # note_id -> Counter of terms, for removal
+        self._doc_len = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._doc_len)
+
+    def __contains__(self, note_id):
+        return note_id in self._doc_len
+
+    def _remove_locked(self, note_id):
+        terms = self._doc_terms.pop(note_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            posting = self._postings.get(term)
+            if posting is not None:
+                posting.pop(note_id, None)
+                if not posting:
+                    del self._postings[term]
+        self._total_len -= self._doc_len.pop(note_id)
+
+    def upsert(self, note_id: int, content: str, tags=None):
+        terms = Counter(tokenize(note_text(content, tags)))
+        with self._lock:
+            self._remove_locked(note_id)
+            if not terms:
+                return
+            for term, tf in terms.items():
+                self._postings[term][note_id] = tf
+            self._doc_terms[note_id] = terms
+            length = sum(terms.values())
+            self._doc_len[note_id] = length
+            self._total_len += length
+
+    def remove(self, note_ids):
+        with self._lock:
+            for note_id in note_ids:
+                self._remove_locked(note_id)
+
+    def clear(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._doc_terms = {}
+            self._doc_len = {}
+            self._total_len = 0
+            self.loaded = False
+            self.synced_at = None
+
+    def search(self, query: str, top_k: int = 10, allowed_ids=None):
+        """Return [(note_id, bm25 score), ...] best first."""
+        terms = set(tokenize(query))
+        allowed = set(allowed_ids) if allowed_ids is not None else None
+        scores = defaultdict(float)
+        with self._lock:
+            n = len(self._doc_len)
+            if not n or not terms:
+                return []
+            avgdl = self._total_len / n
+            for term in terms:
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                if allowed is None:
+                    matches = posting.items()
+                elif len(allowed) < len(posting):
+                    # Walk the smaller side of the intersection
+                    matches = ((note_id, posting[note_id]) for note_id in allowed if note_id in posting)
+                else:
+                    matches = ((note_id, tf) for note_id, tf in posting.items() if note_id in allowed)
+                for note_id, tf in matches:
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[note_id] / avgdl)
+                    scores[note_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def load(self, db):
+        from models import KnowledgeNote
+
+        rows = db.query(KnowledgeNote.id, KnowledgeNote.content, KnowledgeNote.tags, KnowledgeNote.updated_at).filter(
+            KnowledgeNote.is_deleted == False
+        ).yield_per(1000)
+        with self._lock:
+            self.clear()
+            for note_id, content, tags, updated_at in rows:
+                self.upsert(note_id, content, tags)
+                if updated_at and (self.synced_at is None or updated_at > self.synced_at):
+                    self.synced_at = updated_at
+            self.loaded = True
+
+    def sync(self, db):
+        """Apply rows changed since the last load/sync (e.g. written by the worker)."""
+        from models import KnowledgeNote
+
+        query = db.query(
+            KnowledgeNote.id, KnowledgeNote.content, KnowledgeNote.tags, KnowledgeNote.is_deleted, KnowledgeNote.updated_at
+        )
+        if self.synced_at is not None:
+            query = query.filter(KnowledgeNote.updated_at >= self.synced_at)
+        with self._lock:
+            for note_id, content, tags, is_deleted, updated_at in query.yield_per(1000):
+                if is_deleted:
+                    self.remove([note_id])
+                else:
+                    self.upsert(note_id, content, tags)
+                if updated_at and (self.synced_at is None or updated_at > self.synced_at):
+                    self.synced_at = updated_at
+
+
+def reciprocal_rank_fusion(rankings, k: int = 60, top_k: int = 10):
+    """Merge several [(id, score), ...] rankings by summing 1 / (k + rank)."""
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, (note_id, _) in enumerate(ranking):
+            fused[note_id] += 1.0 / (k + rank + 1)
+    return heapq.nlargest(top_k, fused.items(), key=lambda item: item[1])
+
+
+_index = KeywordIndex()
+
+
+def get_keyword_index():
+    return _index
+
+
+def ensure_keyword_index_loaded(db):
+    if not _index.loaded:
+        _index.load(db)
+    else:
+        _index.sync(db)
+    return _index
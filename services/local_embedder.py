@@ -0,0 +1,210 @@
+import os
+import zlib
+import atexit
+import time
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import Config
+from services.keyword_index import tokenize
+from services.metrics import AI_REQUEST_SECONDS
+
+N_FEATURES = 2 ** 15       # hashed feature space the LSA projection is fitted on
+PARALLEL_MIN_TEXTS = 256   # smaller batches are featurized in-process
+CURRENT_FILE = "current"   # holds the id of the model new notes are embedded with
+
+
+def featurize(text: str):
+    """
+    Hashed sparse features of a text: words, word bigrams and character trigrams of
+    each word (robust to typos and inflections). Returns (feature hashes, counts).
+    """
+    words = tokenize(text)
+    features = list(words)
+    features.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for word in words:
+        if len(word) > 3:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    if not features:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.float32)
+    hashes = np.fromiter((zlib.crc32(f.encode()) for f in features), dtype=np.uint32, count=len(features))
+    hashes, counts = np.unique(hashes, return_counts=True)
+    return hashes, counts.astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Signed feature hashing straight into `dim` buckets (a random projection that
+    needs no fitting), optionally followed by a fitted LSA projection: tf-idf over
+    N_FEATURES hashed buckets, reduced to `dim` by truncated SVD of a note sample.
+    """
+
+    def __init__(self, dim: int, components=None, idf=None, model_id: str = None):
+        self.dim = dim
+        self.components = components  # N_FEATURES x dim, or None for plain hashing
+        self.idf = idf
+        self.model_id = model_id or f"hash-{dim}"
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _features(self, texts: list):
+        workers = Config.LOCAL_EMBED_WORKERS or os.cpu_count() or 1
+        if workers == 1 or len(texts) < PARALLEL_MIN_TEXTS:
+            return [featurize(text) for text in texts]
+        with self._pool_lock:
+            if self._pool is None:
+                # Fresh interpreters: workers and the app run threads of their own
+                self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                atexit.register(self.close)
+            pool = self._pool
+        return list(pool.map(featurize, texts, chunksize=64))
+
+    def close(self):
+        """Shut down the featurizing processes, if any were started."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            atexit.unregister(self.close)
+            pool.shutdown()
+
+    def _vector(self, hashes, counts):
+        if self.components is None:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, hashes % self.dim, signs * (1 + np.log(counts)))
+        else:
+            buckets = hashes % N_FEATURES
+            weights = (1 + np.log(counts)) * self.idf[buckets]
+            vector = weights @ self.components[buckets]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed(self, texts: list):
+        return [self._vector(hashes, counts) for hashes, counts in self._features(texts)]
+
+
+class SentenceTransformerEmbedder:
+    """A sentence-transformers model on CPU (optional dependency)."""
+
+    def __init__(self, name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(name, device="cpu")
+        self.model_id = name
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: list):
+        return list(self.model.encode(texts, batch_size=Config.EMBED_BATCH_SIZE, normalize_embeddings=True))
+
+
+def _model_path(model_id: str):
+    return os.path.join(Config.LOCAL_EMBEDDING_DIR, f"{model_id}.npz")
+
+
+def current_model_id():
+    """The configured sentence-transformers model, else the last fitted LSA model, else plain hashing."""
+    if Config.LOCAL_EMBEDDING_MODEL:
+        return Config.LOCAL_EMBEDDING_MODEL
+    try:
+        with open(os.path.join(Config.LOCAL_EMBEDDING_DIR, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return f"hash-{Config.LOCAL_EMBEDDING_DIM}"
+
+
+def load_embedder(model_id: str):
+    if model_id.startswith("hash-"):
+        return HashingEmbedder(int(model_id.split("-", 1)[1]))
+    if model_id.startswith("lsa-"):
+        data = np.load(_model_path(model_id))
+        return HashingEmbedder(data["components"].shape[1], data["components"], data["idf"], model_id)
+    try:
+        return SentenceTransformerEmbedder(model_id)
+    except ImportError:
+        # The space name follows the embedder actually used, so vectors never mix
+        print(f"sentence-transformers not installed, embedding with hash-{Config.LOCAL_EMBEDDING_DIM} instead of {model_id}.")
+        return HashingEmbedder(Config.LOCAL_EMBEDDING_DIM)
+
+
+_embedders = {}
+_embedders_lock = threading.Lock()
+
+
+def get_local_embedder(model_id: str = None):
+    """Loaded once per process and model; older fitted models stay loadable for their embedding spaces."""
+    model_id = model_id or current_model_id()
+    with _embedders_lock:
+        embedder = _embedders.get(model_id)
+        if embedder is None:
+            embedder = _embedders[model_id] = load_embedder(model_id)
+    return embedder
+
+
+def embed_texts(embedder, texts: list):
+    start = time.perf_counter()
+    vectors = embedder.embed(texts)
+    AI_REQUEST_SECONDS.observe(time.perf_counter() - start, provider="local", model=embedder.model_id)
+    return vectors
+
+
+def _sparse_matmul(rows, matrix):
+    """X @ matrix for X given as [(bucket indices, weights), ...]."""
+    return np.stack([weights @ matrix[buckets] for buckets, weights in rows])
+
+
+def _sparse_rmatmul(rows, matrix):
+    """X.T @ matrix."""
+    out = np.zeros((N_FEATURES, matrix.shape[1]), dtype=np.float32)
+    for (buckets, weights), row in zip(rows, matrix):
+        out[buckets] += np.outer(weights, row)
+    return out
+
+
+def fit_lsa(texts: list, dim: int = None, iterations: int = 3, seed: int = 0):
+    """
+    Fit an LSA model on `texts` (randomized truncated SVD of the tf-idf matrix),
+    save it under Config.LOCAL_EMBEDDING_DIR and make it the current local model.
+    Returns the new model id.
+    """
+    dim = dim or Config.LOCAL_EMBEDDING_DIM
+    featurizer = HashingEmbedder(dim)
+    try:
+        features = featurizer._features(texts)
+    finally:
+        featurizer.close()
+    rows = []
+    doc_freq = np.zeros(N_FEATURES, dtype=np.float32)
+    for hashes, counts in features:
+        # Two features can share a bucket; merge them so each bucket appears once per row
+        buckets, inverse = np.unique(hashes % N_FEATURES, return_inverse=True)
+        rows.append((buckets, np.bincount(inverse, weights=1 + np.log(counts)).astype(np.float32)))
+        doc_freq[buckets] += 1
+    idf = np.log((1 + len(rows)) / (1 + doc_freq)).astype(np.float32) + 1
+    rows = [(buckets, weights * idf[buckets]) for buckets, weights in rows]
+    rows = [(buckets, weights / (np.linalg.norm(weights) or 1)) for buckets, weights in rows]
+
+    rank = min(dim, len(rows))
+    rng = np.random.default_rng(seed)
+    y = _sparse_matmul(rows, rng.standard_normal((N_FEATURES, rank + 10)).astype(np.float32))
+    for _ in range(iterations):
+        q, _ = np.linalg.qr(y)
+        z, _ = np.linalg.qr(_sparse_rmatmul(rows, q))
+        y = _sparse_matmul(rows, z)
+    q, _ = np.linalg.qr(y)
+    _, _, vt = np.linalg.svd(_sparse_rmatmul(rows, q).T, full_matrices=False)
+    components = np.ascontiguousarray(vt[:rank].T, dtype=np.float32)  # N_FEATURES x rank
+
+    digest = hashlib.sha1(components.tobytes() + idf.tobytes()).hexdigest()[:8]
+    model_id = f"lsa-{rank}-{digest}"
+    os.makedirs(Config.LOCAL_EMBEDDING_DIR, exist_ok=True)
+    tmp = _model_path(model_id) + ".tmp.npz"
+    np.savez(tmp, components=components, idf=idf)
+    os.replace(tmp, _model_path(model_id))
+    with open(os.path.join(Config.LOCAL_EMBEDDING_DIR, CURRENT_FILE + ".tmp"), "w") as f:
+        f.write(model_id)
+    os.replace(os.path.join(Config.LOCAL_EMBEDDING_DIR, CURRENT_FILE + ".tmp"),
+               os.path.join(Config.LOCAL_EMBEDDING_DIR, CURRENT_FILE))
+    return model_id
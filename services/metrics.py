@@ -0,0 +1,234 @@
+import time
+import threading
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; covers sub-millisecond index scoring up to slow provider calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+ROW_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Timer:
+    """Context manager / decorator returned by Histogram.time()."""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+    def __call__(self, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(self.histogram, self.labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value that goes up and down, set to the latest reading."""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def set(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition format."""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+def render_metrics():
+    """Every metric of this process in the Prometheus text format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Where a request spends its time
+DB_QUERY_SECONDS = Histogram("knowledge_hub_db_query_seconds", "SQL statement execution time", ["statement"])
+DB_ROWS = Counter("knowledge_hub_db_rows_total", "Rows returned or affected by SQL statements (when the driver reports them)", ["statement"])
+NOTE_SERVICE_SECONDS = Histogram("knowledge_hub_note_service_seconds", "NoteService call time, including all its queries", ["method"])
+NOTE_SERVICE_ROWS = Histogram("knowledge_hub_note_service_rows", "Rows returned by NoteService calls", ["method"], buckets=ROW_BUCKETS)
+AI_REQUEST_SECONDS = Histogram("knowledge_hub_ai_request_seconds", "Provider API call latency, per attempt", ["provider", "model"])
+AI_RATE_LIMIT_WAIT_SECONDS = Histogram("knowledge_hub_ai_rate_limit_wait_seconds", "Time spent waiting for the shared rate limiter", ["provider", "model"])
+AI_TOKENS = Counter("knowledge_hub_ai_tokens_total", "Estimated tokens sent to providers", ["provider", "model"])
+AI_ERRORS = Counter("knowledge_hub_ai_errors_total", "Failed provider calls, per attempt", ["provider", "model", "error"])
+RESULT_CACHE_SECONDS = Histogram("knowledge_hub_result_cache_seconds", "Result cache lookups by outcome; misses include computing the result", ["name", "outcome"])
+SEARCH_STAGE_SECONDS = Histogram("knowledge_hub_search_stage_seconds", "Search time per stage", ["stage"])
+JOB_WAIT_SECONDS = Histogram("knowledge_hub_job_queue_wait_seconds", "Time notes waited in the queue before a worker started on them", ["job", "queue"])
+JOB_RUN_SECONDS = Histogram("knowledge_hub_job_run_seconds", "Worker job run time", ["job"])
+QUEUE_DEPTH = Gauge("knowledge_hub_queue_depth", "Jobs waiting per queue (notes in batch mode), as last seen by the supervisor", ["queue"])
+QUEUE_OLDEST_SECONDS = Gauge("knowledge_hub_queue_oldest_job_seconds", "Age of the oldest waiting job per queue", ["queue"])
+WORKER_PROCESSES = Gauge("knowledge_hub_worker_processes", "Worker processes run by the supervisor")
+PURGED_ROWS = Counter("knowledge_hub_retention_purged_notes_total", "Notes permanently deleted by retention purges")
+PURGE_BATCH_SECONDS = Histogram("knowledge_hub_retention_batch_seconds", "Time each purge batch held its row locks")
+APP_RENDER_SECONDS = Histogram("knowledge_hub_app_render_seconds", "Streamlit script run time per page", ["page"])
+
+
+def _row_count(result):
+    if isinstance(result, (list, set, dict)):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])  # (rows, next_cursor) pages
+    return None
+
+
+def track_query(fn):
+    """Decorator for NoteService methods: call time and rows returned."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        NOTE_SERVICE_SECONDS.observe(time.perf_counter() - start, method=fn.__name__)
+        rows = _row_count(result)
+        if rows is not None:
+            NOTE_SERVICE_ROWS.observe(rows, method=fn.__name__)
+        return result
+    return wrapper
+
+
+def instrument_engine(engine):
+    """Time every statement run through `engine` and count the rows the driver reports."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"]
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        DB_QUERY_SECONDS.observe(elapsed, statement=kind)
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            DB_ROWS.inc(cursor.rowcount, statement=kind)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render_metrics().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """Serve /metrics on a daemon thread, once per process. port 0 disables it."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                # e.g. the port is taken by another worker on this host; don't retry on every rerun
+                print(f"Metrics endpoint not started on {host}:{port}: {e}")
+                _server = False
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server or None
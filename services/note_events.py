@@ -0,0 +1,45 @@
+# Note lifecycle events on a Redis stream: workers append a note's new status, the app
+# reads what arrived since its last look and patches only those cards. A stream rather
+# than pub/sub because a Streamlit session has no long-lived subscriber between reruns.
+
+NOTE_EVENTS_KEY = "notes:events"
+NOTE_EVENTS_MAXLEN = 10000  # approximate; readers only care about the last few seconds
+
+
+def publish_status(note_ids, status: str):
+    """Record that `note_ids` moved to `status`. Best-effort: a failure is printed, never raised."""
+    if not note_ids:
+        return
+    try:
+        from database import redis_client
+
+        pipe = redis_client.pipeline(transaction=False)
+        for note_id in note_ids:
+            pipe.xadd(NOTE_EVENTS_KEY, {"note_id": note_id, "status": status},
+                      maxlen=NOTE_EVENTS_MAXLEN, approximate=True)
+        pipe.execute()
+    except Exception as e:
+        print(f"Could not publish status events: {e}")
+
+
+def latest_event_id():
+    """Stream position to read from so only events published from now on are seen."""
+    from database import redis_client
+
+    last = redis_client.xrevrange(NOTE_EVENTS_KEY, count=1)
+    return last[0][0] if last else "0-0"
+
+
+def read_status_events(after_id: str, count: int = 1000):
+    """
+    Events published after `after_id`, without blocking.
+    Returns (new position, {note_id: latest status}).
+    """
+    from database import redis_client
+
+    statuses = {}
+    for _, entries in redis_client.xread({NOTE_EVENTS_KEY: after_id}, count=count):
+        for event_id, fields in entries:
+            statuses[int(fields["note_id"])] = fields["status"]
+            after_id = event_id
+    return after_id, statuses
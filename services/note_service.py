@@ -1,22 +1,112 @@
-from sqlalchemy.orm import Session
-from models import KnowledgeNote
+from sqlalchemy import and_, or_, func, insert, select
+from sqlalchemy.orm import Session, defer
+from models import KnowledgeNote, NoteChunk, NoteTag, NoteEmbedding, NoteNeighbor, compute_content_hash, space_name
+from services.vector_index import get_vector_index, get_passage_index, ensure_index_loaded
+from services.keyword_index import get_keyword_index, ensure_keyword_index_loaded
+from services.embedding_space import get_active_space
+from services.metrics import track_query
+from services.result_cache import cached_result, invalidates_results
+from config import Config
 import datetime
+import uuid
+from collections import namedtuple
 from typing import List
 
+PREVIEW_CHARS = 150
+TAG_CHARS = 100
+# A row of the list views, for summaries whose status changed since they were cached
+NoteSummary = namedtuple("NoteSummary", ["id", "category", "tags", "status", "created_at", "preview"])
+
 class NoteService:
     def __init__(self, db: Session):
         self.db = db
+        self.index = get_vector_index()
+        self.passage_index = get_passage_index()
+        self.keyword_index = get_keyword_index()
+
+    def active_space(self):
+        return get_active_space(self.db)
+
+    def _indexed(self, space: str, index=None):
+        """
+        Whether vectors of `space` belong in `index` (the note vectors by default).
+        Only a loaded index takes upserts: a process that never searches would
+        otherwise grow its copy forever, and the next load reads the database anyway.
+        """
+        index = self.index if index is None else index
+        return index.loaded and (index.space is None or space == index.space)
+
+    @track_query
+    def ensure_search_index(self):
+        # Loads the embedding matrix and keyword index once per process, then applies incremental changes
+        ensure_keyword_index_loaded(self.db)
+        return ensure_index_loaded(self.db)
 
+    @track_query
+    @invalidates_results
     def create_note(self, content: str):
-        note = KnowledgeNote(content=content)
+        note = KnowledgeNote(content=content, content_hash=compute_content_hash(content))
         self.db.add(note)
         self.db.commit()
         self.db.refresh(note)
+        if self.keyword_index.loaded:
+            self.keyword_index.upsert(note.id, content)
         return note
 
+    @track_query
+    @invalidates_results
+    def bulk_create_notes(self, records: List[dict], skip_existing: bool = True):
+        """
+        Insert many notes with one multi-row INSERT and return their new ids.
+        records hold content and optionally category, tags and created_at.
+        skip_existing drops records whose content is already stored (safe re-runs).
+        """
+        rows = [(record, compute_content_hash(record["content"])) for record in records]
+        if skip_existing and rows:
+            existing = {row[0] for row in self.db.query(KnowledgeNote.content_hash).filter(
+                KnowledgeNote.content_hash.in_(list({content_hash for _, content_hash in rows}))
+            )}
+            unique = []
+            for record, content_hash in rows:
+                if content_hash not in existing:
+                    existing.add(content_hash)
+                    unique.append((record, content_hash))
+            rows = unique
+        if not rows:
+            return []
+
+        now = datetime.datetime.now()
+        # MySQL can't RETURNING ids from a multi-row insert: the rows carry a token for
+        # this batch, cleared again before the commit, so no other writer's rows match
+        token = uuid.uuid4().hex
+        max_id = self.db.query(func.max(KnowledgeNote.id)).scalar() or 0
+        self.db.execute(insert(KnowledgeNote), [{
+            "content": record["content"],
+            "content_hash": content_hash,
+            "category": record.get("category"),
+            "tags": record.get("tags"),
+            "status": "pending",
+            "claim_token": token,
+            "created_at": record.get("created_at") or now,
+            "updated_at": now,
+            "is_deleted": False,
+        } for record, content_hash in rows])
+        # Ids of one INSERT ascend in row order
+        note_ids = [row[0] for row in self.db.query(KnowledgeNote.id).filter(
+            KnowledgeNote.id > max_id, KnowledgeNote.claim_token == token
+        ).order_by(KnowledgeNote.id)]
+        self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids)).update({
+            KnowledgeNote.claim_token: None
+        }, synchronize_session=False)
+        self._replace_tags({note_id: record["tags"] for note_id, (record, _) in zip(note_ids, rows) if record.get("tags")})
+        self.db.commit()
+        return note_ids
+
+    @track_query
     def get_note_by_id(self, note_id: int):
         return self.db.query(KnowledgeNote).filter(KnowledgeNote.id == note_id).first()
 
+    @track_query
     def update_note_status(self, note_id: int, status: str):
         note = self.db.query(KnowledgeNote).filter(KnowledgeNote.id == note_id).first()
         if note:
@@ -25,48 +115,415 @@ class NoteService:
             self.db.refresh(note)
         return note
 
-    def update_note_ai_data(self, note_id: int, category: str, tags: list, embedding: list):
-        note = self.db.query(KnowledgeNote).filter(KnowledgeNote.id == note_id).first()
-        if note:
-            note.category = category
-            note.tags = tags
-            note.embedding = embedding
+    def _replace_tags(self, tags_by_note: dict):
+        """Rewrite the note_tags rows of several notes inside the current transaction."""
+        if not tags_by_note:
+            return
+        self.db.query(NoteTag).filter(NoteTag.note_id.in_(list(tags_by_note))).delete(synchronize_session=False)
+        rows = [{"note_id": note_id, "tag": tag}
+                for note_id, tags in tags_by_note.items()
+                for tag in {str(tag).strip()[:TAG_CHARS] for tag in tags or []} if tag]
+        if rows:
+            self.db.execute(insert(NoteTag), rows)
+
+    def _replace_passages(self, passages_by_note: dict, space: str):
+        """
+        Swap the passage rows of several notes in one embedding space inside the current transaction.
+        passages_by_note maps note_id -> [passage dict]; returns note_id -> [(chunk_id, embedding)].
+        """
+        if not passages_by_note:
+            return {}
+        self.db.query(NoteChunk).filter(
+            NoteChunk.note_id.in_(list(passages_by_note)),
+            NoteChunk.space == space
+        ).delete(synchronize_session=False)
+        created = {note_id: [(NoteChunk(note_id=note_id, position=p["position"], start=p["start"],
+                                        content=p["content"], embedding=p["embedding"], space=space), p["embedding"])
+                             for p in passages]
+                   for note_id, passages in passages_by_note.items()}
+        self.db.add_all(chunk for items in created.values() for chunk, _ in items)
+        self.db.flush()
+        return {note_id: [(chunk.id, embedding) for chunk, embedding in items] for note_id, items in created.items()}
+
+    @track_query
+    def get_passages(self, note_id: int, space: str):
+        """A note's passages in one space as dicts, in the shape save_ai_results takes them."""
+        return [{"position": c.position, "start": c.start, "content": c.content, "embedding": c.embedding}
+                for c in self.db.query(NoteChunk).filter(
+                    NoteChunk.note_id == note_id, NoteChunk.space == space
+                ).order_by(NoteChunk.position)]
+
+    @track_query
+    def save_space_embeddings(self, space: str, results: List[dict]):
+        """
+        Store vectors for a space that is being backfilled, next to the notes' current ones.
+        Each result holds note_id, embedding and passages. Nothing searchable changes
+        until the space is switched to.
+        """
+        if not results:
+            return
+        note_ids = [r["note_id"] for r in results]
+        self.db.query(NoteEmbedding).filter(
+            NoteEmbedding.space == space, NoteEmbedding.note_id.in_(note_ids)
+        ).delete(synchronize_session=False)
+        self.db.add_all(NoteEmbedding(note_id=r["note_id"], space=space, embedding=r["embedding"]) for r in results)
+        self._replace_passages({r["note_id"]: r["passages"] for r in results}, space)
+        self.db.commit()
+
+    @cached_result
+    @track_query
+    def get_passage_texts(self, chunk_ids: List[int]):
+        """{chunk_id: passage text} for showing the matching passage of a search result."""
+        if not chunk_ids:
+            return {}
+        return dict(self.db.query(NoteChunk.id, NoteChunk.content).filter(NoteChunk.id.in_(chunk_ids)).all())
+
+    @track_query
+    def get_notes_by_ids(self, note_ids: List[int]):
+        return self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids)).all()
+
+    @track_query
+    def claim_notes(self, note_ids: List[int]):
+        """
+        Mark notes as processing with one conditional UPDATE, so two workers never
+        enrich the same note. Takes pending notes, and "processing" notes untouched for
+        Config.AI_CLAIM_TIMEOUT seconds (their worker died). Returns (id, content,
+        content_hash) rows of the notes this call claimed.
+        """
+        if not note_ids:
+            return []
+        token = uuid.uuid4().hex
+        stale = datetime.datetime.now() - datetime.timedelta(seconds=Config.AI_CLAIM_TIMEOUT)
+        claimed = self.db.query(KnowledgeNote).filter(
+            KnowledgeNote.id.in_(note_ids),
+            or_(KnowledgeNote.status == "pending",
+                and_(KnowledgeNote.status == "processing", KnowledgeNote.updated_at < stale))
+        ).update({
+            KnowledgeNote.status: "processing",
+            KnowledgeNote.claim_token: token
+        }, synchronize_session=False)
+        if not claimed:
             self.db.commit()
-            self.db.refresh(note)
-        return note
+            return []
+        rows = self.db.query(KnowledgeNote.id, KnowledgeNote.content, KnowledgeNote.content_hash).filter(
+            KnowledgeNote.id.in_(note_ids), KnowledgeNote.claim_token == token
+        ).all()
+        self.db.commit()
+        return rows
 
-    def get_active_notes(self):
-        return self.db.query(KnowledgeNote).filter(KnowledgeNote.is_deleted == False).order_by(KnowledgeNote.created_at.desc()).all()
+    @track_query
+    def release_claims(self, note_ids: List[int]):
+        """Put notes a dead worker had claimed back to pending; finished notes are left alone."""
+        if not note_ids:
+            return
+        self.db.query(KnowledgeNote).filter(
+            KnowledgeNote.id.in_(note_ids), KnowledgeNote.status == "processing"
+        ).update({
+            KnowledgeNote.status: "pending",
+            KnowledgeNote.claim_token: None
+        }, synchronize_session=False)
+        self.db.commit()
+
+    @track_query
+    def set_notes_status(self, note_ids: List[int], status: str, from_status: str = None):
+        """Set the status of notes; with from_status, only of those currently in it."""
+        if not note_ids:
+            return
+        criteria = [KnowledgeNote.status == from_status] if from_status else []
+        self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids), *criteria).update({
+            KnowledgeNote.status: status
+        }, synchronize_session=False)
+        self.db.commit()
+
+    @track_query
+    @invalidates_results
+    def save_ai_results(self, results: List[dict], failed_ids: List[int] = None):
+        """
+        Write enrichment results for many notes, their "completed" status, and mark
+        failures, in a single transaction.
+        Each result holds note_id, category, tags, embedding, embedding_model, ai_provider
+        and optionally the passages of a long note.
+        """
+        notes = {note.id: note for note in self.get_notes_by_ids([r["note_id"] for r in results])}
+        passages = {}  # space -> {note_id: passages}
+        for result in results:
+            note = notes.get(result["note_id"])
+            if not note:
+                continue
+            note.category = result["category"]
+            note.tags = result["tags"]
+            note.embedding = result["embedding"]
+            note.embedding_model = result["embedding_model"]
+            note.ai_provider = result["ai_provider"]
+            note.embedding_dim = len(result["embedding"])
+            note.status = "completed"
+            note.claim_token = None
+            space = space_name(result["ai_provider"], result["embedding_model"])
+            passages.setdefault(space, {})[note.id] = result.get("passages") or []
+        chunks = {}
+        for space, by_note in passages.items():
+            chunks.update(self._replace_passages(by_note, space))
+        self._replace_tags({r["note_id"]: r["tags"] for r in results if r["note_id"] in notes})
+        active = {note.id: note.content for note in notes.values() if not note.is_deleted}
+        if failed_ids:
+            self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(failed_ids)).update({
+                KnowledgeNote.status: "failed"
+            }, synchronize_session=False)
+        self.db.commit()
+        for r in results:
+            if r["note_id"] in active:
+                space = space_name(r["ai_provider"], r["embedding_model"])
+                if self._indexed(space):
+                    self.index.upsert(r["note_id"], r["embedding"])
+                if self._indexed(space, self.passage_index):
+                    self.passage_index.set_note_passages(r["note_id"], chunks[r["note_id"]])
+                if self.keyword_index.loaded:
+                    self.keyword_index.upsert(r["note_id"], active[r["note_id"]], r["tags"])
+        return len(notes)
+
+    @track_query
+    def find_enrichment_donor(self, content_hash: str, ai_provider: str, embedding_model: str, exclude_id: int = None):
+        """A completed note with identical content whose AI results can be reused (deleted ones count too)."""
+        if not content_hash:
+            return None
+        query = self.db.query(KnowledgeNote).filter(
+            KnowledgeNote.content_hash == content_hash,
+            KnowledgeNote.ai_provider == ai_provider,
+            KnowledgeNote.embedding_model == embedding_model,
+            KnowledgeNote.status == "completed",
+            KnowledgeNote.embedding.isnot(None)
+        )
+        if exclude_id is not None:
+            query = query.filter(KnowledgeNote.id != exclude_id)
+        return query.first()
+
+    def _summary_query(self, preview_chars: int = PREVIEW_CHARS):
+        # Only the columns list views render; embedding and full content stay in the DB.
+        # preview holds one extra char so callers can tell whether to add "..."
+        return self.db.query(
+            KnowledgeNote.id,
+            KnowledgeNote.category,
+            KnowledgeNote.tags,
+            KnowledgeNote.status,
+            KnowledgeNote.created_at,
+            func.substr(KnowledgeNote.content, 1, preview_chars + 1).label("preview")
+        )
+
+    def _filter_criteria(self, filters: dict = None):
+        """
+        SQL criteria for metadata filters: category, tags (a note must carry all of them),
+        date_from / date_to (created_at, date_to exclusive). Each one is served by an index.
+        """
+        criteria = []
+        if not filters:
+            return criteria
+        if filters.get("category"):
+            criteria.append(KnowledgeNote.category == filters["category"])
+        for tag in filters.get("tags") or []:
+            criteria.append(KnowledgeNote.id.in_(select(NoteTag.note_id).where(NoteTag.tag == tag)))
+        if filters.get("date_from"):
+            criteria.append(KnowledgeNote.created_at >= filters["date_from"])
+        if filters.get("date_to"):
+            criteria.append(KnowledgeNote.created_at < filters["date_to"])
+        return criteria
+
+    @cached_result
+    @track_query
+    def filter_note_ids(self, filters: dict = None):
+        """
+        Ids of active notes matching filters, to pass as allowed_ids to search so
+        only the filtered set is scored. None means no filter (search everything).
+        """
+        criteria = self._filter_criteria(filters)
+        if not criteria:
+            return None
+        return {row[0] for row in self.db.query(KnowledgeNote.id).filter(KnowledgeNote.is_deleted == False, *criteria)}
+
+    @cached_result
+    @track_query
+    def get_categories(self):
+        return [row[0] for row in self.db.query(KnowledgeNote.category).filter(
+            KnowledgeNote.category.isnot(None)
+        ).distinct().order_by(KnowledgeNote.category)]
+
+    @cached_result
+    @track_query
+    def get_popular_tags(self, limit: int = 200):
+        return [row[0] for row in self.db.query(NoteTag.tag).group_by(NoteTag.tag).order_by(
+            func.count(NoteTag.note_id).desc(), NoteTag.tag
+        ).limit(limit)]
+
+    def _with_current_status(self, rows):
+        """
+        Claims and status changes don't invalidate cached results, so re-read the
+        status of cached summary rows: one primary-key lookup for the page.
+        """
+        if not rows:
+            return rows
+        statuses = dict(self.db.query(KnowledgeNote.id, KnowledgeNote.status).filter(
+            KnowledgeNote.id.in_([row.id for row in rows])
+        ).all())
+        return [row if statuses.get(row.id, row.status) == row.status
+                else NoteSummary(*row)._replace(status=statuses[row.id]) for row in rows]
 
+    def get_active_notes_page(self, limit: int = 50, cursor: tuple = None, preview_chars: int = PREVIEW_CHARS,
+                              filters: dict = None):
+        """
+        Keyset pagination over active notes, newest first.
+        cursor is the (created_at, id) of the last row of the previous page.
+        Returns (rows, next_cursor); next_cursor is None on the last page.
+        """
+        rows, next_cursor = self._active_notes_page(limit, cursor, preview_chars, filters)
+        return self._with_current_status(rows), next_cursor
+
+    @cached_result
+    @track_query
+    def _active_notes_page(self, limit: int, cursor: tuple, preview_chars: int, filters: dict):
+        query = self._summary_query(preview_chars).filter(KnowledgeNote.is_deleted == False, *self._filter_criteria(filters))
+        if cursor:
+            created_at, note_id = cursor
+            query = query.filter(or_(
+                KnowledgeNote.created_at < created_at,
+                and_(KnowledgeNote.created_at == created_at, KnowledgeNote.id < note_id)
+            ))
+        rows = query.order_by(KnowledgeNote.created_at.desc(), KnowledgeNote.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = (rows[-1].created_at, rows[-1].id)
+        return rows, next_cursor
+
+    def get_note_summaries(self, note_ids: List[int], preview_chars: int = PREVIEW_CHARS):
+        """Projected rows for the given ids, in the order of note_ids."""
+        return self._with_current_status(self._note_summaries(note_ids, preview_chars))
+
+    @cached_result
+    @track_query
+    def _note_summaries(self, note_ids: List[int], preview_chars: int):
+        if not note_ids:
+            return []
+        rows = self._summary_query(preview_chars).filter(
+            KnowledgeNote.id.in_(note_ids),
+            KnowledgeNote.is_deleted == False
+        ).all()
+        by_id = {row.id: row for row in rows}
+        return [by_id[note_id] for note_id in note_ids if note_id in by_id]
+
+    @track_query
+    def get_related_notes(self, note_ids: List[int], limit: int = 3, preview_chars: int = 80):
+        """
+        {note_id: [row(neighbor_id, score, preview), ...]}, most similar first, from the
+        precomputed related-notes graph: one indexed read for a whole page of cards.
+        Not result-cached, since the workers refresh the graph without a note write.
+        """
+        if not note_ids:
+            return {}
+        rows = self.db.query(
+            NoteNeighbor.note_id,
+            NoteNeighbor.neighbor_id,
+            NoteNeighbor.score,
+            func.substr(KnowledgeNote.content, 1, preview_chars + 1).label("preview")
+        ).join(KnowledgeNote, KnowledgeNote.id == NoteNeighbor.neighbor_id).filter(
+            NoteNeighbor.note_id.in_(note_ids),
+            KnowledgeNote.is_deleted == False
+        ).order_by(NoteNeighbor.note_id, NoteNeighbor.score.desc()).all()
+        related = {}
+        for row in rows:
+            items = related.setdefault(row.note_id, [])
+            if len(items) < limit:
+                items.append(row)
+        return related
+
+    @cached_result
+    @track_query
+    def count_active_notes(self, filters: dict = None):
+        return self.db.query(func.count(KnowledgeNote.id)).filter(
+            KnowledgeNote.is_deleted == False, *self._filter_criteria(filters)
+        ).scalar()
+
+    @track_query
     def get_deleted_notes(self):
-        return self.db.query(KnowledgeNote).filter(KnowledgeNote.is_deleted == True).order_by(KnowledgeNote.deleted_at.desc()).all()
+        return self.db.query(KnowledgeNote).options(defer(KnowledgeNote.embedding)).filter(
+            KnowledgeNote.is_deleted == True
+        ).order_by(KnowledgeNote.deleted_at.desc()).all()
 
+    @track_query
+    @invalidates_results
     def soft_delete_notes(self, note_ids: List[int]):
         self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids)).update({
             KnowledgeNote.is_deleted: True,
             KnowledgeNote.deleted_at: datetime.datetime.now()
         }, synchronize_session=False)
         self.db.commit()
+        self.index.remove(note_ids)
+        self.passage_index.remove_notes(note_ids)
+        self.keyword_index.remove(note_ids)
 
+    @track_query
+    @invalidates_results
     def restore_notes(self, note_ids: List[int]):
         self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids)).update({
             KnowledgeNote.is_deleted: False,
             KnowledgeNote.deleted_at: None
         }, synchronize_session=False)
         self.db.commit()
+        rows = self.db.query(
+            KnowledgeNote.id, KnowledgeNote.embedding, KnowledgeNote.content, KnowledgeNote.tags,
+            KnowledgeNote.ai_provider, KnowledgeNote.embedding_model
+        ).filter(KnowledgeNote.id.in_(note_ids)).all()
+        self.index.upsert_many((row.id, row.embedding) for row in rows
+                               if row.embedding is not None and self._indexed(space_name(row.ai_provider, row.embedding_model)))
+        if self.keyword_index.loaded:
+            for row in rows:
+                self.keyword_index.upsert(row.id, row.content, row.tags)
+        if not self.passage_index.loaded:
+            return
+        passages = {}
+        chunk_query = self.db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.embedding).filter(NoteChunk.note_id.in_(note_ids))
+        if self.passage_index.space is not None:
+            chunk_query = chunk_query.filter(NoteChunk.space == self.passage_index.space)
+        for chunk_id, note_id, embedding in chunk_query:
+            passages.setdefault(note_id, []).append((chunk_id, embedding))
+        for note_id, items in passages.items():
+            self.passage_index.set_note_passages(note_id, items)
 
+    @track_query
+    @invalidates_results
     def hard_delete_notes(self, note_ids: List[int]):
-        self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids)).delete(synchronize_session=False)
+        self._delete_note_rows(note_ids)
         self.db.commit()
+        self.index.remove(note_ids)
+        self.passage_index.remove_notes(note_ids)
+        self.keyword_index.remove(note_ids)
 
-    def empty_recycle_bin(self):
-        self.db.query(KnowledgeNote).filter(KnowledgeNote.is_deleted == True).delete(synchronize_session=False)
-        self.db.commit()
-        
-    def cleanup_old_deleted_notes(self, days=30):
-        cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-        self.db.query(KnowledgeNote).filter(
-            KnowledgeNote.is_deleted == True,
-            KnowledgeNote.deleted_at < cutoff_date
-        ).delete(synchronize_session=False)
+    def _delete_note_rows(self, note_ids: List[int]):
+        # Child rows first; doesn't rely on the database enforcing ON DELETE CASCADE
+        self.db.query(NoteChunk).filter(NoteChunk.note_id.in_(note_ids)).delete(synchronize_session=False)
+        self.db.query(NoteTag).filter(NoteTag.note_id.in_(note_ids)).delete(synchronize_session=False)
+        self.db.query(NoteEmbedding).filter(NoteEmbedding.note_id.in_(note_ids)).delete(synchronize_session=False)
+        self.db.query(NoteNeighbor).filter(or_(
+            NoteNeighbor.note_id.in_(note_ids), NoteNeighbor.neighbor_id.in_(note_ids)
+        )).delete(synchronize_session=False)
+        self.db.query(KnowledgeNote).filter(KnowledgeNote.id.in_(note_ids)).delete(synchronize_session=False)
+
+    @track_query
+    @invalidates_results
+    def purge_deleted_batch(self, cutoff: datetime.datetime = None, after_id: int = 0, limit: int = 200):
+        """
+        Permanently delete up to `limit` soft-deleted notes with id > after_id (only those
+        deleted before `cutoff`, when given) in one short transaction. The rows are
+        locked as they are read, so a note restored meanwhile is kept. Returns the
+        purged ids in id order; run it repeatedly to work through the recycle bin.
+        """
+        criteria = [KnowledgeNote.is_deleted == True, KnowledgeNote.id > after_id]
+        if cutoff is not None:
+            criteria.append(KnowledgeNote.deleted_at < cutoff)
+        note_ids = [note_id for note_id, in self.db.query(KnowledgeNote.id).filter(*criteria)
+                    .order_by(KnowledgeNote.id).limit(limit).with_for_update()]
+        if note_ids:
+            self._delete_note_rows(note_ids)
         self.db.commit()
+        self.index.remove(note_ids)
+        self.passage_index.remove_notes(note_ids)
+        self.keyword_index.remove(note_ids)
+        return note_ids
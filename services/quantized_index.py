@@ -0,0 +1,194 @@
+import time
+import tempfile
+import numpy as np
+from config import Config
+from services.vector_index import VectorIndex, _is_empty
+
+DEFAULT_RERANK = {"int8": 4, "binary": 16}  # shortlist = top_k * this; sign codes need a longer one
+SCORE_CHUNK_VALUES = 2 ** 22  # codes decoded per block: bounds the temporary float32 copy to 16 MB
+
+if hasattr(np, "bitwise_count"):
+    def _popcount(words):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+else:  # numpy < 2
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        return _BYTE_BITS[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Compressed in-memory index for collections whose float32 matrix won't fit in RAM.
+
+    mode="int8": each normalized vector as int8 codes plus a float32 scale (4x smaller).
+    mode="binary": the signs only, packed into 64-bit words (32x smaller), scored by
+    Hamming distance. A search scores every row on its codes, then re-ranks the best
+    top_k * rerank with the full-precision vectors, kept row-aligned in a memory-mapped
+    file under Config.QUANT_RERANK_DIR: the OS pages in the few rows a query reads,
+    and they don't count against the process's memory.
+    """
+
+    def __init__(self, mode: str = "int8", rerank: int = None, dim: int = None, capacity: int = 1024):
+        if mode not in DEFAULT_RERANK:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        super().__init__(dim, capacity)
+        self.mode = mode
+        self.rerank = (Config.QUANT_RERANK or DEFAULT_RERANK[mode]) if rerank is None else rerank
+        self._keep_full = self.rerank > 0
+        self._scales = None
+        self._full = None
+
+    def _encode(self, vec):
+        """(codes, scale) of a normalized vector."""
+        if self.mode == "binary":
+            bits = np.zeros(-(-self.dim // 64) * 64, dtype=bool)
+            bits[:vec.shape[0]] = vec > 0
+            return np.packbits(bits).view(np.uint64), 1.0
+        peak = float(np.abs(vec).max()) or 1.0
+        return np.round(vec * (127 / peak)).astype(np.int8), peak / 127
+
+    def _disk_matrix(self, rows: int):
+        """A zeroed float32 (rows, dim) matrix in an anonymous temporary file, removed once unmapped."""
+        with tempfile.TemporaryFile(dir=Config.QUANT_RERANK_DIR or None) as handle:
+            handle.truncate(rows * self.dim * 4)
+            return np.memmap(handle, dtype=np.float32, mode="r+", shape=(rows, self.dim))
+
+    def _ensure_capacity(self, needed: int):
+        if self._matrix is not None and needed <= self._matrix.shape[0]:
+            return
+        capacity = max(self._capacity, needed) if self._matrix is None else max(needed, self._matrix.shape[0] * 2)
+        if self.mode == "binary":
+            matrix = np.zeros((capacity, -(-self.dim // 64)), dtype=np.uint64)
+        else:
+            matrix = np.zeros((capacity, self.dim), dtype=np.int8)
+        scales = np.zeros(capacity, dtype=np.float32)
+        ids = np.zeros(capacity, dtype=np.int64)
+        full = self._disk_matrix(capacity) if self._keep_full else None
+        if self._matrix is not None:
+            matrix[:self._size] = self._matrix[:self._size]
+            scales[:self._size] = self._scales[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            if full is not None:
+                full[:self._size] = self._full[:self._size]
+        self._matrix, self._scales, self._ids, self._full = matrix, scales, ids, full
+
+    def _store(self, row: int, vec):
+        self._matrix[row], self._scales[row] = self._encode(vec)
+        if self._full is not None:
+            self._full[row] = vec
+
+    def _move(self, dst: int, src: int):
+        self._matrix[dst] = self._matrix[src]
+        self._scales[dst] = self._scales[src]
+        if self._full is not None:
+            self._full[dst] = self._full[src]
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._scales = None
+            self._full = None
+
+    def memory_bytes(self):
+        with self._lock:
+            if self._matrix is None:
+                return 0
+            return sum(a[:self._size].nbytes for a in (self._matrix, self._scales, self._ids))
+
+    def snapshot(self):
+        """Copy of (ids, decoded vectors): approximations of the original vectors."""
+        with self._lock:
+            if self._matrix is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+            return self._ids[:self._size].copy(), self._decode(self._matrix[:self._size], self._scales[:self._size])
+
+    def _decode(self, codes, scales):
+        if self.mode == "binary":
+            bits = np.unpackbits(codes.view(np.uint8), axis=1)[:, :self.dim]
+            return (bits.astype(np.float32) * 2 - 1) / np.sqrt(self.dim)
+        return codes.astype(np.float32) * scales[:, None]
+
+    def _score(self, codes, scales, query, query_bits):
+        """Approximate cosine similarity of the query to each row of codes."""
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        chunk = max(1, SCORE_CHUNK_VALUES // codes.shape[1])
+        for start in range(0, codes.shape[0], chunk):
+            block = codes[start:start + chunk]
+            if self.mode == "binary":
+                hamming = _popcount(block ^ query_bits)
+                scores[start:start + block.shape[0]] = 1 - 2 * hamming / self.dim
+            else:
+                scores[start:start + block.shape[0]] = (block.astype(np.float32) @ query) * scales[start:start + block.shape[0]]
+        return scores
+
+    def search(self, query_embedding, top_k: int = 10, allowed_ids=None):
+        """
+        Return [(note_id, score), ...] sorted by descending cosine similarity; re-ranked
+        scores are exact, with rerank=0 they are approximate.
+        """
+        query = None if _is_empty(query_embedding) else self._normalize(query_embedding)
+        with self._lock:
+            if query is None or self._size == 0 or query.shape[0] != self.dim:
+                return []
+            query_bits = self._encode(query)[0] if self.mode == "binary" else None
+            if allowed_ids is not None:
+                rows = np.fromiter((self._rows[i] for i in allowed_ids if i in self._rows), dtype=np.int64)
+                scores = self._score(self._matrix[rows], self._scales[rows], query, query_bits)
+            else:
+                rows = np.arange(self._size)
+                scores = self._score(self._matrix[:self._size], self._scales[:self._size], query, query_bits)
+            if scores.shape[0] == 0:
+                return []
+            k = min(top_k * max(self.rerank, 1), scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            if self.rerank and self._full is not None:
+                # Exact scores from the full-precision rows, read in row order
+                top = np.sort(rows[top])
+                scores = self._full[top] @ query
+                ids = self._ids[top]
+            else:
+                ids = self._ids[rows[top]]
+                scores = scores[top]
+            order = np.argsort(-scores)[:top_k]
+            return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+def evaluate_quantized_recall(ids, vectors, top_k: int = 10, sample: int = 100, modes=("int8", "binary"),
+                              rerank: int = None):
+    """
+    Recall@top_k of each quantization mode against exact search over the same
+    vectors, with and without re-ranking, plus memory use and p50 latency.
+    Queries are a random sample of the vectors.
+    """
+    exact = VectorIndex()
+    exact.upsert_many(zip(ids.tolist(), vectors))
+    rng = np.random.default_rng(0)
+    queries = [vectors[i] for i in rng.choice(len(ids), min(sample, len(ids)), replace=False)]
+
+    def measure(index):
+        hits, times = 0, []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            found = index.search(query, top_k=top_k)
+            times.append(time.perf_counter() - start)
+            hits += len({note_id for note_id, _ in found} & expected)
+        return {"recall": hits / sum(len(e) for e in truth) if truth else None,
+                "ms_p50": round(float(np.median(times) * 1000), 3) if times else None}
+
+    truth = [{note_id for note_id, _ in exact.search(query, top_k=top_k)} for query in queries]
+    report = {"vectors": len(ids), "dim": exact.dim, "queries": len(queries), "top_k": top_k,
+              "exact": dict(measure(exact), memory_mb=round(exact.memory_bytes() / 2 ** 20, 2))}
+    for mode in modes:
+        index = QuantizedIndex(mode, rerank=rerank)
+        index.upsert_many(zip(ids.tolist(), vectors))
+        reranked = measure(index)
+        index.rerank, configured = 0, index.rerank
+        report[mode] = {
+            "memory_mb": round(index.memory_bytes() / 2 ** 20, 2),
+            "compression": round(exact.memory_bytes() / index.memory_bytes(), 1),
+            "rerank": configured,
+            "codes_only": measure(index),
+            "reranked": reranked,
+        }
+    return report
@@ -0,0 +1,217 @@
+import time
+import random
+import asyncio
+from config import Config
+from services.metrics import AI_REQUEST_SECONDS, AI_RATE_LIMIT_WAIT_SECONDS, AI_TOKENS, AI_ERRORS
+
+KEY_PREFIX = "ratelimit"
+
+# Two token buckets (requests/min, tokens/min) per provider+model, refilled continuously.
+# Uses the Redis clock so every worker replica agrees on time.
+# Returns "0" when granted, otherwise the seconds to wait before trying again.
+ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'req', 'tok', 'ts', 'blocked')
+local blocked = tonumber(b[4]) or 0
+if blocked > now then
+    return tostring(blocked - now)
+end
+local req = tonumber(b[1]) or rpm
+local tok = tonumber(b[2]) or tpm
+local ts = tonumber(b[3]) or now
+local elapsed = math.max(0, now - ts)
+local wait = 0
+if rpm > 0 then
+    req = math.min(rpm, req + elapsed * rpm / 60)
+    if req < 1 then wait = (1 - req) * 60 / rpm end
+end
+if tpm > 0 then
+    cost = math.min(cost, tpm)
+    tok = math.min(tpm, tok + elapsed * tpm / 60)
+    if tok < cost then wait = math.max(wait, (cost - tok) * 60 / tpm) end
+end
+if wait == 0 then
+    req = req - 1
+    tok = tok - cost
+end
+redis.call('HSET', KEYS[1], 'req', req, 'tok', tok, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 300)
+return tostring(wait)
+"""
+
+# Pause the bucket for everyone, e.g. after a 429 with Retry-After
+BLOCK_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local until_ts = now + tonumber(ARGV[1])
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked')) or 0
+if until_ts > blocked then
+    redis.call('HSET', KEYS[1], 'blocked', until_ts)
+    redis.call('EXPIRE', KEYS[1], math.max(300, math.ceil(tonumber(ARGV[1]))))
+end
+return 1
+"""
+
+
+def estimate_tokens(texts) -> int:
+    """Cheap token estimate (~4 chars per token) for tokens/min budgeting."""
+    if isinstance(texts, str):
+        texts = [texts]
+    return max(1, sum(len(text) for text in texts) // 4)
+
+
+class RateLimiter:
+    """
+    Cluster-wide rate limiter shared by every app and worker process through Redis.
+    Limits come from Config.RATE_LIMITS keyed "provider:model"; models without
+    an entry are not limited. Redis errors fail open.
+    """
+
+    def __init__(self, redis_client=None, limits: dict = None):
+        self.redis = redis_client
+        self.limits = limits if limits is not None else Config.RATE_LIMITS
+        self._acquire = redis_client.register_script(ACQUIRE_SCRIPT) if redis_client is not None else None
+        self._block = redis_client.register_script(BLOCK_SCRIPT) if redis_client is not None else None
+
+    def _key(self, provider: str, model: str):
+        return f"{KEY_PREFIX}:{provider}:{model}"
+
+    def try_acquire(self, provider: str, model: str, tokens: int = 1) -> float:
+        """Take one request and `tokens` tokens if available. Returns 0 or the seconds to wait."""
+        limit = self.limits.get(f"{provider}:{model}")
+        if not limit or self._acquire is None:
+            return 0.0
+        try:
+            wait = self._acquire(keys=[self._key(provider, model)],
+                                 args=[limit.get("rpm", 0), limit.get("tpm", 0), tokens])
+            return float(wait)
+        except Exception as e:
+            print(f"Rate limiter unavailable, not throttling: {e}")
+            return 0.0
+
+    def acquire(self, provider: str, model: str, tokens: int = 1):
+        while True:
+            wait = self.try_acquire(provider, model, tokens)
+            if wait <= 0:
+                return
+            time.sleep(min(wait, 5.0))
+
+    async def aacquire(self, provider: str, model: str, tokens: int = 1):
+        while True:
+            wait = self.try_acquire(provider, model, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(min(wait, 5.0))
+
+    def block(self, provider: str, model: str, seconds: float):
+        if self._block is None or seconds <= 0:
+            return
+        try:
+            self._block(keys=[self._key(provider, model)], args=[seconds])
+        except Exception as e:
+            print(f"Rate limiter unavailable, could not pause {provider}:{model}: {e}")
+
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_NAMES = ("RateLimit", "ResourceExhausted", "ServiceUnavailable", "Timeout", "APIConnection", "InternalServer")
+
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int) and status in RETRYABLE_STATUS:
+        return True
+    return any(name in type(error).__name__ for name in RETRYABLE_NAMES)
+
+
+def retry_after_seconds(error: Exception):
+    """Retry-After from the provider response, if it sent one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def backoff_delay(attempt: int, error: Exception = None) -> float:
+    retry_after = retry_after_seconds(error) if error is not None else None
+    if retry_after is not None:
+        return retry_after
+    delay = min(Config.AI_RETRY_MAX_SECONDS, Config.AI_RETRY_BASE_SECONDS * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)  # jitter so replicas don't retry in lockstep
+
+
+def call_with_retry(fn, provider: str, model: str, tokens: int = 1, limiter: RateLimiter = None, max_retries: int = None):
+    """Run fn() under the shared limiter, retrying transient errors with exponential backoff."""
+    limiter = limiter or get_rate_limiter()
+    max_retries = Config.AI_MAX_RETRIES if max_retries is None else max_retries
+    for attempt in range(max_retries + 1):
+        with AI_RATE_LIMIT_WAIT_SECONDS.time(provider=provider, model=model):
+            limiter.acquire(provider, model, tokens)
+        AI_TOKENS.inc(tokens, provider=provider, model=model)
+        start = time.perf_counter()
+        try:
+            result = fn()
+        except Exception as e:
+            AI_REQUEST_SECONDS.observe(time.perf_counter() - start, provider=provider, model=model)
+            AI_ERRORS.inc(provider=provider, model=model, error=type(e).__name__)
+            if not is_retryable(e) or attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt, e)
+            if retry_after_seconds(e) is not None:
+                limiter.block(provider, model, delay)
+            print(f"{provider}:{model} call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        AI_REQUEST_SECONDS.observe(time.perf_counter() - start, provider=provider, model=model)
+        return result
+
+
+async def acall_with_retry(coro_fn, provider: str, model: str, tokens: int = 1, limiter: RateLimiter = None):
+    """Async version of call_with_retry; coro_fn() must return a new awaitable each call."""
+    limiter = limiter or get_rate_limiter()
+    for attempt in range(Config.AI_MAX_RETRIES + 1):
+        with AI_RATE_LIMIT_WAIT_SECONDS.time(provider=provider, model=model):
+            await limiter.aacquire(provider, model, tokens)
+        AI_TOKENS.inc(tokens, provider=provider, model=model)
+        start = time.perf_counter()
+        try:
+            result = await coro_fn()
+        except Exception as e:
+            AI_REQUEST_SECONDS.observe(time.perf_counter() - start, provider=provider, model=model)
+            AI_ERRORS.inc(provider=provider, model=model, error=type(e).__name__)
+            if not is_retryable(e) or attempt == Config.AI_MAX_RETRIES:
+                raise
+            delay = backoff_delay(attempt, e)
+            if retry_after_seconds(e) is not None:
+                limiter.block(provider, model, delay)
+            print(f"{provider}:{model} call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        AI_REQUEST_SECONDS.observe(time.perf_counter() - start, provider=provider, model=model)
+        return result
+
+
+_limiter = None
+
+
+def get_rate_limiter():
+    global _limiter
+    if _limiter is None:
+        try:
+            from database import redis_client
+            _limiter = RateLimiter(redis_client)
+        except Exception as e:
+            print(f"Rate limiter running without Redis: {e}")
+            _limiter = RateLimiter(None)
+    return _limiter
@@ -0,0 +1,244 @@
+# Related notes: a top-k nearest-neighbour graph over the note embeddings of the active
+# space, stored as edges in note_neighbors, so a card reads its related notes with one
+# indexed lookup instead of a corpus scan. A rebuild scores every note against all the
+# others in row blocks spread over a process pool; between rebuilds the workers apply
+# the notes changed since the last pass (the updated_at watermark sync_index uses too).
+import os
+import time
+import datetime
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from sqlalchemy import func, insert
+from config import Config
+from models import KnowledgeNote, NoteNeighbor, space_name
+from services.vector_index import iter_active_embeddings, ensure_index_loaded, _is_empty
+from services.embedding_space import get_active_space
+
+GRAPH_STATE_KEY = "related:state"  # hash: space, k, synced_at, built_at, refreshed_at, version
+BLOCK_VALUES = 2 ** 24  # similarity scores per block: bounds each process's temporary matrix to 64 MB
+ID_CHUNK = 1000  # ids per IN (...) list
+INSERT_CHUNK = 5000
+
+
+def _read_state():
+    from database import redis_client
+
+    return redis_client.hgetall(GRAPH_STATE_KEY)
+
+
+def _write_state(**fields):
+    from database import redis_client
+
+    redis_client.hset(GRAPH_STATE_KEY, mapping={name: "" if value is None else value for name, value in fields.items()})
+
+
+def _corpus_version():
+    """
+    The result cache's corpus version, bumped by every write the graph depends on
+    (content, deletes, embeddings; not claims or status changes); None without Redis.
+    """
+    from services.result_cache import get_result_cache
+
+    return get_result_cache().version()
+
+
+def _chunks(items, size=ID_CHUNK):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _block_neighbors(path: str, start: int, stop: int, k: int):
+    """Top-k (positions, scores) of rows start:stop of the saved matrix against every row, self excluded."""
+    vectors = np.asarray(np.load(path, mmap_mode="r"))
+    scores = vectors[start:stop] @ vectors.T
+    scores[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return start, np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _replace_edges(db, neighbors: dict, removed=()):
+    """Swap in the edges of each note of neighbors ({note_id: [(neighbor_id, score)]}) and drop those of removed notes."""
+    removed = list(removed)
+    for chunk in _chunks(list(neighbors) + removed):
+        db.query(NoteNeighbor).filter(NoteNeighbor.note_id.in_(chunk)).delete(synchronize_session=False)
+    for chunk in _chunks(removed):
+        db.query(NoteNeighbor).filter(NoteNeighbor.neighbor_id.in_(chunk)).delete(synchronize_session=False)
+    rows = [{"note_id": note_id, "neighbor_id": other, "score": score}
+            for note_id, items in neighbors.items() for other, score in items]
+    for chunk in _chunks(rows, INSERT_CHUNK):
+        db.execute(insert(NoteNeighbor), chunk)
+    db.commit()
+
+
+def rebuild_related_notes(db, k: int = None, workers: int = None):
+    """
+    Recompute the whole graph for the active space: the exact top-k of every note,
+    block by block on `workers` processes (Config.RELATED_WORKERS, 0 = all cores).
+    Each block's edges replace the old ones in their own transaction, so readers
+    never find a note without neighbours mid-rebuild. Returns a report.
+    """
+    k = k or Config.RELATED_K
+    started = time.perf_counter()
+    version = _corpus_version()
+    space = get_active_space(db)
+    # Anything written from here on is picked up by the next incremental pass
+    synced_at = db.query(func.max(KnowledgeNote.updated_at)).scalar()
+    ids, vectors = [], []
+    # No active space yet: nothing comparable to link
+    for note_id, embedding, _ in iter_active_embeddings(db, space) if space else ():
+        if not _is_empty(embedding):
+            ids.append(note_id)
+            vectors.append(np.asarray(embedding, dtype=np.float32))
+    count = len(ids)
+    top_k = min(k, count - 1)
+    rewritten = 0
+    if top_k > 0:
+        matrix = np.vstack(vectors)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        matrix /= norms
+        del vectors
+        rows = max(1, BLOCK_VALUES // count)
+        blocks = [(start, min(start + rows, count)) for start in range(0, count, rows)]
+        workers = min(workers or Config.RELATED_WORKERS or os.cpu_count() or 1, len(blocks))
+        fd, path = tempfile.mkstemp(suffix=".npy")
+        os.close(fd)
+        try:
+            # Workers map the saved matrix instead of each receiving a pickled copy
+            np.save(path, matrix)
+            del matrix
+            if workers > 1:
+                # Fresh interpreters: the worker calling this has threads of its own
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                    futures = [pool.submit(_block_neighbors, path, start, stop, top_k) for start, stop in blocks]
+                    results = (future.result() for future in as_completed(futures))
+                    rewritten = _write_blocks(db, ids, results)
+            else:
+                rewritten = _write_blocks(db, ids, (_block_neighbors(path, start, stop, top_k) for start, stop in blocks))
+        finally:
+            os.remove(path)
+    kept = set(ids) if top_k > 0 else set()
+    stale = [note_id for note_id, in db.query(NoteNeighbor.note_id).distinct() if note_id not in kept]
+    _replace_edges(db, {}, stale)
+    now = time.time()
+    _write_state(space=space, k=k, synced_at=synced_at.isoformat() if synced_at else None,
+                 built_at=now, refreshed_at=now, version=version)
+    return {"mode": "rebuild", "notes": count, "rewritten": rewritten, "dropped": len(stale),
+            "workers": workers if top_k > 0 else 0, "seconds": time.perf_counter() - started}
+
+
+def _write_blocks(db, ids, results):
+    written = 0
+    for start, top, top_scores in results:
+        neighbors = {
+            ids[start + row]: [(ids[col], float(score)) for col, score in zip(top[row], top_scores[row])]
+            for row in range(top.shape[0])
+        }
+        _replace_edges(db, neighbors)
+        written += len(neighbors)
+    return written
+
+
+def _index_neighbors(index, note_id: int, embedding, k: int):
+    return [(other, score) for other, score in index.search(embedding, top_k=k + 1) if other != note_id][:k]
+
+
+def refresh_due():
+    """Whether notes were written since the last pass and Config.RELATED_REFRESH_INTERVAL has passed, or a rebuild is due."""
+    if not Config.RELATED_REFRESH_INTERVAL:
+        return False
+    state = _read_state()
+    if not state:
+        return True
+    now = time.time()
+    if Config.RELATED_REBUILD_INTERVAL and now - float(state["built_at"]) >= Config.RELATED_REBUILD_INTERVAL:
+        return True
+    if now - float(state["refreshed_at"]) < Config.RELATED_REFRESH_INTERVAL:
+        return False
+    version = _corpus_version()
+    return version is not None and str(version) != state.get("version")
+
+
+def refresh_related_notes(db, k: int = None):
+    """
+    Bring the graph up to date with the notes changed since the last pass, or rebuild
+    it when there is none yet for the active space and k, or Config.RELATED_REBUILD_INTERVAL
+    has passed. A changed note gets its top-k from the search index (loaded in this
+    process), notes listing a changed or removed note are recomputed, and a changed
+    note joins the lists of its neighbours where it beats their k-th. Lists of notes
+    outside both sets can miss a newcomer until the next rebuild.
+    Returns a report; "near_duplicates" holds (note, neighbour, score) of changed notes
+    at least Config.NEAR_DUPLICATE_SCORE similar to another note.
+    """
+    k = k or Config.RELATED_K
+    state = _read_state()
+    space = get_active_space(db)
+    if (not state or state["space"] != (space or "") or int(state["k"]) != k
+            or (Config.RELATED_REBUILD_INTERVAL
+                and time.time() - float(state["built_at"]) >= Config.RELATED_REBUILD_INTERVAL)):
+        return rebuild_related_notes(db, k)
+    started = time.perf_counter()
+    version = _corpus_version()
+    synced_at = datetime.datetime.fromisoformat(state["synced_at"]) if state.get("synced_at") else None
+    index = ensure_index_loaded(db)
+
+    query = db.query(
+        KnowledgeNote.id, KnowledgeNote.embedding, KnowledgeNote.is_deleted, KnowledgeNote.updated_at,
+        KnowledgeNote.ai_provider, KnowledgeNote.embedding_model
+    )
+    if synced_at is not None:
+        # >= because DATETIME columns may only have second resolution
+        query = query.filter(KnowledgeNote.updated_at >= synced_at)
+    live, removed = {}, set()
+    for note_id, embedding, is_deleted, updated_at, provider, model in query.yield_per(1000):
+        if is_deleted or _is_empty(embedding) or space_name(provider, model) != space:
+            removed.add(note_id)
+        else:
+            live[note_id] = embedding
+        if updated_at and (synced_at is None or updated_at > synced_at):
+            synced_at = updated_at
+
+    neighbors = {}
+    if live or removed:
+        changed = set(live) | removed
+        listers = set()
+        for chunk in _chunks(changed):
+            listers.update(note_id for note_id, in db.query(NoteNeighbor.note_id)
+                           .filter(NoteNeighbor.neighbor_id.in_(chunk)).distinct())
+        listers -= changed
+        vectors = dict(live)
+        for chunk in _chunks(listers):
+            vectors.update(db.query(KnowledgeNote.id, KnowledgeNote.embedding)
+                           .filter(KnowledgeNote.id.in_(chunk), KnowledgeNote.is_deleted == False))
+        for note_id, embedding in vectors.items():
+            if not _is_empty(embedding):
+                neighbors[note_id] = _index_neighbors(index, note_id, embedding, k)
+
+        joins = {}
+        for note_id in live:
+            for other, score in neighbors.get(note_id, []):
+                if other not in neighbors:
+                    joins.setdefault(other, []).append((note_id, score))
+        current = {}
+        for chunk in _chunks(joins):
+            for note_id, other, score in db.query(NoteNeighbor.note_id, NoteNeighbor.neighbor_id, NoteNeighbor.score) \
+                    .filter(NoteNeighbor.note_id.in_(chunk)):
+                current.setdefault(note_id, {})[other] = score
+        for note_id, additions in joins.items():
+            merged = dict(current.get(note_id, {}))
+            merged.update(additions)
+            top = sorted(merged.items(), key=lambda item: -item[1])[:k]
+            if set(top) != set(current.get(note_id, {}).items()):
+                neighbors[note_id] = top
+        _replace_edges(db, neighbors, removed)
+
+    _write_state(synced_at=synced_at.isoformat() if synced_at else None, refreshed_at=time.time(), version=version)
+    near_duplicates = [(note_id, neighbors[note_id][0][0], neighbors[note_id][0][1]) for note_id in live
+                       if neighbors.get(note_id) and neighbors[note_id][0][1] >= Config.NEAR_DUPLICATE_SCORE]
+    return {"mode": "incremental", "changed": len(live), "removed": len(removed), "rewritten": len(neighbors),
+            "near_duplicates": near_duplicates, "seconds": time.perf_counter() - started}
@@ -0,0 +1,181 @@
+import pickle
+import hashlib
+import functools
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from services.metrics import RESULT_CACHE_SECONDS
+
+KEY_PREFIX = "results"
+VERSION_KEY = "corpus:version"  # bumped by writes that change listings or searches, shared by all processes
+RETRY_AFTER = 30  # seconds without caching after Redis fails, instead of waiting on it every call
+
+
+def _freeze(value):
+    """Hashable, order-independent form of call arguments (filters dicts, id sets...)."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class ResultCache:
+    """
+    Listing pages and search results, keyed by the call and the corpus version.
+
+    Writes to content, category, tags, deleted state or embeddings bump the version
+    with one INCR, so entries computed before it are never read again, in any process,
+    and simply age out (TTL in Redis, LRU locally). Claims and status changes don't:
+    NoteService re-reads the status of cached summaries.
+    A small in-process LRU sits in front of Redis. Without Redis nothing is cached:
+    the version could not be shared with the workers.
+    """
+
+    def __init__(self, redis_client=None, ttl: int = None, local_size: int = None):
+        self.redis = redis_client
+        self.ttl = ttl or Config.RESULT_CACHE_TTL
+        self.local_size = local_size or Config.RESULT_CACHE_LOCAL_SIZE
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self._missed_bump = False
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def _available(self):
+        return self.redis is not None and time.monotonic() >= self._down_until
+
+    def _failed(self, what: str, error):
+        print(f"Result cache {what} failed, caching off for {RETRY_AFTER}s: {error}")
+        self._down_until = time.monotonic() + RETRY_AFTER
+        with self._lock:
+            # Writes made meanwhile can't bump the version; don't serve what we hold
+            self._local.clear()
+
+    def version(self):
+        if not self._available():
+            return None
+        try:
+            if self._missed_bump:
+                # This process wrote while Redis was unreachable
+                self._missed_bump = False
+                return int(self.redis.incr(VERSION_KEY))
+            return int(self.redis.get(VERSION_KEY) or 0)
+        except Exception as e:
+            self._failed("version read", e)
+            return None
+
+    def bump(self):
+        """Invalidate every cached result."""
+        if self.redis is None:
+            return
+        if not self._available():
+            self._missed_bump = True
+            return
+        try:
+            self.redis.incr(VERSION_KEY)
+            self._missed_bump = False
+        except Exception as e:
+            self._missed_bump = True
+            self._failed("version bump", e)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._local[key] = value
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get_or_compute(self, name: str, args, compute, keep=None):
+        """
+        Cached result of compute() for `name` called with `args` at the current corpus
+        version. keep(value) returning False leaves a result uncached (e.g. degraded).
+        """
+        start = time.perf_counter()
+        outcome, value = self._lookup(name, args, compute, keep)
+        RESULT_CACHE_SECONDS.observe(time.perf_counter() - start, name=name, outcome=outcome)
+        return value
+
+    def _lookup(self, name: str, args, compute, keep):
+        """(outcome, value); outcome is local_hit, redis_hit, miss or bypass (no cache)."""
+        version = self.version()
+        if version is None:
+            return "bypass", compute()
+        digest = hashlib.sha256(repr(_freeze(args)).encode("utf-8")).hexdigest()
+        key = f"{KEY_PREFIX}:{version}:{name}:{digest}"
+        with self._lock:
+            if key in self._local:
+                self._local.move_to_end(key)
+                self.stats["local_hits"] += 1
+                return "local_hit", self._local[key]
+        try:
+            blob = self.redis.get(key)
+            if blob is not None:
+                value = pickle.loads(blob)
+                self._remember(key, value)
+                self.stats["redis_hits"] += 1
+                return "redis_hit", value
+        except Exception as e:
+            self._failed("read", e)
+            return "bypass", compute()
+        value = compute()
+        self.stats["misses"] += 1
+        if keep is not None and not keep(value):
+            return "miss", value
+        self._remember(key, value)
+        try:
+            self.redis.set(key, pickle.dumps(value), ex=self.ttl)
+        except Exception as e:
+            self._failed("write", e)
+        return "miss", value
+
+    def report(self):
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return dict(self.stats, hit_rate=hits / total if total else 0.0)
+
+
+_cache = None
+
+
+def get_result_cache():
+    global _cache
+    if _cache is None:
+        try:
+            from database import redis_binary_client
+            client = redis_binary_client
+        except Exception as e:
+            print(f"Result cache running without Redis: {e}")
+            client = None
+        _cache = ResultCache(client)
+    return _cache
+
+
+def cached_result(fn):
+    """
+    Decorator for NoteService reads: served from the result cache until the next write.
+    Put it above @track_query, so NoteService latency only counts calls that ran queries.
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        return get_result_cache().get_or_compute(
+            fn.__name__, (args, kwargs), lambda: fn(self, *args, **kwargs)
+        )
+    return wrapper
+
+
+def invalidates_results(fn):
+    """
+    Decorator for writes that change what listings and searches return (content,
+    category, tags, deleted state, embeddings): bump the corpus version once done.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            get_result_cache().bump()
+    return wrapper
@@ -0,0 +1,381 @@
+import threading
+from collections import defaultdict
+import numpy as np
+from config import Config
+
+
+def _is_empty(vector):
+    return vector is None or len(vector) == 0
+
+
+class VectorIndex:
+    """
+    In-memory embedding matrix for exact cosine search.
+
+    All vectors are L2-normalized once on insert and kept in a single float32
+    matrix with a parallel id array, so scoring a query is one matrix-vector
+    product and picking top_k is an argpartition instead of a full sort.
+    """
+
+    def __init__(self, dim: int = None, capacity: int = 1024):
+        self.dim = dim
+        self._capacity = capacity
+        self._matrix = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._rows = {}  # note_id -> row in matrix
+        self._size = 0
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.synced_at = None  # newest updated_at seen, used by sync_index
+        self.space = None      # embedding space loaded; None = whatever the rows hold
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, note_id):
+        return note_id in self._rows
+
+    @staticmethod
+    def _normalize(vector):
+        vec = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vec)
+        if norm == 0 or not np.isfinite(norm):
+            return None
+        return vec / norm
+
+    def _ensure_capacity(self, needed: int):
+        if self._matrix is None:
+            capacity = max(self._capacity, needed)
+            self._matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+            self._ids = np.zeros(capacity, dtype=np.int64)
+            return
+        if needed <= self._matrix.shape[0]:
+            return
+        capacity = max(needed, self._matrix.shape[0] * 2)
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+    def upsert(self, note_id: int, embedding):
+        """Insert or replace a note's vector. Vectors of another dimension are dropped."""
+        if _is_empty(embedding):
+            self.remove([note_id])
+            return False
+        vec = self._normalize(embedding)
+        with self._lock:
+            if vec is None:
+                self._remove_locked(note_id)
+                return False
+            if self.dim is None:
+                self.dim = vec.shape[0]
+            if vec.shape[0] != self.dim:
+                # Provider switch edge case: keep the index single-dimension
+                self._remove_locked(note_id)
+                return False
+            row = self._rows.get(note_id)
+            if row is None:
+                self._ensure_capacity(self._size + 1)
+                row = self._size
+                self._size += 1
+                self._rows[note_id] = row
+                self._ids[row] = note_id
+            self._store(row, vec)
+            return True
+
+    def upsert_many(self, items):
+        for note_id, embedding in items:
+            self.upsert(note_id, embedding)
+
+    def _store(self, row: int, vec):
+        self._matrix[row] = vec
+
+    def _move(self, dst: int, src: int):
+        self._matrix[dst] = self._matrix[src]
+
+    def _remove_locked(self, note_id: int):
+        row = self._rows.pop(note_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        if row != last:
+            # Swap the last row into the hole to keep the matrix dense
+            moved_id = int(self._ids[last])
+            self._move(row, last)
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._size = last
+
+    def remove(self, note_ids):
+        with self._lock:
+            for note_id in note_ids:
+                self._remove_locked(note_id)
+
+    def clear(self):
+        with self._lock:
+            self._matrix = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._rows = {}
+            self._size = 0
+            self.dim = None
+            self.loaded = False
+            self.synced_at = None
+
+    def memory_bytes(self):
+        """Bytes held by the vectors and ids of the indexed notes."""
+        with self._lock:
+            if self._matrix is None:
+                return 0
+            return self._matrix[:self._size].nbytes + self._ids[:self._size].nbytes
+
+    def snapshot(self):
+        """Copy of (ids, normalized vectors) currently held."""
+        with self._lock:
+            if self._matrix is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, self.dim or 0), dtype=np.float32)
+            return self._ids[:self._size].copy(), self._matrix[:self._size].copy()
+
+    def load(self, db):
+        with self._lock:
+            self.clear()
+            for note_id, embedding, updated_at in iter_active_embeddings(db, self.space):
+                self.upsert(note_id, embedding)
+                if updated_at and (self.synced_at is None or updated_at > self.synced_at):
+                    self.synced_at = updated_at
+            self.loaded = True
+
+    def search(self, query_embedding, top_k: int = 10, allowed_ids=None):
+        """
+        Return [(note_id, score), ...] sorted by descending cosine similarity.
+        allowed_ids optionally restricts the candidates to a set of note ids.
+        """
+        query = None if _is_empty(query_embedding) else self._normalize(query_embedding)
+        with self._lock:
+            if query is None or self._size == 0 or query.shape[0] != self.dim:
+                return []
+            if allowed_ids is not None:
+                # Pre-filter: only the allowed rows are scored, so cost follows the filter size
+                rows = np.fromiter((self._rows[i] for i in allowed_ids if i in self._rows), dtype=np.int64)
+                ids = self._ids[rows]
+                scores = self._matrix[rows] @ query
+            else:
+                ids = self._ids[:self._size].copy()
+                scores = self._matrix[:self._size] @ query
+        if scores.shape[0] == 0:
+            return []
+        k = min(top_k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+class PassageIndex(VectorIndex):
+    """
+    Passage vectors of long notes, keyed by chunk id. search_notes max-pools
+    passage scores per note, so a long note ranks as well as its best passage.
+    """
+
+    def __init__(self, dim: int = None, capacity: int = 1024):
+        super().__init__(dim, capacity)
+        self._note_of = {}                  # chunk_id -> note_id
+        self._chunks_of = defaultdict(set)  # note_id -> chunk ids
+
+    def set_note_passages(self, note_id: int, passages):
+        """Replace a note's passages with [(chunk_id, embedding), ...]."""
+        with self._lock:
+            self.remove_notes([note_id])
+            for chunk_id, embedding in passages:
+                if self.upsert(chunk_id, embedding):
+                    self._note_of[chunk_id] = note_id
+                    self._chunks_of[note_id].add(chunk_id)
+
+    def remove_notes(self, note_ids):
+        with self._lock:
+            for note_id in note_ids:
+                chunk_ids = self._chunks_of.pop(note_id, ())
+                for chunk_id in chunk_ids:
+                    self._note_of.pop(chunk_id, None)
+                self.remove(chunk_ids)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+            self._note_of = {}
+            self._chunks_of = defaultdict(set)
+
+    def search_notes(self, query_embedding, top_k: int = 10, allowed_ids=None):
+        """[(note_id, score, chunk_id), ...] for the best passage of each note, best first."""
+        with self._lock:
+            allowed_chunks = None
+            if allowed_ids is not None:
+                allowed_chunks = [chunk_id for note_id in allowed_ids for chunk_id in self._chunks_of.get(note_id, ())]
+                if not allowed_chunks:
+                    return []
+            fetch = top_k * 4
+            while True:
+                hits = self.search(query_embedding, top_k=fetch, allowed_ids=allowed_chunks)
+                best = {}
+                for chunk_id, score in hits:
+                    note_id = self._note_of[chunk_id]
+                    if note_id not in best:
+                        best[note_id] = (note_id, score, chunk_id)
+                # Several passages of one note can crowd the candidates; widen until top_k notes
+                if len(best) >= top_k or len(hits) < fetch:
+                    break
+                fetch *= 4
+        return list(best.values())[:top_k]
+
+    def _space_filter(self):
+        from models import NoteChunk
+
+        return [NoteChunk.space == self.space] if self.space is not None else []
+
+    def _apply(self, rows):
+        grouped = defaultdict(list)
+        for chunk_id, note_id, embedding in rows:
+            grouped[note_id].append((chunk_id, embedding))
+        for note_id, passages in grouped.items():
+            self.set_note_passages(note_id, passages)
+
+    def load(self, db):
+        from sqlalchemy import func
+        from models import KnowledgeNote, NoteChunk
+
+        synced_at = db.query(func.max(KnowledgeNote.updated_at)).scalar()
+        rows = db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.embedding).join(
+            KnowledgeNote, KnowledgeNote.id == NoteChunk.note_id
+        ).filter(
+            KnowledgeNote.is_deleted == False,
+            NoteChunk.embedding.isnot(None),
+            *self._space_filter()
+        ).yield_per(1000)
+        with self._lock:
+            self.clear()
+            self._apply(rows)
+            self.synced_at = synced_at
+            self.loaded = True
+
+    def sync(self, db, batch_size: int = 1000):
+        """Reload the passages of notes changed since the last load/sync."""
+        from models import KnowledgeNote, NoteChunk
+
+        query = db.query(KnowledgeNote.id, KnowledgeNote.is_deleted, KnowledgeNote.updated_at)
+        if self.synced_at is not None:
+            query = query.filter(KnowledgeNote.updated_at >= self.synced_at)
+        changed = query.all()
+        with self._lock:
+            for start in range(0, len(changed), batch_size):
+                batch = changed[start:start + batch_size]
+                self.remove_notes([row.id for row in batch])
+                active = [row.id for row in batch if not row.is_deleted]
+                if active:
+                    self._apply(db.query(NoteChunk.id, NoteChunk.note_id, NoteChunk.embedding).filter(
+                        NoteChunk.note_id.in_(active),
+                        NoteChunk.embedding.isnot(None),
+                        *self._space_filter()
+                    ))
+                for row in batch:
+                    if row.updated_at and (self.synced_at is None or row.updated_at > self.synced_at):
+                        self.synced_at = row.updated_at
+
+
+_index = None
+_index_lock = threading.Lock()
+_passages = PassageIndex()
+
+
+def get_vector_index():
+    """Process-wide search index: exact matrix, IVF or quantized, depending on Config.SEARCH_BACKEND."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if Config.SEARCH_BACKEND == "ivf":
+                    from services.ann_index import AnnIndex
+                    _index = AnnIndex(Config.ANN_INDEX_DIR)
+                elif Config.SEARCH_BACKEND in ("int8", "binary"):
+                    from services.quantized_index import QuantizedIndex
+                    _index = QuantizedIndex(Config.SEARCH_BACKEND)
+                else:
+                    _index = VectorIndex()
+    return _index
+
+
+def get_passage_index():
+    """Process-wide passage index (always exact; only long notes have passages)."""
+    return _passages
+
+
+def iter_active_embeddings(db, space: str = None, batch_size: int = 1000):
+    """(id, embedding, updated_at) of active notes, only those embedded in `space` if given."""
+    from models import KnowledgeNote
+    from services.embedding_space import space_criteria
+
+    return db.query(KnowledgeNote.id, KnowledgeNote.embedding, KnowledgeNote.updated_at).filter(
+        KnowledgeNote.is_deleted == False,
+        KnowledgeNote.embedding.isnot(None),
+        *(space_criteria(space) if space else [])
+    ).yield_per(batch_size)
+
+
+def load_index(db, index=None):
+    """Fill the index with every active note that has an embedding."""
+    if index is None:
+        index = get_vector_index()
+    index.load(db)
+    return index
+
+
+def sync_index(db, index=None):
+    """
+    Apply rows changed since the last load/sync.
+    Picks up writes made by other processes (e.g. the RQ worker) without a rebuild.
+    """
+    from models import KnowledgeNote, space_name
+
+    if index is None:
+        index = get_vector_index()
+    if hasattr(index, "reload_if_stale"):
+        index.reload_if_stale()
+    query = db.query(
+        KnowledgeNote.id, KnowledgeNote.embedding, KnowledgeNote.is_deleted, KnowledgeNote.updated_at,
+        KnowledgeNote.ai_provider, KnowledgeNote.embedding_model
+    )
+    if index.synced_at is not None:
+        # >= because DATETIME columns may only have second resolution
+        query = query.filter(KnowledgeNote.updated_at >= index.synced_at)
+    with index._lock:
+        for note_id, embedding, is_deleted, updated_at, provider, model in query.yield_per(1000):
+            other_space = index.space is not None and space_name(provider, model) != index.space
+            if is_deleted or _is_empty(embedding) or other_space:
+                index.remove([note_id])
+            else:
+                index.upsert(note_id, embedding)
+            if updated_at and (index.synced_at is None or updated_at > index.synced_at):
+                index.synced_at = updated_at
+    return index
+
+
+def ensure_index_loaded(db):
+    """
+    Load the note and passage indexes for the active embedding space, or catch
+    them up. When another process switches the active space they are rebuilt.
+    """
+    from services.embedding_space import get_active_space
+
+    space = get_active_space(db)
+    index = get_vector_index()
+    if not index.loaded or index.space != space:
+        with index._lock:
+            if index.space != space:
+                index.clear()
+            index.space = space
+            load_index(db, index)
+    if not _passages.loaded or _passages.space != space:
+        with _passages._lock:
+            _passages.space = space
+            _passages.load(db)
+    else:
+        _passages.sync(db)
+    return sync_index(db, index)
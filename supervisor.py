@@ -0,0 +1,163 @@
+import math
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+import multiprocessing
+from config import Config
+from services.metrics import QUEUE_DEPTH, QUEUE_OLDEST_SECONDS, WORKER_PROCESSES, start_metrics_server
+import worker
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("supervisor")
+
+
+def serve(mode: str, slot: int, batch_size: int = None, max_wait_ms: int = None):
+    """Body of one pool process: a worker with a metrics port of its own."""
+    if Config.WORKER_METRICS_PORT:
+        start_metrics_server(Config.WORKER_METRICS_PORT + slot, Config.METRICS_HOST)
+    worker.run_worker(mode, batch_size, max_wait_ms, slot=slot)
+
+
+def desired_size(stats: dict, current: int, min_procs: int, max_procs: int):
+    """
+    One process per Config.WORKER_SCALE_DEPTH waiting jobs, and one more than now
+    whenever a job has waited longer than Config.WORKER_SCALE_MAX_AGE, within bounds.
+    """
+    depth = sum(queue["depth"] for queue in stats.values())
+    oldest = max((queue["oldest_seconds"] for queue in stats.values()), default=0)
+    wanted = math.ceil(depth / max(Config.WORKER_SCALE_DEPTH, 1))
+    if oldest > Config.WORKER_SCALE_MAX_AGE:
+        wanted = max(wanted, current + 1)
+    return max(min_procs, min(max_procs, wanted))
+
+
+class WorkerPool:
+    """
+    Worker processes of one mode, numbered from 1. Grows as soon as the queues call
+    for it; shrinks by one process after Config.WORKER_SCALE_DOWN_AFTER seconds of
+    spare capacity. A stopped process finishes the job (or batch) in hand first.
+    """
+
+    def __init__(self, mode: str, min_procs: int = None, max_procs: int = None,
+                 batch_size: int = None, max_wait_ms: int = None):
+        self.mode = mode
+        self.min_procs = max(1, Config.WORKER_MIN_PROCESSES if min_procs is None else min_procs)
+        self.max_procs = max(self.min_procs, Config.WORKER_MAX_PROCESSES if max_procs is None else max_procs)
+        self.worker_args = (batch_size, max_wait_ms)
+        self.running = {}  # slot -> Process
+        self.stopping = {}  # slot -> Process finishing its last job; the slot stays taken
+        self._spare_since = None
+        # Fresh interpreters rather than forks of this multi-threaded process
+        self._context = multiprocessing.get_context("spawn")
+
+    def _start(self):
+        taken = set(self.running) | set(self.stopping)
+        slot = next(n for n in range(1, len(taken) + 2) if n not in taken)
+        proc = self._context.Process(target=serve, args=(self.mode, slot) + self.worker_args, name=f"worker-{slot}")
+        proc.start()
+        self.running[slot] = proc
+        logger.info(f"Started worker {slot} (pid {proc.pid}), {len(self.running)} running.")
+
+    def _stop(self):
+        slot = max(self.running)
+        proc = self.running.pop(slot)
+        proc.terminate()  # SIGTERM: warm shutdown
+        self.stopping[slot] = proc
+        logger.info(f"Stopping worker {slot} (pid {proc.pid}), {len(self.running)} running.")
+
+    def reap(self):
+        """Forget processes that have exited; a crashed one is replaced on the next resize."""
+        for procs in (self.running, self.stopping):
+            for slot, proc in list(procs.items()):
+                if not proc.is_alive():
+                    proc.join()
+                    del procs[slot]
+                    if procs is self.running:
+                        logger.warning(f"Worker {slot} exited unexpectedly (code {proc.exitcode}).")
+
+    def resize(self, stats: dict = None):
+        """Scale towards what the queue stats call for; without stats, only keep the minimum up."""
+        self.reap()
+        current = len(self.running)
+        if stats is None:
+            wanted = max(current, self.min_procs)
+        else:
+            wanted = desired_size(stats, current, self.min_procs, self.max_procs)
+        if wanted > current:
+            self._spare_since = None
+            for _ in range(wanted - current):
+                self._start()
+        elif wanted < current:
+            now = time.monotonic()
+            if self._spare_since is None:
+                self._spare_since = now
+            elif now - self._spare_since >= Config.WORKER_SCALE_DOWN_AFTER:
+                self._stop()
+                self._spare_since = now
+        else:
+            self._spare_since = None
+        WORKER_PROCESSES.set(len(self.running))
+
+    def shutdown(self):
+        """Stop every process and wait for the jobs in hand to finish."""
+        while self.running:
+            self._stop()
+        for proc in self.stopping.values():
+            proc.join()
+        self.stopping.clear()
+        WORKER_PROCESSES.set(0)
+
+
+def read_queue_stats(mode: str):
+    """worker.queue_stats(), also published as gauges; None when Redis can't be read."""
+    try:
+        stats = worker.queue_stats(mode)
+    except Exception as e:
+        logger.warning(f"Could not read queue stats: {e}")
+        return None
+    for name, queue in stats.items():
+        QUEUE_DEPTH.set(queue["depth"], queue=name)
+        QUEUE_OLDEST_SECONDS.set(round(queue["oldest_seconds"], 3), queue=name)
+    return stats
+
+
+def supervise(mode: str = None, min_procs: int = None, max_procs: int = None,
+              batch_size: int = None, max_wait_ms: int = None):
+    """Run the worker pool until SIGTERM / SIGINT, resizing it every Config.WORKER_SCALE_INTERVAL seconds."""
+    mode = mode or Config.WORKER_MODE
+    pool = WorkerPool(mode, min_procs, max_procs, batch_size, max_wait_ms)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    start_metrics_server(Config.WORKER_METRICS_PORT, Config.METRICS_HOST)
+    # One maintenance scheduler per host instead of one per worker process
+    worker.start_maintenance_thread(mode)
+    logger.info(f"Supervising {pool.min_procs}-{pool.max_procs} {mode} workers.")
+    try:
+        while not stop.is_set():
+            pool.resize(read_queue_stats(mode))
+            stop.wait(Config.WORKER_SCALE_INTERVAL)
+    finally:
+        logger.info("Shutting down the worker pool...")
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run an autoscaling pool of Knowledge Hub workers")
+    parser.add_argument("--batch", action="store_true", help="Pool of batching workers (see worker.py --batch)")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Pool of async batching workers")
+    parser.add_argument("--min", dest="min_procs", type=int, default=None, help="Default: WORKER_MIN_PROCESSES")
+    parser.add_argument("--max", dest="max_procs", type=int, default=None, help="Default: WORKER_MAX_PROCESSES")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--max-wait-ms", type=int, default=None)
+    parser.add_argument("--status", action="store_true", help="Print the depth and oldest job age of each queue, then exit")
+    args = parser.parse_args()
+    mode = "async" if args.use_async else "batch" if args.batch else Config.WORKER_MODE
+
+    if args.status:
+        print(json.dumps(worker.queue_stats(mode), indent=2))
+    else:
+        supervise(mode, args.min_procs, args.max_procs, args.batch_size, args.max_wait_ms)
@@ -0,0 +1,73 @@
+import os
+
+# No provider keys: nothing in the tests may reach a real AI provider
+for key in ("OPENAI_API_KEY", "GOOGLE_API_KEY", "ANTHROPIC_API_KEY"):
+    os.environ[key] = ""
+
+import fakeredis
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import StaticPool
+
+import database
+import models  # noqa: F401  (registers the tables on Base)
+from services import vector_index, keyword_index, result_cache, embedding_cache, rate_limiter, ai_service
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    """A fresh in-memory SQLite database shared by every thread, in place of MySQL."""
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    database.Base.metadata.create_all(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "SessionLocal", session_factory)
+    monkeypatch.setattr(database, "db_session", scoped_session(session_factory))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    session = database.SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """(text client, binary client) of one in-process fake Redis server."""
+    server = fakeredis.FakeServer()
+    text = fakeredis.FakeRedis(server=server, decode_responses=True)
+    binary = fakeredis.FakeRedis(server=server)
+    monkeypatch.setattr(database, "redis_client", text)
+    monkeypatch.setattr(database, "redis_binary_client", binary)
+    monkeypatch.setattr(result_cache, "_cache", result_cache.ResultCache(binary))
+    monkeypatch.setattr(embedding_cache, "_cache", None)
+    monkeypatch.setattr(rate_limiter, "_limiter", None)
+    return text, binary
+
+
+@pytest.fixture(autouse=True)
+def fresh_indexes(monkeypatch):
+    """Process-wide search indexes and caches start empty in every test."""
+    monkeypatch.setattr(vector_index, "_index", None)
+    monkeypatch.setattr(vector_index, "_passages", vector_index.PassageIndex())
+    monkeypatch.setattr(keyword_index, "_index", keyword_index.KeywordIndex())
+    monkeypatch.setattr(result_cache, "_cache", result_cache.ResultCache(None))
+    monkeypatch.setattr(ai_service, "_services", {})
+    monkeypatch.setattr(ai_service, "_space_services", {})
+    monkeypatch.setattr(ai_service, "_embedding_down_until", 0.0)
+
+
+@pytest.fixture
+def fake_ai(db):
+    """An offline FakeAIService whose embedding space is the active one."""
+    from models import EmbeddingSpace
+    from services.fake_ai import FakeAIService
+
+    service = FakeAIService(dim=16)
+    db.add(EmbeddingSpace(name=service.embedding_space, dim=16, status="active"))
+    db.commit()
+    return service
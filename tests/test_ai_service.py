@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from config import Config
+from services.ai_service import AIService, AIProviderError
+from services.local_embedder import HashingEmbedder, PARALLEL_MIN_TEXTS
+
+
+def test_no_embedding_api_raises_instead_of_random_vectors():
+    service = AIService(provider="openai")
+    assert service.embedding_model == "mock"
+
+    with pytest.raises(AIProviderError):
+        service.generate_embedding("some text")
+    assert service.generate_embeddings(["a", "b"]) == [None, None]
+    assert service.embed_notes(["a"]) == [None]
+    assert service.generate_query_embedding("query") is None
+    assert not service.embedding_available()
+
+
+def test_local_featurizing_in_spawned_processes_matches_in_process(monkeypatch):
+    monkeypatch.setattr(Config, "LOCAL_EMBED_WORKERS", 2)
+    texts = [f"note number {i} about topic {i % 7}" for i in range(PARALLEL_MIN_TEXTS)]
+    embedder = HashingEmbedder(64)
+    try:
+        parallel = embedder.embed(texts)
+        assert embedder._pool._mp_context.get_start_method() == "spawn"
+    finally:
+        embedder.close()
+    assert embedder._pool is None
+
+    monkeypatch.setattr(Config, "LOCAL_EMBED_WORKERS", 1)
+    assert np.allclose(parallel, embedder.embed(texts))
+
+
+def test_claude_embeds_into_the_local_embedders_space():
+    claude, local = AIService(provider="claude"), AIService(provider="local")
+    assert claude.embedding_space == local.embedding_space == "local:hash-256"
+    assert claude.for_space("local:hash-256") is claude
+    # An older local model keeps Claude for classification
+    other = claude.for_space("local:hash-64")
+    assert (other.provider, other.embedding_space) == ("claude", "local:hash-64")
+    assert local.for_space("local:hash-64").provider == "local"
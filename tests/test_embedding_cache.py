@@ -0,0 +1,29 @@
+from services.embedding_cache import EmbeddingCache, STATS_KEY
+
+
+def test_hits_are_counted_in_process_and_flushed_in_batches(redis):
+    binary = redis[1]
+    cache = EmbeddingCache(binary, stats_flush=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return [1.0, 0.0]
+
+    for _ in range(5):
+        assert list(cache.get_or_compute("openai", "m", "query", compute)) == [1.0, 0.0]
+    assert len(calls) == 1
+    assert cache.stats["local_hits"] == 4
+    # Nothing written per hit
+    assert not binary.exists(STATS_KEY)
+
+    # Another process finds the vector in Redis
+    other = EmbeddingCache(binary, stats_flush=0)
+    other.get_or_compute("openai", "m", "query", compute)
+    assert int(binary.hget(STATS_KEY, "redis_hits")) == 1
+
+    report = cache.report()
+    assert report["local_hits"] == 4 and report["redis_hits"] == 1 and report["misses"] == 1
+    assert report["hit_rate"] == 5 / 6
+    cache.flush()
+    assert int(binary.hget(STATS_KEY, "local_hits")) == 4
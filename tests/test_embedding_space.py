@@ -0,0 +1,57 @@
+from config import Config
+from models import EmbeddingSpace, KnowledgeNote
+from services.embedding_space import get_active_space, register_space, switch_space, missing_note_ids, prune_spaces
+from services.note_service import NoteService
+
+
+def enriched_note(service: NoteService, content: str, provider: str, model: str, embedding: list):
+    note = service.create_note(content)
+    service.save_ai_results([{
+        "note_id": note.id, "category": "Work", "tags": [], "embedding": embedding,
+        "embedding_model": model, "ai_provider": provider
+    }])
+    return note.id
+
+
+def test_mock_space_is_never_made_active(db, monkeypatch):
+    monkeypatch.setattr(Config, "AI_PROVIDER", "openai")
+
+    assert get_active_space(db) is None
+    assert db.query(EmbeddingSpace).count() == 0
+
+
+def test_first_real_space_replaces_a_recorded_mock_space(db, monkeypatch):
+    db.add(EmbeddingSpace(name="openai:mock", status="active"))
+    db.commit()
+    monkeypatch.setattr(Config, "AI_PROVIDER", "openai")
+    assert get_active_space(db) is None
+
+    monkeypatch.setattr(Config, "AI_PROVIDER", "local")
+    assert get_active_space(db) == "local:hash-256"
+    assert db.get(EmbeddingSpace, "openai:mock").status == "retired"
+    # Recorded: a later provider change doesn't move it
+    monkeypatch.setattr(Config, "AI_PROVIDER", "openai")
+    assert get_active_space(db) == "local:hash-256"
+
+
+def test_switch_space_promotes_backfilled_vectors(db, fake_ai):
+    service = NoteService(db)
+    old = fake_ai.embedding_space
+    backfilled = enriched_note(service, "backfilled note", "fake", "fake-16", [1.0] * 16)
+    straggler = enriched_note(service, "created during the backfill", "fake", "fake-16", [0.5] * 16)
+    register_space(db, "other:model-4", dim=4)
+    assert missing_note_ids(db, "other:model-4") == [backfilled, straggler]
+    service.save_space_embeddings("other:model-4", [{"note_id": backfilled, "embedding": [0.0, 1.0, 0.0, 0.0], "passages": []}])
+    assert missing_note_ids(db, "other:model-4") == [straggler]
+
+    assert switch_space(db, "other:model-4") == [straggler]
+
+    db.expire_all()
+    assert get_active_space(db) == "other:model-4"
+    assert db.get(EmbeddingSpace, old).status == "retired"
+    note = db.get(KnowledgeNote, backfilled)
+    assert (note.ai_provider, note.embedding_model, note.embedding_dim) == ("other", "model-4", 4)
+    assert list(note.embedding) == [0.0, 1.0, 0.0, 0.0]
+    assert db.get(KnowledgeNote, straggler).embedding_model == "fake-16"
+    # The promoted copy is redundant now
+    assert prune_spaces(db) == 1
@@ -0,0 +1,179 @@
+import numpy as np
+import pytest
+
+from services.quantized_index import QuantizedIndex, evaluate_quantized_recall
+from services.vector_index import VectorIndex
+
+
+def random_vectors(count, dim=32, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(1, count + 1), rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def test_vector_index_search_upsert_and_delete():
+    ids, vectors = random_vectors(200)
+    index = VectorIndex(capacity=8)
+    index.upsert_many(zip(ids.tolist(), vectors))
+    assert len(index) == 200
+
+    brute = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = vectors[5]
+    expected = ids[np.argsort(-(brute @ (query / np.linalg.norm(query))))][:5].tolist()
+    assert [note_id for note_id, _ in index.search(query, top_k=5)] == expected
+    assert index.search(query, top_k=3, allowed_ids=[7, 8, 6])[0][0] == 6
+
+    index.remove([6, 200])
+    assert 6 not in index and len(index) == 198
+    assert index.search(query, top_k=1)[0][0] != 6
+    index.upsert(7, vectors[5])
+    assert index.search(query, top_k=1) == [(7, pytest.approx(1.0, abs=1e-5))]
+    # Other dimensions and empty vectors are dropped rather than mixed in
+    assert not index.upsert(8, [1.0, 0.0])
+    assert not index.upsert(9, [])
+    assert 8 not in index and 9 not in index
+    assert index.search([]) == [] and index.search([1.0, 0.0]) == []
+
+
+def test_semantic_search_pools_note_and_passage_vectors(db, fake_ai):
+    from services.note_service import NoteService
+
+    service = NoteService(db)
+    service.ensure_search_index()
+    short = service.create_note("apples and pears").id
+    long = service.create_note("a long note").id
+    service.save_ai_results([
+        {"note_id": short, "category": "Ideas", "tags": [], "embedding": fake_ai._vector("apples and pears"),
+         "embedding_model": fake_ai.embedding_model, "ai_provider": fake_ai.provider},
+        {"note_id": long, "category": "Ideas", "tags": [], "embedding": fake_ai._vector("unrelated words"),
+         "embedding_model": fake_ai.embedding_model, "ai_provider": fake_ai.provider,
+         "passages": [{"position": 0, "start": 0, "content": "bananas", "embedding": fake_ai._vector("bananas")},
+                      {"position": 1, "start": 7, "content": "cherries", "embedding": fake_ai._vector("cherries")}]},
+    ])
+
+    passages = {}
+    results = fake_ai.search_note_ids("cherries", mode="semantic", passages=passages)
+    assert results[0] == (long, pytest.approx(1.0, abs=1e-5))
+    assert long in passages and short not in passages
+    assert fake_ai.search_note_ids("apples and pears", mode="semantic")[0][0] == short
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_quantized_search_matches_exact_after_rerank(mode):
+    ids, vectors = random_vectors(500)
+    exact, quantized = VectorIndex(), QuantizedIndex(mode)
+    exact.upsert_many(zip(ids.tolist(), vectors))
+    quantized.upsert_many(zip(ids.tolist(), vectors))
+
+    for query in vectors[:20]:
+        expected = exact.search(query, top_k=5)
+        found = quantized.search(query, top_k=5)
+        assert found[0][0] == expected[0][0]
+        # Re-ranked scores are the exact cosine similarities
+        exact_scores = dict(exact.search(query, top_k=500))
+        for note_id, score in found:
+            assert score == pytest.approx(exact_scores[note_id], abs=1e-5)
+
+
+@pytest.mark.parametrize("mode", ["int8", "binary"])
+def test_quantized_upsert_and_delete_keep_rows_aligned(mode):
+    ids, vectors = random_vectors(300)
+    index = QuantizedIndex(mode, capacity=16)  # grows several times
+    index.upsert_many(zip(ids.tolist(), vectors))
+    index.remove(ids[:100].tolist())
+    index.upsert(ids[-1], vectors[0])
+
+    assert len(index) == 200 and 1 not in index
+    # The row swapped into each hole still finds its own vector
+    for note_id in (150, 299):
+        assert index.search(vectors[note_id - 1], top_k=1)[0][0] == note_id
+    top = index.search(vectors[0], top_k=1)[0]
+    assert top[0] == 300 and top[1] == pytest.approx(1.0, abs=1e-5)
+    assert index.search(vectors[120], top_k=3, allowed_ids=[121, 5, 250])[0][0] == 121
+
+    index.clear()
+    assert index.search(vectors[0]) == []
+
+
+def test_quantized_recall_report():
+    ids, vectors = random_vectors(400)
+    report = evaluate_quantized_recall(ids, vectors, top_k=5, sample=20)
+    for mode in ("int8", "binary"):
+        assert report[mode]["reranked"]["recall"] >= report[mode]["codes_only"]["recall"]
+    assert report["int8"]["reranked"]["recall"] >= 0.9
+
+
+def ann_index(tmp_path, monkeypatch, count=400):
+    from config import Config
+    from services.ann_index import AnnIndex, write_segment
+
+    monkeypatch.setattr(Config, "ANN_COMPACT_MIN_CHANGES", 10 ** 9)  # compact only when the test says so
+    ids, vectors = random_vectors(count)
+    write_segment(str(tmp_path), ids, vectors, nlist=8)
+    index = AnnIndex(str(tmp_path), nprobe=8)
+    assert index.open()
+    index.loaded = True  # as load() leaves it once synced with the database
+    return index, ids, vectors
+
+
+def test_ann_search_upsert_and_delete(tmp_path, monkeypatch):
+    index, ids, vectors = ann_index(tmp_path, monkeypatch)
+    assert len(index) == 400
+    assert index.search(vectors[10], top_k=1)[0][0] == 11
+
+    index.remove([11])
+    assert 11 not in index and all(note_id != 11 for note_id, _ in index.search(vectors[10], top_k=5))
+    index.upsert(12, vectors[10])  # re-embedded: the delta shadows the base copy
+    assert index.search(vectors[10], top_k=1)[0][0] == 12
+    index.upsert(1000, vectors[20])
+    assert {note_id for note_id, _ in index.search(vectors[20], top_k=2)} == {21, 1000}
+    assert index.search(vectors[20], top_k=5, allowed_ids=[1000, 3])[0][0] == 1000
+    assert len(index) == 400
+
+    index.compact()
+    assert index.pending_changes() == 0
+    assert 11 not in index and index.search(vectors[10], top_k=1)[0][0] == 12
+    assert {note_id for note_id, _ in index.search(vectors[20], top_k=2)} == {21, 1000}
+
+
+def test_ann_index_that_was_never_loaded_does_not_compact(tmp_path, monkeypatch):
+    import json
+    from config import Config
+    from services.ann_index import AnnIndex
+
+    ann_index(tmp_path, monkeypatch)
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    monkeypatch.setattr(Config, "ANN_COMPACT_MIN_CHANGES", 1)
+    other = AnnIndex(str(tmp_path))  # e.g. the import CLI: saves notes, never searches
+    other.upsert(1000, random_vectors(1)[1][0])
+
+    assert not other.maybe_compact() and other.compact() is None
+    assert json.loads((tmp_path / "manifest.json").read_text()) == manifest
+
+
+def test_ann_compaction_keeps_changes_made_while_it_writes(tmp_path, monkeypatch):
+    from services import ann_index as module
+
+    index, ids, vectors = ann_index(tmp_path, monkeypatch)
+    index.remove([1])
+    index.upsert(2, vectors[0])
+    real_write = module.write_segment
+
+    def write_while_notes_change(*args, **kwargs):
+        # Another thread purges and re-embeds notes after the snapshot was taken
+        index.remove([3, 1000])
+        index.upsert(4, vectors[50])
+        index.upsert(1000, vectors[60])
+        index.remove([1000])
+        index.upsert(1001, vectors[70])
+        return real_write(*args, **kwargs)
+
+    monkeypatch.setattr(module, "write_segment", write_while_notes_change)
+    index.compact()
+
+    assert 1 not in index and 3 not in index and 1000 not in index
+    assert all(note_id not in (1, 3) for note_id, _ in index.search(vectors[2], top_k=400))
+    assert index.search(vectors[50], top_k=1)[0][0] in (4, 51)
+    assert dict(index.search(vectors[50], top_k=2))[4] == pytest.approx(1.0, abs=1e-5)
+    assert index.search(vectors[70], top_k=2)[0][1] == pytest.approx(1.0, abs=1e-5)
+    # Only the post-snapshot changes are left: tombstones of 3 and 4, delta 4 and 1001
+    assert index.pending_changes() == 4
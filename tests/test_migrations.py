@@ -0,0 +1,122 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import sessionmaker
+
+import migrate_db
+from config import Config
+from database import Base
+from models import EmbeddingSpace, KnowledgeNote, NoteChunk, NoteEmbedding, NoteTag, encode_vector
+
+# knowledge_notes as the first release created it
+ORIGINAL_SCHEMA = """
+CREATE TABLE knowledge_notes (
+    id INTEGER PRIMARY KEY, content TEXT NOT NULL, category VARCHAR(50), tags JSON, embedding JSON,
+    status VARCHAR(20) DEFAULT 'pending', created_at DATETIME, updated_at DATETIME,
+    is_deleted BOOLEAN DEFAULT 0, deleted_at DATETIME
+)
+"""
+
+
+@pytest.fixture
+def database_url(tmp_path, monkeypatch):
+    url = f"sqlite:///{tmp_path / 'notes.db'}"
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URL", url)
+    engine = create_engine(url)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def original_db(database_url):
+    with database_url.begin() as conn:
+        conn.execute(text(ORIGINAL_SCHEMA))
+        conn.execute(text(
+            "INSERT INTO knowledge_notes (id, content, category, tags, embedding, status, created_at, is_deleted) "
+            "VALUES (1, 'an old note', 'Work', :tags, :embedding, 'completed', '2024-01-01 00:00:00', 0)"
+        ), {"tags": json.dumps(["old", "note"]), "embedding": json.dumps([0.6, 0.8])})
+    return database_url
+
+
+def convert_embeddings(engine):
+    """What migrate_embeddings.py does (its ALTERs are MySQL-only)."""
+    with engine.begin() as conn:
+        for ddl in ("embedding_vec BLOB", "embedding_model VARCHAR(100)", "embedding_dim INT"):
+            conn.execute(text(f"ALTER TABLE knowledge_notes ADD COLUMN {ddl}"))
+        conn.execute(text("UPDATE knowledge_notes SET embedding_vec = :vec, embedding_dim = 2"),
+                     {"vec": encode_vector([0.6, 0.8])})
+
+
+def test_fresh_database(database_url):
+    Base.metadata.create_all(database_url)
+    migrate_db.migrate_all()
+    migrate_db.migrate_all()
+
+    assert set(Base.metadata.tables) <= set(inspect(database_url).get_table_names())
+    with database_url.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM embedding_spaces")).scalar() == 0
+
+
+def test_existing_database_before_the_vector_migration(original_db):
+    migrate_db.migrate_all()
+
+    columns = {column["name"] for column in inspect(original_db).get_columns("knowledge_notes")}
+    assert {"content_hash", "ai_provider", "claim_token"} <= columns
+    assert "note_neighbors" in inspect(original_db).get_table_names()
+    indexes = {index["name"] for index in inspect(original_db).get_indexes("knowledge_notes")}
+    assert {"ix_notes_listing", "ix_knowledge_notes_updated_at"} <= indexes
+    with original_db.connect() as conn:
+        assert conn.execute(text("SELECT content_hash FROM knowledge_notes")).scalar()
+        assert conn.execute(text("SELECT COUNT(*) FROM note_tags")).scalar() == 2
+        # Nothing to tag until migrate_embeddings.py has run
+        assert conn.execute(text("SELECT COUNT(*) FROM embedding_spaces")).scalar() == 0
+
+
+def test_existing_vectors_go_to_an_explicit_legacy_space(original_db):
+    convert_embeddings(original_db)
+    migrate_db.migrate_all()
+
+    db = sessionmaker(bind=original_db)()
+    note = db.get(KnowledgeNote, 1)
+    assert (note.ai_provider, note.embedding_model) == ("legacy", "unknown")
+    assert list(note.embedding) == pytest.approx([0.6, 0.8])
+    legacy = db.get(EmbeddingSpace, migrate_db.LEGACY_SPACE)
+    assert (legacy.status, legacy.dim) == ("retired", 2)
+    assert {tag for tag, in db.query(NoteTag.tag)} == {"old", "note"}
+    db.close()
+
+    # Naming the model later re-tags them and makes that space the searched one
+    migrate_db.migrate_all(legacy_space="openai:text-embedding-3-small")
+    db = sessionmaker(bind=original_db)()
+    note = db.get(KnowledgeNote, 1)
+    assert (note.ai_provider, note.embedding_model) == ("openai", "text-embedding-3-small")
+    assert db.get(EmbeddingSpace, "openai:text-embedding-3-small").status == "active"
+    db.close()
+
+
+def test_claude_vectors_move_to_the_local_embedders_space(database_url):
+    Base.metadata.create_all(database_url)
+    db = sessionmaker(bind=database_url)()
+    db.add_all([
+        KnowledgeNote(id=1, content="a", ai_provider="claude", embedding_model="hash-256", embedding=[1.0, 0.0]),
+        KnowledgeNote(id=2, content="b", ai_provider="claude", embedding_model="hash-256", embedding=[0.0, 1.0]),
+        EmbeddingSpace(name="claude:hash-256", dim=2, status="active"),
+        EmbeddingSpace(name="local:hash-256", dim=2, status="retired"),
+        NoteChunk(note_id=1, position=0, start=0, content="a", embedding=[1.0, 0.0], space="claude:hash-256"),
+        NoteChunk(note_id=1, position=0, start=0, content="a", embedding=[1.0, 0.0], space="local:hash-256"),
+        NoteChunk(note_id=2, position=0, start=0, content="b", embedding=[0.0, 1.0], space="claude:hash-256"),
+        NoteEmbedding(note_id=1, space="claude:lsa-2-abc", embedding=[1.0, 0.0]),
+    ])
+    db.commit()
+    db.close()
+
+    migrate_db.migrate_all()
+    migrate_db.migrate_all()
+
+    db = sessionmaker(bind=database_url)()
+    assert {note.ai_provider for note in db.query(KnowledgeNote)} == {"local"}
+    assert {(s.name, s.status) for s in db.query(EmbeddingSpace)} == {("local:hash-256", "active")}
+    assert sorted((c.note_id, c.space) for c in db.query(NoteChunk)) == [(1, "local:hash-256"), (2, "local:hash-256")]
+    assert [e.space for e in db.query(NoteEmbedding)] == ["local:lsa-2-abc"]
+    db.close()
@@ -0,0 +1,52 @@
+import copy
+
+from models import KnowledgeNote, NoteTag
+from services.note_service import NoteService
+
+
+def test_bulk_create_returns_ids_in_input_order_without_touching_records(db):
+    service = NoteService(db)
+    service.create_note("already here")
+    records = [{"content": "first", "tags": ["a", "b"]}, {"content": "already here"},
+               {"content": "second"}, {"content": "first"}]
+    original = copy.deepcopy(records)
+
+    ids = service.bulk_create_notes(records)
+
+    assert records == original
+    assert [db.get(KnowledgeNote, note_id).content for note_id in ids] == ["first", "second"]
+    assert {tag for tag, in db.query(NoteTag.tag).filter(NoteTag.note_id == ids[0])} == {"a", "b"}
+    assert db.query(KnowledgeNote).filter(KnowledgeNote.claim_token.isnot(None)).count() == 0
+
+
+def test_bulk_create_only_returns_rows_of_its_own_batch(db):
+    service = NoteService(db)
+    first = service.bulk_create_notes([{"content": "same text"}], skip_existing=False)
+    second = service.bulk_create_notes([{"content": "same text"}, {"content": "other"}], skip_existing=False)
+
+    assert len(first) == 1 and len(second) == 2
+    assert not set(first) & set(second)
+    assert service.bulk_create_notes([{"content": "same text"}]) == []
+
+
+def test_only_loaded_indexes_take_upserts(db, fake_ai):
+    service = NoteService(db)
+
+    def enrich(content):
+        note = service.create_note(content)
+        service.save_ai_results([{
+            "note_id": note.id, "category": "Work", "tags": ["t"], "embedding": [1.0] * 16,
+            "embedding_model": "fake-16", "ai_provider": "fake",
+            "passages": [{"position": 0, "start": 0, "content": content, "embedding": [1.0] * 16}]
+        }])
+        return note.id
+
+    # A process that never searches (the import CLI, a worker) keeps no copy of the corpus
+    first = enrich("saved before any search")
+    assert not len(service.index) and not len(service.passage_index) and not len(service.keyword_index)
+
+    service.ensure_search_index()
+    second = enrich("saved after the first search")
+    assert first in service.index and second in service.index
+    assert first in service.keyword_index and second in service.keyword_index
+    assert len(service.passage_index) == 2
@@ -0,0 +1,123 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import rate_limiter
+from services.rate_limiter import RateLimiter, call_with_retry, acall_with_retry, estimate_tokens
+
+
+class RateLimitError(Exception):
+    """Named like the provider SDK errors is_retryable recognises."""
+
+    def __init__(self, retry_after: str = None):
+        super().__init__("rate limited")
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+class BrokenRedis:
+    def register_script(self, script):
+        def run(keys, args):
+            raise ConnectionError("redis is down")
+        return run
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Seconds slept by the limiter and the retry loop, without sleeping."""
+    slept = []
+
+    async def asleep(seconds):
+        slept.append(seconds)
+
+    monkeypatch.setattr(rate_limiter.time, "sleep", slept.append)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", asleep)
+    return slept
+
+
+def test_request_budget_is_shared_by_every_limiter(redis):
+    limits = {"openai:gpt": {"rpm": 2}}
+    first, second = RateLimiter(redis[0], limits), RateLimiter(redis[0], limits)
+
+    assert first.try_acquire("openai", "gpt") == 0
+    assert second.try_acquire("openai", "gpt") == 0
+    # The third request of the minute waits for the bucket to refill (30s per request)
+    assert 29 < first.try_acquire("openai", "gpt") <= 30
+    # Models without an entry are not limited
+    assert first.try_acquire("openai", "other") == 0
+
+
+def test_token_budget_and_block(redis):
+    limiter = RateLimiter(redis[0], {"openai:gpt": {"tpm": 600}})
+
+    assert limiter.try_acquire("openai", "gpt", tokens=500) == 0
+    assert 19 < limiter.try_acquire("openai", "gpt", tokens=300) <= 20
+    # Bigger than the whole budget: capped, so it can still go through eventually
+    assert limiter.try_acquire("openai", "gpt", tokens=10_000) <= 50
+
+    limiter.block("openai", "other", 0)
+    limiter.block("openai", "gpt", 120)
+    assert 119 < limiter.try_acquire("openai", "gpt", tokens=1) <= 120
+
+
+def test_limiter_fails_open_without_redis():
+    limits = {"openai:gpt": {"rpm": 1}}
+    for limiter in (RateLimiter(None, limits), RateLimiter(BrokenRedis(), limits)):
+        assert limiter.try_acquire("openai", "gpt") == 0
+        assert limiter.try_acquire("openai", "gpt") == 0
+        limiter.block("openai", "gpt", 10)
+
+
+def test_call_with_retry_retries_transient_errors(redis, sleeps):
+    limiter = RateLimiter(redis[0], {})
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RateLimitError(retry_after="2" if len(calls) == 1 else None)
+        return "ok"
+
+    assert call_with_retry(flaky, "openai", "gpt", limiter=limiter, max_retries=3) == "ok"
+    assert len(calls) == 3
+    # Retry-After is honoured as sent, and pauses the model for every process
+    assert sleeps[0] == 2.0
+    assert redis[0].hget("ratelimit:openai:gpt", "blocked") is not None
+
+
+def test_call_with_retry_gives_up(redis, sleeps):
+    limiter = RateLimiter(redis[0], {})
+
+    def always_limited():
+        raise RateLimitError()
+
+    def broken():
+        raise ValueError("bad request")
+
+    with pytest.raises(RateLimitError):
+        call_with_retry(always_limited, "openai", "gpt", limiter=limiter, max_retries=2)
+    assert len(sleeps) == 2
+    with pytest.raises(ValueError):
+        call_with_retry(broken, "openai", "gpt", limiter=limiter, max_retries=2)
+    assert len(sleeps) == 2
+
+
+def test_async_calls_wait_for_the_shared_budget(redis, sleeps, monkeypatch):
+    limiter = RateLimiter(redis[0], {"openai:gpt": {"rpm": 1}})
+    waits = iter([0.0, 3.0, 0.0])
+    monkeypatch.setattr(limiter, "try_acquire", lambda provider, model, tokens=1: next(waits))
+
+    async def call():
+        return "ok"
+
+    async def both():
+        return [await acall_with_retry(call, "openai", "gpt", limiter=limiter) for _ in range(2)]
+
+    assert asyncio.run(both()) == ["ok", "ok"]
+    assert sleeps == [3.0]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("x" * 40) == 10
+    assert estimate_tokens(["x" * 20, "y" * 20]) == 10
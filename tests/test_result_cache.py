@@ -0,0 +1,76 @@
+import pytest
+
+from services.metrics import NOTE_SERVICE_SECONDS, RESULT_CACHE_SECONDS
+from services.note_service import NoteService
+from services.result_cache import get_result_cache
+
+
+def observations(histogram, *labels):
+    series = histogram._series.get(tuple(labels))
+    return series[-1] if series else 0
+
+
+def page_ids(service):
+    rows, _ = service.get_active_notes_page()
+    return [row.id for row in rows]
+
+
+@pytest.fixture
+def service(db, redis, fake_ai):
+    return NoteService(db)
+
+
+def test_listing_writes_bump_the_version_and_drop_cached_pages(db, service):
+    cache = get_result_cache()
+    first = service.create_note("first note")
+    assert page_ids(service) == [first.id]
+
+    version = cache.version()
+    second = service.create_note("second note")
+    assert cache.version() == version + 1
+    assert page_ids(service) == [second.id, first.id]
+
+    version = cache.version()
+    service.soft_delete_notes([first.id])
+    assert cache.version() == version + 1
+    assert page_ids(service) == [second.id]
+
+    version = cache.version()
+    service.save_ai_results([{
+        "note_id": second.id, "category": "Work", "tags": ["cache"], "embedding": [1.0] * 16,
+        "embedding_model": "fake-16", "ai_provider": "fake"
+    }])
+    assert cache.version() == version + 1
+    rows, _ = service.get_active_notes_page()
+    assert (rows[0].category, rows[0].status) == ("Work", "completed")
+
+
+def test_status_changes_keep_the_cache_but_show_the_current_status(db, service):
+    cache = get_result_cache()
+    note = service.create_note("a note")
+    service.get_active_notes_page()
+    version = cache.version()
+
+    assert [row.id for row in service.claim_notes([note.id])] == [note.id]
+    assert cache.version() == version
+    rows, _ = service.get_active_notes_page()
+    assert rows[0].status == "processing"
+    assert service.get_note_summaries([note.id])[0].status == "processing"
+
+    service.set_notes_status([note.id], "failed")
+    assert cache.version() == version
+    rows, _ = service.get_active_notes_page()
+    assert rows[0].status == "failed"
+    assert cache.stats["misses"] == 2  # the page and the summaries, once each
+
+
+def test_cache_hits_are_timed_apart_from_note_service_calls(db, service):
+    service.create_note("a note")
+    calls = observations(NOTE_SERVICE_SECONDS, "_active_notes_page")
+    hits = observations(RESULT_CACHE_SECONDS, "_active_notes_page", "local_hit")
+
+    service.get_active_notes_page()
+    service.get_active_notes_page()
+
+    assert observations(NOTE_SERVICE_SECONDS, "_active_notes_page") == calls + 1
+    assert observations(RESULT_CACHE_SECONDS, "_active_notes_page", "local_hit") == hits + 1
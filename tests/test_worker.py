@@ -0,0 +1,147 @@
+import pytest
+from rq import Queue, Retry, SimpleWorker
+
+import worker
+from config import Config
+from models import KnowledgeNote
+from services.ai_service import AIProviderError
+from services.fake_ai import FakeAIService
+from services.note_service import NoteService
+
+
+class FlakyAI(FakeAIService):
+    """FakeAIService whose first `failures` classifications raise AIProviderError."""
+
+    def __init__(self, failures: int):
+        super().__init__(dim=16)
+        self.failures = failures
+        self.calls = 0
+
+    def _fail(self):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise AIProviderError("provider unavailable")
+
+    def classify_and_tag(self, text: str):
+        self._fail()
+        return super().classify_and_tag(text)
+
+    async def aclassify_and_tag(self, text: str):
+        self._fail()
+        return await super().aclassify_and_tag(text)
+
+
+@pytest.fixture
+def setup(db, redis, fake_ai, monkeypatch):
+    """Point the worker at the fake Redis and return a function installing an AI service."""
+    text, binary = redis
+    monkeypatch.setattr(worker, "redis_client", text)
+    monkeypatch.setattr(worker, "redis_binary_client", binary)
+
+    def use(ai):
+        monkeypatch.setattr(worker, "get_ai_service", lambda provider=None: ai)
+        return ai
+    return use
+
+
+def statuses(db, note_ids):
+    db.expire_all()
+    rows = db.query(KnowledgeNote.id, KnowledgeNote.status).filter(KnowledgeNote.id.in_(note_ids))
+    return {note_id: status for note_id, status in rows}
+
+
+def run_rq(binary):
+    SimpleWorker([Queue(worker.BULK_QUEUE, connection=binary)], connection=binary).work(burst=True)
+
+
+def test_rq_mode_retries_failed_notes_through_the_job(db, redis, setup, monkeypatch):
+    monkeypatch.setattr(Config, "WORKER_MODE", "rq")
+    monkeypatch.setattr(worker, "job_retry", lambda: Retry(max=2))
+    ai = setup(FlakyAI(failures=1))
+    ids = NoteService(db).bulk_create_notes([{"content": "first note"}, {"content": "second note"}])
+
+    worker.enqueue_enrichment(ids)
+    run_rq(redis[1])
+
+    assert statuses(db, ids) == {note_id: "completed" for note_id in ids}
+    # One failed call, the other note on the first run, the retried note on the second
+    assert ai.calls == 3
+    assert not redis[0].zcard(worker.BATCH_DELAYED_KEY)
+
+
+def test_rq_mode_fails_notes_once_retries_are_used_up(db, redis, setup, monkeypatch):
+    monkeypatch.setattr(Config, "WORKER_MODE", "rq")
+    monkeypatch.setattr(worker, "job_retry", lambda: Retry(max=1))
+    ai = setup(FlakyAI(failures=100))
+    ids = NoteService(db).bulk_create_notes([{"content": "only note"}])
+
+    worker.enqueue_enrichment(ids)
+    run_rq(redis[1])
+
+    assert statuses(db, ids) == {ids[0]: "failed"}
+    assert ai.calls == 2
+
+
+def test_rq_single_note_job_retries(db, redis, setup):
+    setup(FlakyAI(failures=1))
+    note = NoteService(db).create_note("a single note")
+
+    Queue(worker.BULK_QUEUE, connection=redis[1]).enqueue(worker.process_note_ai, note.id, retry=Retry(max=1))
+    run_rq(redis[1])
+
+    assert statuses(db, [note.id]) == {note.id: "completed"}
+
+
+@pytest.mark.parametrize("mode", ["batch", "async"])
+def test_batching_modes_requeue_through_the_delayed_set(db, redis, setup, monkeypatch, mode):
+    text = redis[0]
+    monkeypatch.setattr(Config, "WORKER_MODE", mode)
+    ai = setup(FlakyAI(failures=1))
+    ids = NoteService(db).bulk_create_notes([{"content": "retry me"}])
+
+    worker.process_note_batch(ids, concurrent=mode == "async")
+    assert statuses(db, ids) == {ids[0]: "pending"}
+    assert text.zscore(worker.BATCH_DELAYED_KEY, ids[0]) is not None
+    assert text.hget(worker.BATCH_ATTEMPTS_KEY, ids[0]) == "1"
+
+    # Backoff over: the note goes back on the queue and the next batch completes it
+    text.zadd(worker.BATCH_DELAYED_KEY, {ids[0]: 0})
+    worker.promote_delayed_notes()
+    assert text.lrange(worker.BATCH_PENDING_KEY, 0, -1) == [str(ids[0])]
+    worker.process_note_batch(ids, concurrent=mode == "async")
+    assert statuses(db, ids) == {ids[0]: "completed"}
+    assert text.hget(worker.BATCH_ATTEMPTS_KEY, ids[0]) is None
+    assert ai.failures == 0
+
+
+def test_batching_modes_fail_notes_after_the_last_attempt(db, redis, setup, monkeypatch):
+    text = redis[0]
+    monkeypatch.setattr(Config, "WORKER_MODE", "batch")
+    monkeypatch.setattr(Config, "AI_JOB_RETRIES", 1)
+    setup(FlakyAI(failures=100))
+    ids = NoteService(db).bulk_create_notes([{"content": "never works"}])
+
+    worker.process_note_batch(ids)
+    worker.process_note_batch(ids)
+
+    assert statuses(db, ids) == {ids[0]: "failed"}
+    assert text.hget(worker.BATCH_ATTEMPTS_KEY, ids[0]) is None
+
+
+def test_requeue_leaves_notes_this_worker_did_not_claim(db, redis, setup, monkeypatch):
+    text = redis[0]
+    monkeypatch.setattr(Config, "WORKER_MODE", "batch")
+    ai = setup(FakeAIService(dim=16))
+    service = NoteService(db)
+    waiting, done, elsewhere = service.bulk_create_notes([{"content": "waiting"}, {"content": "done"}, {"content": "elsewhere"}])
+    service.set_notes_status([done], "completed")
+    service.claim_notes([elsewhere])  # another worker is on it
+
+    def unavailable(space):
+        raise AIProviderError("embedding provider unavailable")
+    monkeypatch.setattr(ai, "for_space", unavailable)
+    worker.process_note_batch([waiting, done, elsewhere])
+
+    assert statuses(db, [waiting, done, elsewhere]) == {waiting: "pending", done: "completed", elsewhere: "processing"}
+    assert text.zrange(worker.BATCH_DELAYED_KEY, 0, -1) == [str(waiting)]
@@ -1,73 +1,618 @@
 import os
+import time
+import datetime
+import asyncio
+import socket
+import signal
+import argparse
+import threading
 import redis
-from rq import Worker, Queue, Connection
+from rq import SimpleWorker, Queue, Connection, Retry, get_current_job
 from config import Config
-from database import get_db
+from database import get_db, redis_client, redis_binary_client
 from services.note_service import NoteService
-from services.ai_service import AIService
+from services.ai_service import AIService, AIProviderError, get_ai_service
+from services.note_events import publish_status
+from services.related_notes import refresh_related_notes, refresh_due as related_refresh_due
+from services.metrics import (JOB_WAIT_SECONDS, JOB_RUN_SECONDS, PURGED_ROWS, PURGE_BATCH_SECONDS,
+                              start_metrics_server)
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-listen = ['default']
+INTERACTIVE_QUEUE = "interactive"  # notes a user just saved
+BULK_QUEUE = "bulk"  # imports and re-embedding backfills
+MAINTENANCE_QUEUE = "maintenance"  # retention purges
+# Strict priority: a worker only takes a job from a queue when every queue before it is
+# empty. 'default' still drains jobs enqueued before the queues were split.
+listen = [INTERACTIVE_QUEUE, BULK_QUEUE, MAINTENANCE_QUEUE, 'default']
 
-def process_note_ai(note_id: int):
+ENRICHMENT_STATS_KEY = "enrichment:stats"
+BATCH_PENDING_KEY = "enrichment:pending"  # Redis list of note ids for the batching worker (bulk)
+BATCH_INTERACTIVE_KEY = "enrichment:interactive"  # same, for notes a user just saved; drained first
+BATCH_QUEUES = {INTERACTIVE_QUEUE: BATCH_INTERACTIVE_KEY, BULK_QUEUE: BATCH_PENDING_KEY}  # in priority order
+BATCH_DELAYED_KEY = "enrichment:delayed"  # sorted set: note id -> time it may be retried
+BATCH_ATTEMPTS_KEY = "enrichment:attempts"
+BATCH_ENQUEUED_KEY = "enrichment:enqueued_at"  # hash: note id -> time it was queued, for the queue wait metric
+RETENTION_REQUEST_KEY = "retention:requested"  # "expired" or "all": a purge asked for from the app
+RETENTION_LOCK_KEY = "retention:lock"  # held by the worker running a purge
+RETENTION_REPORT_KEY = "retention:last_run"  # hash: stats of the last purge
+RETENTION_QUEUED_KEY = "retention:queued"  # set while a purge job waits on the maintenance queue
+RELATED_LOCK_KEY = "related:lock"  # held by the worker updating the related-notes graph
+RELATED_QUEUED_KEY = "related:queued"  # set while a graph update waits on the maintenance queue
+
+def job_retry():
+    """RQ retry policy for enrichment jobs; intervals need the worker's scheduler."""
+    return Retry(max=Config.AI_JOB_RETRIES, interval=[30, 60, 120, 300, 600])
+
+def observe_job_wait(job_name: str):
+    """Record how long the current RQ job sat in the queue."""
+    job = get_current_job()
+    if job is None or job.enqueued_at is None:
+        return
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if job.enqueued_at.tzinfo is None:
+        now = now.replace(tzinfo=None)  # RQ stores naive UTC
+    JOB_WAIT_SECONDS.observe((now - job.enqueued_at).total_seconds(), job=job_name, queue=job.origin)
+
+def observe_batch_wait(items: list):
+    """
+    Record how long claimed notes sat in the batching queues, and forget their enqueue
+    times. items: [(queue name, note id), ...].
+    """
+    try:
+        now = time.time()
+        note_ids = [note_id for _, note_id in items]
+        for (queue, _), queued_at in zip(items, redis_client.hmget(BATCH_ENQUEUED_KEY, note_ids)):
+            if queued_at is not None:
+                JOB_WAIT_SECONDS.observe(now - float(queued_at), job="batch", queue=queue)
+        redis_client.hdel(BATCH_ENQUEUED_KEY, *note_ids)
+    except Exception as e:
+        logger.warning(f"Could not record queue wait: {e}")
+
+_event_loop = None
+
+def worker_event_loop():
+    """
+    One event loop for the life of the worker, so the async SDK clients (which are
+    bound to the loop that created them) keep their connections between batches.
+    """
+    global _event_loop
+    if _event_loop is None:
+        _event_loop = asyncio.new_event_loop()
+    return _event_loop
+
+def record_enrichment_stat(field: str, amount: int = 1):
+    try:
+        redis_client.hincrby(ENRICHMENT_STATS_KEY, field, amount)
+    except Exception as e:
+        logger.warning(f"Could not record enrichment stat {field}: {e}")
+
+def find_donor(note_service: NoteService, ai_service: AIService, note_id: int, content_hash: str):
+    if ai_service.embedding_model == "mock":
+        return None
+    return note_service.find_enrichment_donor(
+        content_hash, ai_service.embedding_provider, ai_service.embedding_model, exclude_id=note_id
+    )
+
+def enrich_note(note_service: NoteService, ai_service: AIService, note):
+    """
+    Classify and embed a note, or copy the results of a completed note with the
+    same content hash, provider and embedding model, and store them together with
+    the "completed" status in one transaction. Returns True when reused.
+    """
+    # Vectors must land in the active space, whichever provider the caller was set up with
+    ai_service = ai_service.for_space(note_service.active_space())
+    donor = find_donor(note_service, ai_service, note.id, note.content_hash)
+
+    if donor:
+        category, tags, embedding = donor.category, donor.tags, donor.embedding
+        passages = note_service.get_passages(donor.id, ai_service.embedding_space)
+        record_enrichment_stat("dedup_hits")
+    else:
+        ai_data = ai_service.classify_and_tag(note.content)
+        category, tags = ai_data.get("category"), ai_data.get("tags")
+        embedding, passages = ai_service.embed_note(note.content)
+        record_enrichment_stat("dedup_misses")
+
+    note_service.save_ai_results([{
+        "note_id": note.id, "category": category, "tags": tags, "embedding": embedding,
+        "embedding_model": ai_service.embedding_model, "ai_provider": ai_service.embedding_provider,
+        "passages": passages
+    }])
+    return donor is not None
+
+@JOB_RUN_SECONDS.time(job="process_note_ai")
+def process_note_ai(note_id: int, ai_service: AIService = None):
     """
     Background task to process AI for a note.
+    The note is claimed with one conditional UPDATE and its results are written with
+    the final status in one transaction. The session comes from the process-wide pool
+    and the AIService, with its SDK clients, is shared by every job of this worker.
+    ai_service overrides the configured provider (benchmark.py passes an offline fake).
     """
     logger.info(f"Processing note {note_id}...")
+    observe_job_wait("process_note_ai")
     
-    # Create new DB session for this task
     db = next(get_db())
     note_service = NoteService(db)
-    ai_service = AIService()
+    ai_service = ai_service or get_ai_service()
+    claimed = []
     
     try:
-        # Get note content
-        note = note_service.get_note_by_id(note_id)
-        if not note:
-            logger.error(f"Note {note_id} not found.")
+        claimed = note_service.claim_notes([note_id])
+        if not claimed:
+            logger.info(f"Note {note_id} not found, already processed or claimed by another worker.")
             return
+        publish_status([note_id], "processing")
 
-        # Update status to processing
-        note_service.update_note_status(note_id, "processing")
-
-        # Process
-        content = note.content
-        
-        # Note: Worker needs to pick up the correct provider. 
-        # Since Config is loaded at start, dynamic changes in UI might not propagate to worker 
-        # unless passed as arguments or stored in DB/Redis.
-        # For this phase, we assume the worker uses the default .env Config or we'd need to enhance architecture.
-        # To make it robust, we'll instantiate AIService inside the task, which reads Config.
-        # But Config.AI_PROVIDER is static from env. 
-        # IMPROVEMENT: Pass provider in the job arguments if per-request provider is needed.
-        
-        ai_data = ai_service.classify_and_tag(content)
-        embedding = ai_service.generate_embedding(content)
-        
-        # Save results
-        note_service.update_note_ai_data(
-            note_id=note.id,
-            category=ai_data.get("category"),
-            tags=ai_data.get("tags"),
-            embedding=embedding
-        )
-        
-        # Update status to completed
-        note_service.update_note_status(note_id, "completed")
-        logger.info(f"Note {note_id} processed successfully.")
+        # Process and save results (reusing a duplicate's results when possible)
+        reused = enrich_note(note_service, ai_service, claimed[0])
+        publish_status([note_id], "completed")
+        logger.info(f"Note {note_id} processed successfully{' (reused duplicate results)' if reused else ''}.")
         
+    except AIProviderError as e:
+        db.rollback()
+        job = get_current_job()
+        if job is not None and job.retries_left:
+            # Let RQ put the job back on the queue instead of storing a fallback
+            logger.warning(f"Provider error on note {note_id}, requeueing ({job.retries_left} retries left): {e}")
+            note_service.set_notes_status([note_id], "pending", from_status="processing")
+            publish_status([note_id], "pending")
+            raise
+        logger.error(f"Error processing note {note_id}: {e}")
+        note_service.set_notes_status([note_id], "failed", from_status="processing")
+        publish_status([note_id], "failed")
     except Exception as e:
         logger.error(f"Error processing note {note_id}: {e}")
-        note_service.update_note_status(note_id, "failed")
+        db.rollback()
+        if claimed:
+            note_service.set_notes_status([note_id], "failed", from_status="processing")
+            publish_status([note_id], "failed")
     finally:
         db.close()
 
-if __name__ == '__main__':
+def requeue_notes(note_service: NoteService, note_ids: list):
+    """
+    Put notes this worker claimed that hit provider errors back on the batching
+    queue after a backoff; notes no longer "processing" are left alone.
+    Notes that used up Config.AI_JOB_RETRIES are marked failed. Returns the failed ids.
+    Inside an RQ job the backoff is the job's own retry policy (only the batching
+    workers drain the delayed set): the notes go back to pending and AIProviderError
+    is raised so RQ schedules the retry, or they fail once the job has no retries left.
+    """
+    if not note_ids:
+        return []
+    job = get_current_job()
+    if job is not None:
+        if job.retries_left:
+            note_service.set_notes_status(note_ids, "pending", from_status="processing")
+            publish_status(note_ids, "pending")
+            raise AIProviderError(f"Provider errors on notes {note_ids}, retrying the job "
+                                  f"({job.retries_left} retries left)")
+        note_service.set_notes_status(note_ids, "failed", from_status="processing")
+        publish_status(note_ids, "failed")
+        return list(note_ids)
+    retry, failed = [], []
+    now = time.time()
+    for note_id in note_ids:
+        attempts = redis_client.hincrby(BATCH_ATTEMPTS_KEY, note_id, 1)
+        if attempts > Config.AI_JOB_RETRIES:
+            redis_client.hdel(BATCH_ATTEMPTS_KEY, note_id)
+            failed.append(note_id)
+        else:
+            redis_client.zadd(BATCH_DELAYED_KEY, {note_id: now + min(600, 30 * 2 ** (attempts - 1))})
+            retry.append(note_id)
+    note_service.set_notes_status(retry, "pending", from_status="processing")
+    note_service.set_notes_status(failed, "failed", from_status="processing")
+    publish_status(retry, "pending")
+    publish_status(failed, "failed")
+    if retry:
+        logger.warning(f"Requeued {len(retry)} notes after provider errors.")
+    return failed
+
+def promote_delayed_notes():
+    """Move notes whose backoff has expired from the delayed set back to the queue."""
+    for note_id in redis_client.zrangebyscore(BATCH_DELAYED_KEY, "-inf", time.time()):
+        # Only the worker whose ZREM succeeds pushes it, so replicas don't duplicate ids
+        if redis_client.zrem(BATCH_DELAYED_KEY, note_id):
+            redis_client.hset(BATCH_ENQUEUED_KEY, note_id, time.time())
+            redis_client.rpush(BATCH_PENDING_KEY, note_id)
+
+@JOB_RUN_SECONDS.time(job="process_note_batch")
+def process_note_batch(note_ids: list, concurrent: bool = False):
+    """
+    Enrich several notes and write them back in one transaction.
+    concurrent=False: classify one by one, then batched embeddings requests
+    (long notes contribute one input per passage).
+    concurrent=True: classify + embed every note concurrently on the async clients,
+    up to Config.AI_CONCURRENCY notes in flight.
+    An error on one note only fails that note.
+    """
+    logger.info(f"Processing batch of {len(note_ids)} notes...")
+    observe_job_wait("process_note_batch")
+    db = next(get_db())
+    note_service = NoteService(db)
+    claimed_ids = []
+
+    try:
+        items = [tuple(row) for row in note_service.claim_notes(note_ids)]
+        claimed_ids = [note_id for note_id, _, _ in items]
+        for note_id in set(note_ids) - set(claimed_ids):
+            logger.info(f"Note {note_id} not found, already processed or claimed by another worker.")
+        if not items:
+            return
+        try:
+            ai_service = get_ai_service().for_space(note_service.active_space())
+        except AIProviderError as e:
+            logger.warning(f"{e}; requeueing batch")
+            requeue_notes(note_service, claimed_ids)
+            return
+        publish_status(claimed_ids, "processing")
+
+        results, failed, retry, pending = [], [], [], []
+        for note_id, content, content_hash in items:
+            try:
+                donor = find_donor(note_service, ai_service, note_id, content_hash)
+            except Exception as e:
+                logger.error(f"Error processing note {note_id}: {e}")
+                failed.append(note_id)
+                continue
+            if donor:
+                record_enrichment_stat("dedup_hits")
+                results.append({
+                    "note_id": note_id, "category": donor.category, "tags": donor.tags,
+                    "embedding": donor.embedding, "embedding_model": ai_service.embedding_model,
+                    "ai_provider": ai_service.embedding_provider,
+                    "passages": note_service.get_passages(donor.id, ai_service.embedding_space)
+                })
+            else:
+                record_enrichment_stat("dedup_misses")
+                pending.append((note_id, content))
+
+        if concurrent:
+            enriched = worker_event_loop().run_until_complete(
+                ai_service.aenrich_many([content for _, content in pending], close_clients=False))
+        else:
+            classified = []
+            for note_id, content in pending:
+                try:
+                    classified.append((note_id, content, ai_service.classify_and_tag(content)))
+                except AIProviderError as e:
+                    logger.warning(f"Classification failed for note {note_id}: {e}")
+                    retry.append(note_id)
+            embedded = ai_service.embed_notes([content for _, content, _ in classified])
+            pending = [(note_id, content) for note_id, content, _ in classified]
+            enriched = [(ai_data,) + outcome if outcome is not None else None
+                        for (_, _, ai_data), outcome in zip(classified, embedded)]
+
+        for (note_id, _), outcome in zip(pending, enriched):
+            if outcome is None:
+                retry.append(note_id)
+                continue
+            ai_data, embedding, passages = outcome
+            results.append({
+                "note_id": note_id, "category": ai_data.get("category"), "tags": ai_data.get("tags"),
+                "embedding": embedding, "embedding_model": ai_service.embedding_model,
+                "ai_provider": ai_service.embedding_provider, "passages": passages
+            })
+
+        note_service.save_ai_results(results, failed)
+        publish_status([r["note_id"] for r in results], "completed")
+        publish_status(failed, "failed")
+        if results:
+            redis_client.hdel(BATCH_ATTEMPTS_KEY, *[r["note_id"] for r in results])
+        failed += requeue_notes(note_service, retry)
+        logger.info(f"Batch done: {len(results)} completed, {len(retry)} retrying, {len(failed)} failed.")
+
+    except AIProviderError as e:
+        # Raised by requeue_notes for RQ's retry; the notes are already back to pending
+        logger.warning(str(e))
+        raise
+    except Exception as e:
+        logger.error(f"Error processing batch {note_ids}: {e}")
+        db.rollback()
+        note_service.set_notes_status(claimed_ids, "failed", from_status="processing")
+        publish_status(claimed_ids, "failed")
+    finally:
+        db.close()
+
+def enqueue_enrichment(note_ids: list, chunk_size: int = None, queue: str = BULK_QUEUE):
+    """
+    Hand notes to the workers in chunks rather than one job per note. queue is
+    BULK_QUEUE for imports and backfills, INTERACTIVE_QUEUE for notes a user just saved.
+    """
+    if not note_ids:
+        return
+    if Config.WORKER_MODE in ("batch", "async"):
+        now = time.time()
+        pipe = redis_client.pipeline()
+        for note_id in note_ids:
+            pipe.hsetnx(BATCH_ENQUEUED_KEY, note_id, now)
+        pipe.rpush(BATCH_QUEUES[queue], *note_ids)
+        pipe.execute()
+        return
+    chunk_size = chunk_size or Config.EMBED_BATCH_SIZE
+    q = Queue(queue, connection=redis_binary_client)
+    for start in range(0, len(note_ids), chunk_size):
+        q.enqueue(process_note_batch, note_ids[start:start + chunk_size], retry=job_retry())
+
+def queue_stats(mode: str = None):
+    """
+    {queue: {"depth", "oldest_seconds"}} for the queues of mode (Config.WORKER_MODE by
+    default): RQ jobs, or note ids waiting for the batching workers.
+    """
+    now = time.time()
+    stats = {}
+    if (mode or Config.WORKER_MODE) in ("batch", "async"):
+        for name, key in BATCH_QUEUES.items():
+            first = redis_client.lindex(key, 0)
+            queued_at = redis_client.hget(BATCH_ENQUEUED_KEY, first) if first is not None else None
+            stats[name] = {"depth": redis_client.llen(key),
+                           "oldest_seconds": max(0.0, now - float(queued_at)) if queued_at else 0.0}
+        return stats
+    for name in listen:
+        q = Queue(name, connection=redis_binary_client)
+        job_ids = q.get_job_ids(0, 1)
+        job = q.fetch_job(job_ids[0]) if job_ids else None
+        oldest = 0.0
+        if job is not None and job.enqueued_at is not None:
+            enqueued_at = job.enqueued_at
+            if enqueued_at.tzinfo is None:
+                enqueued_at = enqueued_at.replace(tzinfo=datetime.timezone.utc)  # RQ stores naive UTC
+            oldest = max(0.0, now - enqueued_at.timestamp())
+        stats[name] = {"depth": q.count, "oldest_seconds": oldest}
+    return stats
+
+_stopping = threading.Event()
+
+def request_stop(signum=None, frame=None):
+    """SIGTERM handler of the batching worker: finish the batch in hand, then exit."""
+    _stopping.set()
+
+def take_next_note(processing_key: str, timeout: float):
+    """
+    Move the next queued note id to processing_key, interactive notes first, waiting up
+    to timeout seconds for one. The wait is on the interactive list only, so an idle
+    worker picks up a bulk note at most one timeout late. Returns (queue, note id) or None.
+    """
+    for name, key in BATCH_QUEUES.items():
+        item = redis_client.lmove(key, processing_key, "LEFT", "RIGHT")
+        if item is not None:
+            return name, item
+    if timeout > 0:
+        item = redis_client.blmove(BATCH_INTERACTIVE_KEY, processing_key, timeout, "LEFT", "RIGHT")
+        if item is not None:
+            return INTERACTIVE_QUEUE, item
+    return None
+
+def run_batch_worker(batch_size: int = None, max_wait_ms: int = None, concurrent: bool = False, slot: int = None):
+    """
+    Drain up to batch_size note ids from the batching queues, interactive before bulk,
+    waiting at most max_wait_ms after the first one arrives, then process them together.
+    Claimed ids sit in a per-host (per-slot under supervisor.py) processing list until
+    the batch is written, so a crashed worker's batch is requeued, and its notes
+    released, on restart. SIGTERM stops it between batches.
+    """
+    batch_size = batch_size or Config.EMBED_BATCH_SIZE
+    max_wait = (max_wait_ms or Config.EMBED_BATCH_WAIT_MS) / 1000
+    processing_key = f"{BATCH_PENDING_KEY}:processing:{socket.gethostname()}"
+    if slot:
+        processing_key += f":{slot}"
+
+    recovered = []
+    while True:
+        note_id = redis_client.lmove(processing_key, BATCH_PENDING_KEY, "RIGHT", "LEFT")
+        if note_id is None:
+            break
+        recovered.append(int(note_id))
+    if recovered:
+        # Our previous run died holding these claims; don't wait for AI_CLAIM_TIMEOUT
+        db = next(get_db())
+        try:
+            NoteService(db).release_claims(recovered)
+            publish_status(recovered, "pending")
+        finally:
+            db.close()
+    logger.info(f"Batch worker listening on {', '.join(BATCH_QUEUES.values())} "
+                f"(size {batch_size}, wait {max_wait * 1000:.0f} ms)")
+
+    signal.signal(signal.SIGTERM, request_stop)
+    while not _stopping.is_set():
+        promote_delayed_notes()
+        first = take_next_note(processing_key, 1)
+        if first is None:
+            continue
+        batch = [first]
+        deadline = time.monotonic() + max_wait
+        while len(batch) < batch_size:
+            item = take_next_note(processing_key, deadline - time.monotonic())
+            if item is None:
+                break
+            batch.append(item)
+        observe_batch_wait(batch)
+        process_note_batch([int(note_id) for _, note_id in batch], concurrent=concurrent)
+        redis_client.delete(processing_key)
+    logger.info("Batch worker stopped.")
+
+def request_purge(everything: bool = False):
+    """Ask the workers to purge expired notes from the recycle bin, or all of them."""
+    if everything:
+        redis_client.set(RETENTION_REQUEST_KEY, "all")
+    else:
+        redis_client.set(RETENTION_REQUEST_KEY, "expired", nx=True)
+
+def forget_notes(note_ids: list):
+    """Drop purged notes from the batching queue's bookkeeping."""
+    if not note_ids:
+        return
+    pipe = redis_client.pipeline()
+    pipe.hdel(BATCH_ATTEMPTS_KEY, *note_ids)
+    pipe.hdel(BATCH_ENQUEUED_KEY, *note_ids)
+    pipe.zrem(BATCH_DELAYED_KEY, *note_ids)
+    pipe.execute()
+
+def purge_deleted_notes(days: int = None, batch_size: int = None, pause_ms: int = None):
+    """
+    Permanently delete notes soft-deleted more than `days` ago (all of them when days
+    is None), batch_size at a time in id order, pausing pause_ms between batches so
+    the app's writes are not queued behind one long DELETE.
+    Returns {"rows", "batches", "lock_seconds", "seconds"}.
+    """
+    batch_size = batch_size or Config.PURGE_BATCH_SIZE
+    pause = (Config.PURGE_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days) if days is not None else None
+    report = {"rows": 0, "batches": 0, "lock_seconds": 0.0}
+    start = time.perf_counter()
+    db = next(get_db())
+    note_service = NoteService(db)
+    try:
+        after_id = 0
+        while True:
+            batch_start = time.perf_counter()
+            purged = note_service.purge_deleted_batch(cutoff, after_id, batch_size)
+            if not purged:
+                break
+            elapsed = time.perf_counter() - batch_start
+            PURGE_BATCH_SECONDS.observe(elapsed)
+            PURGED_ROWS.inc(len(purged))
+            report["rows"] += len(purged)
+            report["batches"] += 1
+            report["lock_seconds"] += elapsed
+            after_id = purged[-1]
+            try:
+                forget_notes(purged)
+            except Exception as e:
+                logger.warning(f"Could not clear queue state of purged notes: {e}")
+            if len(purged) < batch_size:
+                break
+            time.sleep(pause)
+    finally:
+        db.close()
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+def pending_retention():
+    """"all" or "expired" when the app asked for a purge, "scheduled" when one is due, else None."""
+    requested = redis_client.get(RETENTION_REQUEST_KEY)
+    if requested:
+        return requested
+    last_run = redis_client.hget(RETENTION_REPORT_KEY, "finished_at")
+    if Config.RETENTION_INTERVAL and (last_run is None or time.time() - float(last_run) >= Config.RETENTION_INTERVAL):
+        return "scheduled"
+    return None
+
+def run_retention():
+    """
+    Purge the recycle bin when the app asked for it or Config.RETENTION_INTERVAL has
+    passed since the last purge, on one worker at a time. Returns the report, or None.
+    """
+    mode = pending_retention()
+    if mode is None:
+        redis_client.delete(RETENTION_QUEUED_KEY)
+        return None
+    if not redis_client.set(RETENTION_LOCK_KEY, socket.gethostname(), nx=True, ex=3600):
+        return None
+    try:
+        # Taken now, so a request made while this purge runs gets its own run
+        redis_client.delete(RETENTION_REQUEST_KEY)
+        report = purge_deleted_notes(None if mode == "all" else Config.RETENTION_DAYS)
+        report.update(mode=mode, finished_at=time.time())
+        redis_client.hset(RETENTION_REPORT_KEY, mapping=report)
+        logger.info(f"Retention purge ({report['mode']}): {report['rows']} notes in {report['batches']} batches, "
+                    f"{report['lock_seconds']:.2f}s holding locks, {report['seconds']:.1f}s total.")
+        return report
+    finally:
+        redis_client.delete(RETENTION_LOCK_KEY, RETENTION_QUEUED_KEY)
+
+def run_related_refresh():
+    """
+    Update the related-notes graph (rebuilding it when a rebuild is due) on one worker
+    at a time, and log near-duplicates among the changed notes. Returns the report, or None.
+    """
+    if not related_refresh_due():
+        redis_client.delete(RELATED_QUEUED_KEY)
+        return None
+    if not redis_client.set(RELATED_LOCK_KEY, socket.gethostname(), nx=True, ex=3600):
+        return None
+    db = next(get_db())
+    try:
+        report = refresh_related_notes(db)
+        if report["mode"] == "rebuild":
+            logger.info(f"Related notes rebuilt: {report['notes']} notes in {report['seconds']:.1f}s "
+                        f"(processes: {report['workers']}).")
+        elif report["rewritten"]:
+            logger.info(f"Related notes: {report['changed']} changed, {report['removed']} removed, "
+                        f"{report['rewritten']} lists rewritten in {report['seconds']:.2f}s.")
+        for note_id, other, score in report.get("near_duplicates", []):
+            logger.info(f"Note {note_id} looks like a near-duplicate of note {other} (similarity {score:.3f}).")
+        return report
+    finally:
+        db.close()
+        redis_client.delete(RELATED_LOCK_KEY, RELATED_QUEUED_KEY)
+
+# (job, whether it has work, key set while it waits on the maintenance queue)
+MAINTENANCE_JOBS = [
+    (run_retention, pending_retention, RETENTION_QUEUED_KEY),
+    (run_related_refresh, related_refresh_due, RELATED_QUEUED_KEY),
+]
+
+def schedule_maintenance(job, pending, queued_key: str):
+    """
+    Put one job on the maintenance queue when it has work, so in RQ mode it only runs
+    once the interactive and bulk queues are empty.
+    """
+    if pending() and redis_client.set(queued_key, 1, nx=True, ex=3600):
+        Queue(MAINTENANCE_QUEUE, connection=redis_binary_client).enqueue(job)
+
+def maintenance_loop(mode: str, poll_seconds: int = 10):
+    while True:
+        for job, pending, queued_key in MAINTENANCE_JOBS:
+            try:
+                if mode in ("batch", "async"):
+                    job()
+                else:
+                    schedule_maintenance(job, pending, queued_key)
+            except Exception as e:
+                logger.error(f"{job.__name__} failed: {e}")
+        time.sleep(poll_seconds)
+
+def start_maintenance_thread(mode: str = None):
+    """
+    Run retention purges and related-notes updates (batching workers) or queue them as
+    maintenance jobs (RQ) from a daemon thread of this process.
+    """
+    threading.Thread(target=maintenance_loop, args=(mode or Config.WORKER_MODE,), name="maintenance", daemon=True).start()
+
+def run_worker(mode: str = None, batch_size: int = None, max_wait_ms: int = None, slot: int = None):
+    """
+    Serve the queues until stopped: mode "rq", "batch" or "async" (Config.WORKER_MODE
+    by default). slot numbers a process of supervisor.py's pool.
+    """
+    mode = mode or Config.WORKER_MODE
+    if mode in ("batch", "async"):
+        run_batch_worker(batch_size, max_wait_ms, concurrent=mode == "async", slot=slot)
+        return
     conn = redis.from_url(f"redis://{Config.REDIS_HOST}:{Config.REDIS_PORT}/{Config.REDIS_DB}")
     with Connection(conn):
-        worker = Worker(map(Queue, listen))
-        worker.work()
+        # SimpleWorker runs jobs in this process instead of forking a child per job, so
+        # the DB pool, SDK clients, indexes and /metrics counters outlive each job.
+        # SIGTERM is a warm shutdown: the job in hand finishes first.
+        worker = SimpleWorker(map(Queue, listen))
+        # The scheduler runs the delayed retries of jobs that hit provider errors
+        worker.work(with_scheduler=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Knowledge Hub background worker")
+    parser.add_argument("--batch", action="store_true", help="Coalesce queued notes into batched provider calls")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Like --batch, but classify and embed queued notes concurrently")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--max-wait-ms", type=int, default=None)
+    args = parser.parse_args()
+    start_metrics_server(Config.WORKER_METRICS_PORT, Config.METRICS_HOST)
+    mode = "async" if args.use_async else "batch" if args.batch else Config.WORKER_MODE
+    start_maintenance_thread(mode)
+    run_worker(mode, args.batch_size, args.max_wait_ms)